@@ -15,7 +15,7 @@ from tomo_recon import astra_recon
 
 # %% Define the folders
 path = r'C:\Users\andykiss\Documents\tmp_work_dir\Sandia\rad1\20170725_134911_rad1-processing\bim\sinos'
-ext = '.binsino'
+ext = '.binsino'  # '.binsino' or '.binsinovol'
 
 # ASTRA settings
 alg = 'FBP_CUDA'
@@ -23,6 +23,15 @@ alg_iter = 100
 px = 1.0
 flag_matlab_crop = True
 
+# True -- Write the slices into a single volume (recon.mhd and recon.raw)
+# False -- Write a binslice file for each slice
+flag_volume = True
+
+# True -- Skip the slices that were already reconstructed (manifest.json in
+#         the output folder) from the same sinograms
+# False -- Reconstruct every slice again
+flag_resume = True
+
 
 # %% Get the files
 if (path[-1] != '\\' and path[-1] != '/'):
@@ -35,6 +44,14 @@ for fn in ls:
 
 N = len(ls)
 
+# A binsinovol file holds all the sinograms, so open it once
+flag_vol = (ext == '.binsinovol')
+if (flag_vol):
+    (vol, th) = txm_image.formats.binsino.open_binsinovol(path+ls[0])
+    (storage, scale, offset) = \
+        txm_image.formats.binsino.read_binsinovol_storage(path+ls[0])
+    N = vol.shape[0]
+
 
 # %% Start reconstructing
 # Make output directories
@@ -45,22 +62,74 @@ outdir = outdir + alg + os.sep
 if (not os.path.isdir(path + outdir)):
     os.mkdir(path + outdir)
 
+# Manifest of the finished slices (changing a setting starts again)
+params = {'alg': alg, 'alg_iter': alg_iter, 'px': px,
+          'flag_matlab_crop': flag_matlab_crop, 'flag_volume': flag_volume}
+ckpt = txm_image.checkpoint(path + outdir + 'manifest.json', 'slices',
+                            params)
+if (not flag_resume):
+    ckpt.reset()
+
+# The output of each slice and the sinogram file it is made from
+fn_out = []
+fn_in = []
+for i in range(N):
+    if (flag_volume):
+        fn_out.append(path + outdir + 'recon.mhd:%06d' % (i))
+    elif (flag_vol):
+        fn_out.append(path + outdir + '_%06d.binslice' % (i+1))
+    else:
+        ind = ls[i].find(ext)
+        fn_out.append(path + outdir + ls[i][0:ind] + '.binslice')
+    fn_in.append([path + ls[0]] if (flag_vol) else [path + ls[i]])
+
+# Only create a new volume if none of its slices are finished
+flag_done = [ckpt.is_done(fn_out[i], fn_in[i]) for i in range(N)]
+flag_new = (not os.path.isfile(path + outdir + 'recon.mhd') or
+            not any(flag_done))
+
 for i in range(N):
     print('Reconstrucing file (%04i/%04i)...' % (i+1, N), end='')
+    # Skip the finished slices
+    if (flag_done[i]):
+        print('done')
+        continue
+
     # Load the file
-    (sino, th) = txm_image.read_file(path+ls[i], verbose=False)
+    if (flag_vol):
+        sino = vol[i]
+        if (storage != 'float32'):
+            sino = txm_image.formats.precision.decode(sino, storage, scale,
+                                                      offset)
+        sino = sino.T
+    else:
+        (sino, th) = txm_image.read_file(path+ls[i], verbose=False)
 
     # Reconstruct the file
     V = astra_recon(sino.T, th, algorithm=alg, num_iter=alg_iter,
                     px=px, flag_matlab_crop=flag_matlab_crop)
 
+    # Save the slice into the volume
+    if (flag_volume):
+        if (flag_new):
+            txm_image.formats.volume.create_volume(path+outdir+'recon.mhd',
+                                                   (N, ) + V.shape, px=px)
+            flag_new = False
+        txm_image.formats.volume.write_volume_slice(path+outdir+'recon.mhd',
+                                                    i, V)
+        ckpt.done(fn_out[i], fn_in[i], flag_file=False)
+        print('done')
+        continue
+
     # Save the file
-    ind = ls[i].find(ext)
-    fn = ls[i][0:ind] + '.binslice'
-    txm_image.write_file(path+outdir+fn, V, verbose=False)
+    txm_image.write_file(fn_out[i], V, verbose=False)
+    ckpt.done(fn_out[i], fn_in[i])
 
     print('done')
 
+# Write the manifest
+ckpt.save()
+
 
 # %% Complete
 print('\nBatch reconstruction complete.\n')
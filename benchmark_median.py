@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark median
+
+Time the histogram median filter (image_handling.median_filter_hist) against
+the SciPy median filter for a range of window widths, on a synthetic
+projection, and check that both give the same median and the same outlier
+removal. The projection is made like a detector image: Poisson counts of a
+flat beam through an absorbing object, with clusters of bright outliers. It
+is tested as uint16 (the detector data) and as float32 (after it is read
+into a float stack), which have thousands of distinct values.
+
+Parameters
+----------
+shape -- tuple of integers
+    the (height, width) of the test image
+counts -- float
+    the mean counts of the flat beam
+window -- list of integers
+    the widths of the median window to time
+N_runs -- integer
+    the number of times each filter is timed (the fastest run is used)
+
+"""
+
+
+# %% Import modules
+import time
+import numpy as np
+import scipy.ndimage
+import image_handling
+
+
+# %% User parameters
+shape = (1024, 1024)
+counts = 3000
+window = [3, 5, 7, 9, 11, 15, 21]
+N_runs = 3
+
+
+# %% Make a test image
+# Poisson counts through a smooth object, with clusters of bright outliers
+rng = np.random.default_rng(0)
+(y, x) = np.mgrid[:shape[0], :shape[1]] / float(max(shape))
+mu = 0.8 * np.exp(-((y - 0.5)**2 + (x - 0.4)**2) / 0.2**2)
+img = rng.poisson(counts * np.exp(-mu)).astype(np.float64)
+ind = rng.integers(0, shape[0] * shape[1], size=(shape[0] * shape[1]) // 500)
+img.flat[ind] += 4000
+img = scipy.ndimage.grey_dilation(img, size=(2, 2))
+images = {'uint16': img.astype(np.uint16), 'float32': img.astype(np.float32)}
+
+
+# %% Time the filters
+def best_time(func):
+    t = []
+    for i in range(N_runs):
+        t0 = time.perf_counter()
+        out = func()
+        t.append(time.perf_counter() - t0)
+    return min(t), out
+
+
+for (name, img) in images.items():
+    print('\n%s image %dx%d with %d distinct values.' %
+          (name, shape[0], shape[1], len(np.unique(img))))
+    print('%8s %12s %12s %8s %8s %8s' % ('window', 'scipy (s)', 'hist (s)',
+                                         'speedup', 'median', 'outliers'))
+    for L in window:
+        # Time the hist median without the SciPy fallback for narrow windows
+        (t_scipy, a) = best_time(lambda: scipy.ndimage.median_filter(
+            img, size=L))
+        (t_hist, b) = best_time(lambda: image_handling.median_filter_hist(
+            img, size=L, min_size=0))
+
+        # Check the outlier removal
+        c = image_handling.remove_outliers_scipy_stack(img, delta=200,
+                                                       radius=L)
+        d = image_handling.remove_outliers_scipy_stack(img, delta=200,
+                                                       radius=L,
+                                                       method='histogram')
+        print('%8d %12.3f %12.3f %8.2f %8s %8s' % (
+            L, t_scipy, t_hist, t_scipy / t_hist, np.array_equal(a, b),
+            np.array_equal(c, d)))
@@ -36,34 +36,106 @@ wf_sig = 2.0
 # Output directory
 outdir = 'sinos' + os.sep
 
+# True -- Write all the sinograms to a single binsinovol file
+# False -- Write a binsino file for each detector row
+flag_sinovol = False
+
+# Storage of the binsinovol file ('float32', 'float16', or 'uint16')
+storage = 'float32'
+
+# The scale and offset of uint16 values (value = stored * scale + offset);
+# None fits them to the range of the sinograms, which is only possible when
+# they are all in memory (they must be given with flag_out_of_core)
+scale = None
+offset = None
+
+# True -- Read the projections in bands of rows that fit in the memory
+#         budget instead of loading them all
+# False -- Load all the projections into memory
+flag_out_of_core = False
+memory = 16 * 1024**3
+
+# True -- Skip writing the sinograms if they are up to date (manifest.json in
+#         the output directory)
+# False -- Write the sinograms again
+flag_resume = True
+
+
+# %% Check the settings
+if (flag_out_of_core and flag_sinovol and storage == 'uint16' and
+        (scale is None or offset is None)):
+    raise ValueError('The scale and offset are needed for uint16 sinograms '
+                     'with flag_out_of_core.')
+
 
 # %% Find the files
 if (root[-1] != '\\' and root[-1] != '/'):
     root += os.sep
 
-ls = os.listdir(root)
-for fn in ls:
-    if (not fn.endswith(ext)):
-        ls.remove(fn)
-N = len(ls)
+# Read the headers to get the angles and the projection size
+hdr = txm_image.scan_headers(root, ext, verbose=False)
+N = len(hdr)
+th = np.array(hdr['MotPos'][:, 3], dtype=np.float32)
+row = int(hdr['height'][0])
+col = int(hdr['width'][0])
+
+# Check if the sinograms are already finished
+if (not os.path.isdir(root + outdir)):
+    os.mkdir(root + outdir)
+params = {'rot_axis': rot_axis, 'flag_ring_removal': flag_ring_removal,
+          'wf_str': wf_str, 'wf_N': wf_N, 'wf_sig': wf_sig,
+          'flag_sinovol': flag_sinovol, 'storage': storage, 'scale': scale,
+          'offset': offset}
+ckpt = txm_image.checkpoint(root + outdir + 'manifest.json', 'sinograms',
+                            params)
+if (flag_sinovol):
+    fn_out = root + outdir + 'sinos.binsinovol'
+    fn_sino = [fn_out]
+else:
+    fn_out = root + outdir + '_%06d.binsino'
+    fn_sino = [fn_out % (i + 1) for i in range(row)]
+fn_in = list(hdr['fn'])
+if (flag_resume and all([ckpt.is_done(fn, fn_in) for fn in fn_sino])):
+    print('The sinograms are up to date.')
+    raise SystemExit
+
+
+# %% Write the sinograms in bands of rows
+if (flag_out_of_core):
+    # Ring removal filter for each sinogram
+    def filter_sino(sino):
+        sino_f = image_handling.wf_filter(sino, N_levels=wf_N,
+                                          waveletName=wf_str, sigma=wf_sig,
+                                          pad=10, forceZero=True)
+        return sino_f[0:sino.shape[0], 0:sino.shape[1]]
+
+    # Find the shift of the rotation axis
+    shift = int(np.round((col / 2) - rot_axis))
 
+    # Transpose the projections
+    txm_image.projections_to_sinograms(
+        list(hdr['fn']), fn_out, th, memory=memory, shift=shift,
+        func=filter_sino if (flag_ring_removal) else None,
+        storage=None if (storage == 'float32') else storage, scale=scale,
+        offset=offset, verbose=True)
 
-# %% Load the files
-# Load the first file to get projection size
-I, meta = txm_image.read_file(root + ls[0], verbose=False)
-row, col = np.shape(I)
-th = np.array([], dtype=np.float32)
-th = np.append(th, meta.MotPos[3])
+    # Record the finished sinograms
+    for fn in fn_sino:
+        ckpt.done(fn, fn_in)
+    ckpt.save()
+
+    print('\nCreating sinograms complete.\n')
+    raise SystemExit
 
+
+# %% Load the files
 # Initialize the projection array
 proj = np.empty((N, row, col), dtype=np.float32)
-proj[0, :, :] = I
 
 # Load the files
-for i in range(1, N):
-    I, meta = txm_image.read_file(root + ls[i], verbose=False)
+for i in range(N):
+    I, _ = txm_image.read_file(hdr['fn'][i], verbose=False)
     proj[i, :, :] = I
-    th = np.append(th, meta.MotPos[3])
 
 # Cleanup
 del I
@@ -111,17 +183,24 @@ print('done')
 
 
 # %% Export sinograms
-# Make a processing directory if it does not exist
-try:
-    os.stat(root + outdir)
-except:
-    os.mkdir(root + outdir)
-
-for i in range(row):
-    fn = '_%06d.binsino' % (i+1)
-    print('Writing sinogram (%04d/%04d)...' % (i+1, row), end='')
-    txm_image.write_file(root+outdir+fn, proj[:, i, :].T, th, verbose=False)
+if (flag_sinovol):
+    print('Writing sinogram volume...', end='')
+    txm_image.formats.binsino.write_binsinovol(
+        fn_out, proj.transpose(1, 2, 0), th,
+        storage=storage, scale=scale, offset=offset)
     print('done')
+else:
+    for i in range(row):
+        fn = '_%06d.binsino' % (i+1)
+        print('Writing sinogram (%04d/%04d)...' % (i+1, row), end='')
+        txm_image.write_file(root+outdir+fn, proj[:, i, :].T, th,
+                             verbose=False)
+        print('done')
+
+# Record the finished sinograms
+for fn in fn_sino:
+    ckpt.done(fn, fn_in)
+ckpt.save()
 
 
 # %% Finish script
@@ -40,11 +40,9 @@ for i in range(len(fn_rm)):
 
 # Get image sizes and calculate offsets
 N = np.size(fn)
-(img, meta) = txm_image.read_file(path + fn[ind], verbose=False)
-# X = np.round(meta.width / 2.0 + delx)
-# Y = meta.height // 2
-X = np.round(612 / 2.0 + delx)
-Y = 512 // 2
+hdr = txm_image.read_header(path + fn[ind], verbose=False)
+X = np.round(hdr['width'] / 2.0 + delx)
+Y = int(hdr['height']) // 2
 Y_new = Y * np.ones((N, ), dtype=np.float)
 offset = (dely / np.float(N - 1)) * np.linspace(0, N-1, num=N, dtype=np.float)
 Y_new = np.round(Y_new + offset)
@@ -11,7 +11,7 @@ Parameters
 path -- string
     folder location of the sinograms
 fn_ext -- string
-    filename extension for the sinograms (*.tif, *.binsino)
+    filename extension for the sinograms (*.tif, *.binsino, *.binsinovol)
 
 Returns
 -------
@@ -24,10 +24,8 @@ Returns
 # %% Import modules
 import numpy as np
 import os
-import matplotlib.pyplot as plt
 import txm_image
 import image_handling
-from tomo_recon import astra_recon
 
 
 # %% Set parameters
@@ -70,6 +68,14 @@ for i in range(len(ls_rm)):
     ls_dir.remove(ls_rm[i])
 num = len(ls_dir)
 
+# A binsinovol file holds all the sinograms, so open it once
+flag_vol = (fn_ext == '.binsinovol')
+if (flag_vol and num > 0):
+    (vol, th) = txm_image.formats.binsino.open_binsinovol(path+ls_dir[0])
+    (storage, scale, offset) = \
+        txm_image.formats.binsino.read_binsinovol_storage(path+ls_dir[0])
+    num = vol.shape[0]
+
 if (num == 0):
     print('There were no sinograms found.')
     raise SystemExit
@@ -86,6 +92,13 @@ except:
         print('There was an error creating the export directory.')
         raise SystemExit
 
+# Create the filtered sinogram volume
+if (flag_vol):
+    txm_image.formats.binsino.create_binsinovol(path+out_dir+ls_dir[0],
+                                                vol.shape[0], vol.shape[2], th)
+    (vol_out, _) = txm_image.formats.binsino.open_binsinovol(
+        path+out_dir+ls_dir[0], mode='r+')
+
 # %% Test filtering one image
 test_i = num // 2
 # test_i = ls_proj.index('_00308.binsino')
@@ -94,7 +107,14 @@ test_i = num // 2
 print('Processing test sinogram...', end='')
 
 # Load the sinogram
-(sino, th) = txm_image.read_file(path+ls_dir[test_i], verbose=False)
+if (flag_vol):
+    sino = vol[test_i]
+    if (storage != 'float32'):
+        sino = txm_image.formats.precision.decode(sino, storage, scale,
+                                                  offset)
+    sino = sino.T
+else:
+    (sino, th) = txm_image.read_file(path+ls_dir[test_i], verbose=False)
 
 # Filter the sinogram
 sino_filtered = image_handling.wf_filter(sino.T, N_levels=nLevels,
@@ -110,12 +130,19 @@ sino_filtered = sino_filtered[0:sino_size, :]
 print('done')
 
 # Export the sinogram
-txm_image.write_file(path+out_dir+ls_dir[test_i]+'.binsino',
-                     sino_filtered, th,
-                     verbose=False)
+if (flag_vol):
+    vol_out[test_i] = sino_filtered.T
+else:
+    txm_image.write_file(path+out_dir+ls_dir[test_i]+'.binsino',
+                         sino_filtered, th,
+                         verbose=False)
 
 # Run the reconstruction
 if (flag_recon):
+    # Only load ASTRA and matplotlib when they are needed
+    import matplotlib.pyplot as plt
+    from tomo_recon import astra_recon
+
     print('Reconstructing sinogram...', end='')
     V = astra_recon(sino_filtered.T, th, algorithm=alg)
     # (row, col) = V.shape
@@ -147,7 +174,14 @@ for i in range(num):
     print('Processing sinogram (%04d/%04d)...' % (i+1, num), end='')
 
     # Load the sinogram
-    (sino, th) = txm_image.read_file(path+ls_dir[i], verbose=False)
+    if (flag_vol):
+        sino = vol[i]
+        if (storage != 'float32'):
+            sino = txm_image.formats.precision.decode(sino, storage, scale,
+                                                      offset)
+        sino = sino.T
+    else:
+        (sino, th) = txm_image.read_file(path+ls_dir[i], verbose=False)
 
     # Filter the sinogram
     sino_filtered = image_handling.wf_filter(sino.T, N_levels=nLevels,
@@ -160,9 +194,12 @@ for i in range(num):
     sino_filtered = sino_filtered[0:sino_size, :]
 
     # Export the sinogram
-    txm_image.write_file(path+out_dir+ls_dir[i]+'.binsino',
-                         sino_filtered, th,
-                         verbose=False)
+    if (flag_vol):
+        vol_out[i] = sino_filtered.T
+    else:
+        txm_image.write_file(path+out_dir+ls_dir[i]+'.binsino',
+                             sino_filtered, th,
+                             verbose=False)
 
     # Success
     print('done')
@@ -170,6 +207,9 @@ for i in range(num):
 
 # %% Clean up and exit
 # Clean up some memory
+if (flag_vol):
+    vol_out.flush()
+    del vol, vol_out
 del sino, sino_filtered, th
 
 # Exit
@@ -6,6 +6,10 @@ Image Handling
 This collection of functions will perform operations on NumPy arrays
 (or images).
 
+The functions are imported from their modules the first time they are used,
+so the dependencies of each module (SciPy, scikit-image, PyWavelets) are only
+loaded when they are needed.
+
 Written by: Andy Kiss
 Started: 2017-01-24
 Last modified: 2017-02-15
@@ -16,10 +20,40 @@ __all__ = ['remove_outliers', 'average_image', 'reference_correction']
 __version__ = '0.1'
 __author__ = 'Andy Kiss'
 
-from image_handling.remove_outliers import remove_outliers_scipy
-from image_handling.average_image import average_image_stack
-from image_handling.average_image import median_image_stack
-from image_handling.reference_correction import external_reference
-from image_handling.wavelet_fourier_filter import wf_filter
-from image_handling.resize_image import bin_image
-from image_handling.resize_image import bin_image_stack
\ No newline at end of file
+import importlib
+
+# The module of each function
+_functions = {'remove_outliers_scipy': 'remove_outliers',
+              'remove_outliers_stack': 'remove_outliers',
+              'remove_outliers_scipy_stack': 'remove_outliers',
+              'outlier_scratch': 'remove_outliers',
+              'median_filter_hist': 'median_filter',
+              'average_image_stack': 'average_image',
+              'median_image_stack': 'average_image',
+              'external_reference': 'reference_correction',
+              'external_reference_stack': 'reference_correction',
+              'log_reference': 'reference_correction',
+              'wf_filter': 'wavelet_fourier_filter',
+              'bin_image': 'resize_image',
+              'bin_image_stack': 'resize_image'}
+
+
+def __getattr__(name):
+    if (name in _functions):
+        module = importlib.import_module('image_handling.' +
+                                         _functions[name])
+        return getattr(module, name)
+
+    # The modules themselves (such as image_handling.remove_outliers)
+    try:
+        return importlib.import_module(__name__ + '.' + name)
+    except ModuleNotFoundError as e:
+        if (e.name != __name__ + '.' + name):
+            raise
+    raise AttributeError("module 'image_handling' has no attribute '%s'" %
+                         (name))
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_functions.keys()) +
+                  __all__)
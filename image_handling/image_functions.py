@@ -11,7 +11,8 @@ Last modified: 2017-01-27
 
 
 import numpy as np
-from scipy.ndimage.interpolation import rotate
+from scipy.ndimage import rotate
+from image_handling import resize_image
 
 
 def rotate_image(img, angle):
@@ -47,8 +48,9 @@ def bin_image(img, binning):
     ----------
     img -- 2D NumPy array
         the image to be binned
-    binning -- int
-        the amount to bin the image
+    binning -- int or tuple of integers
+        the amount to bin the image (or the amount in the vertical and
+        horizontal directions)
 
     Returns
     -------
@@ -56,8 +58,8 @@ def bin_image(img, binning):
         the binned image
     """
 
-    # Use SciPy to rotate the image
-    # img_bin = rotate(img, angle)
+    # Average each block of pixels
+    img_bin = resize_image.bin_image(img, B=binning, method='average')
 
     # Return the image
     return img_bin
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+"""
+Median Filter
+
+This function is an exact median filter whose cost grows only slowly with
+the size of the window. The image is first replaced by the rank of each
+value among the distinct values of the image, which loses nothing for
+integer or float data. The window then slides along the columns with a
+running histogram of the ranks of every row of windows (Huang), and the
+histogram is kept at two resolutions (Perreault and Hebert) so the median is
+found from a coarse cumulative count and then from one fine bin group. Each
+step adds one column to the windows and removes another, so the cost of a
+window is proportional to its width and not to its area.
+
+The result is the same as scipy.ndimage.median_filter with the same size and
+mode. For narrow windows, and for images with more distinct values than
+max_levels (which are not counts), SciPy is faster, so it is used for them.
+
+Started: 2026-10-18
+Last modified: 2026-10-18
+
+"""
+
+
+import numpy as np
+import scipy.ndimage
+
+
+# The names of the SciPy edge modes in np.pad
+_PAD_MODES = {'reflect': 'symmetric', 'mirror': 'reflect', 'nearest': 'edge',
+              'wrap': 'wrap'}
+
+
+def _ranks(img):
+    """ Replace the values of an image by their ranks
+
+    Returns
+    -------
+    q -- NumPy array
+        the rank of each pixel among the distinct values (int32)
+    values -- NumPy array
+        the distinct values in increasing order
+
+    """
+
+    # Small integer types are counted directly, other types are sorted
+    if (img.dtype.kind in 'ui' and img.dtype.itemsize <= 2):
+        lo = int(np.min(img))
+        tmp = img.astype(np.int32) - lo
+        present = np.bincount(tmp.ravel()) > 0
+        lut = (np.cumsum(present) - 1).astype(np.int32)
+        return lut[tmp], (np.flatnonzero(present) + lo).astype(img.dtype)
+    (values, q) = np.unique(img, return_inverse=True)
+    return q.reshape(img.shape).astype(np.int32), values
+
+
+def median_filter_hist(img, size=3, mode='reflect', min_size=9,
+                       max_levels=2**16, max_bins=2**24, out=None):
+    """ Median filter a 2D image with a running histogram
+
+    Parameters
+    ----------
+    img -- 2D NumPy array
+        the image to filter
+    size -- integer (default=3)
+        the width of the square window (as the size of
+        scipy.ndimage.median_filter)
+    mode -- string (default='reflect')
+        how the edges are extended: 'reflect', 'mirror', 'nearest', or 'wrap'
+        (as in scipy.ndimage)
+    min_size -- integer (default=9)
+        windows narrower than this are filtered with
+        scipy.ndimage.median_filter, which is faster for them
+    max_levels -- integer (default=2**16)
+        images with more distinct values than this are also filtered with
+        scipy.ndimage.median_filter
+    max_bins -- integer (default=2**24)
+        the largest number of histogram bins held at once; the rows are
+        filtered in blocks to stay below it
+    out -- 2D NumPy array (optional)
+        an array for the filtered image; a new array with the data type of
+        img is made if not provided
+
+    Returns
+    -------
+    out -- 2D NumPy array
+        the median filtered image
+
+    """
+
+    img = np.asarray(img)
+    if (mode not in _PAD_MODES):
+        raise ValueError('The mode must be one of %s.' %
+                         (', '.join(sorted(_PAD_MODES))))
+    if (out is None):
+        out = np.empty(img.shape, dtype=img.dtype)
+    if (size >= min_size):
+        (q, values) = _ranks(img)
+    if (size < min_size or len(values) > max_levels):
+        scipy.ndimage.median_filter(img, size=size, mode=mode, output=out)
+        return out
+
+    # Pad the ranks as scipy.ndimage pads the image (the ranks and medians
+    # are transposed, so the columns that slide are contiguous)
+    (h, w) = img.shape
+    (b, a) = (size // 2, size - 1 - size // 2)
+    q = np.pad(q, ((b, a), (b, a)), mode=_PAD_MODES[mode])
+    q = np.ascontiguousarray(q.T)
+    half = (size * size) // 2 + 1
+
+    # Split the ranks into coarse and fine bins of about the same number
+    nlev = len(values)
+    shift = (int(nlev - 1).bit_length() + 1) // 2
+    nf = 1 << shift
+    nc = (nlev + nf - 1) >> shift
+    qc = q >> shift
+    med = np.empty((w, h), dtype=np.int32)
+
+    # Filter blocks of rows, each with a histogram for every row of windows
+    rows = max(1, min(h, max_bins // (nc * nf)))
+    for y0 in range(0, h, rows):
+        n = min(rows, h - y0)
+        fine = np.zeros((n, nc * nf), dtype=np.int32)
+        coarse = np.zeros((n, nc), dtype=np.int32)
+        ind = np.arange(n)
+        flat_f = fine.reshape(-1)
+        flat_c = coarse.reshape(-1)
+        off_f = ind * (nc * nf)
+        off_c = ind * nc
+
+        # Add (s=1) or remove (s=-1) a column of the padded image; the rows
+        # of one offset in the window are different histograms, so each
+        # offset is added without repeated indices
+        def update(x, s):
+            for dy in range(size):
+                flat_f[off_f + q[x, y0 + dy:y0 + dy + n]] += s
+                flat_c[off_c + qc[x, y0 + dy:y0 + dy + n]] += s
+
+        for x in range(size - 1):
+            update(x, 1)
+        for x in range(w):
+            update(x + size - 1, 1)
+
+            # Find the coarse bin of the median, then the fine bin within it
+            cum = np.cumsum(coarse, axis=1)
+            c = np.argmax(cum >= half, axis=1)
+            k = half - cum[ind, c] + coarse[ind, c]
+            cum = np.cumsum(fine.reshape(n, nc, nf)[ind, c], axis=1)
+            med[x, y0:y0 + n] = (c << shift) + np.argmax(
+                cum >= k[:, np.newaxis], axis=1)
+
+            update(x, -1)
+
+    # Return the ranks as values
+    np.copyto(out, values[med.T], casting='unsafe')
+
+    return out
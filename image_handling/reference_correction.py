@@ -3,6 +3,10 @@
 """
 Apply a flat-field and dark-field correction.
 
+The stack version prepares the log of the flat-field once and then corrects
+each image in place in small chunks, so a stack is corrected in one pass over
+its pixels.
+
 Written by: Andy Kiss
 Started: 2017-01-25
 Last modified: 2017-01-25
@@ -10,6 +14,7 @@ Last modified: 2017-01-25
 """
 
 
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
 
@@ -61,3 +66,181 @@ def external_reference(img, ff, df=None, flag_remove_neg=True):
 
     # Return the image
     return proj
+
+
+# Number of pixels corrected at once in each image (small enough to stay in
+# the cache between the steps of the correction)
+_CHUNK = 64 * 1024
+
+
+class log_reference:
+    """
+    Define a class to hold a flat-field (and dark-field) prepared for
+    external_reference_stack
+
+    The log of the dark-subtracted flat-field is found once, so each image
+    only needs its own log. Pixels where the flat-field is below the
+    dark-field are recorded, since the log of the ratio is real there when
+    the image is also below the dark-field.
+
+    Parameters
+    ----------
+    ff -- NumPy array
+        a 2D array representing the flat-field image
+    df -- NumPy array (optional)
+        a 2D array representing the dark-field image
+
+    """
+    def __init__(self, ff, df=None):
+        ff = np.array(ff, dtype=np.float32)
+        if (df is not None):
+            df = np.ascontiguousarray(df, dtype=np.float32)
+            ff -= df
+        self.df = df
+        self.shape = ff.shape
+
+        # Flat-field pixels below the dark-field
+        self.neg = np.flatnonzero(ff < 0)
+        self.ff_neg = ff.flat[self.neg]
+
+        # The log of the flat-field
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.log_ff = np.log(ff)
+
+
+def _correct_image(src, dst, ref, flag_remove_neg, mask):
+    """ Reference correct one image from src into dst (which can be src)
+
+    Each chunk of pixels is corrected, and its NaN and negative values are
+    fixed, while it is in the cache. Infinite values need the largest finite
+    value of the whole image, so they are fixed in a second pass over only
+    the chunks that have them.
+    """
+    src = src.reshape(-1)
+    dst = dst.reshape(-1)
+    log_ff = ref.log_ff.reshape(-1)
+    df = None if (ref.df is None) else ref.df.reshape(-1)
+
+    # Flat-field pixels below the dark-field use the ratio
+    if (len(ref.neg) > 0):
+        tmp = src[ref.neg].astype(np.float32)
+        if (df is not None):
+            tmp -= df[ref.neg]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            val_neg = -np.log(tmp / ref.ff_neg)
+
+    # Correct each chunk: log(ff - df) - log(img - df)
+    max_real = -np.inf
+    chunk_inf = []
+    for a in range(0, len(src), _CHUNK):
+        b = min(a + _CHUNK, len(src))
+        (s, d, m) = (src[a:b], dst[a:b], mask[:b - a])
+        if (df is not None):
+            np.subtract(s, df[a:b], out=d, casting='unsafe')
+            np.log(d, out=d)
+        else:
+            np.log(s, out=d, casting='unsafe')
+        np.subtract(log_ff[a:b], d, out=d)
+        if (len(ref.neg) > 0):
+            (i, j) = np.searchsorted(ref.neg, (a, b))
+            d[ref.neg[i:j] - a] = val_neg[i:j]
+
+        # Check for NaN
+        np.isnan(d, out=m)
+        np.copyto(d, 0, where=m)
+
+        # Find the largest finite value, and remove negative values
+        np.isfinite(d, out=m)
+        if (m.all()):
+            max_real = max(max_real, float(d.max()))
+            if (flag_remove_neg):
+                np.maximum(d, 0, out=d)
+        else:
+            max_real = max(max_real, float(np.max(d, where=m,
+                                                  initial=-np.inf)))
+            chunk_inf.append((a, b))
+
+    # Check for inf, then remove negative values
+    for (a, b) in chunk_inf:
+        (d, m) = (dst[a:b], mask[:b - a])
+        np.isinf(d, out=m)
+        np.copyto(d, max_real, where=m)
+        if (flag_remove_neg):
+            np.maximum(d, 0, out=d)
+
+
+def external_reference_stack(img, ff, df=None, flag_remove_neg=True,
+                             out=None, num_threads=4):
+    """
+    Apply a flat-field and dark-field corrections to an image stack
+
+    This gives the same result as external_reference on each image, but the
+    flat-field is prepared once (see log_reference), and each image is
+    corrected in one pass over small chunks of its pixels, with no temporary
+    arrays, so the correction runs at the speed of reading and writing the
+    images.
+
+    Parameters
+    ----------
+    img -- NumPy array
+        a stack of images (N, H, W) or a single image (H, W)
+    ff -- NumPy array or class log_reference
+        a 2D array representing the flat-field image, or a log_reference
+        made from it (which is much faster when the function is called for
+        one image at a time)
+    df -- NumPy array (optional)
+        a 2D array representing the dark-field image (it is ignored if ff is
+        a log_reference)
+    flag_remove_neg -- boolean (default=True)
+        set negative values to 0
+    out -- NumPy array (optional)
+        a float array with the shape of img for the corrected images; use
+        out=img to correct a float32 stack in place; a new float32 array is
+        made if not provided
+    num_threads -- integer (default=4)
+        the number of threads correcting images
+
+    Returns
+    -------
+    proj -- NumPy array
+        returns the reference corrected image(s)
+
+    """
+
+    # Prepare the flat-field
+    if (isinstance(ff, log_reference)):
+        ref = ff
+    else:
+        ref = log_reference(ff, df)
+
+    # Treat a single image as a stack of one
+    if (out is None):
+        out = np.empty(img.shape, dtype=np.float32)
+    src = img if (img.ndim == 3) else img[np.newaxis]
+    dst = out if (out.ndim == 3) else out[np.newaxis]
+    if (src.shape[1:] != ref.shape or dst.shape != src.shape):
+        raise ValueError('The images, references, and output must have the '
+                         'same size.')
+
+    # Correct the images (the ufuncs release the GIL, so the images are
+    # corrected in parallel)
+    def correct(i):
+        mask = np.empty((_CHUNK, ), dtype=bool)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if (dst[i].flags.c_contiguous):
+                _correct_image(src[i], dst[i], ref, flag_remove_neg, mask)
+            else:
+                tmp = np.empty(ref.shape, dtype=np.float32)
+                _correct_image(src[i], tmp, ref, flag_remove_neg, mask)
+                dst[i] = tmp
+
+    num_threads = max(1, min(num_threads, src.shape[0]))
+    if (num_threads == 1):
+        for i in range(src.shape[0]):
+            correct(i)
+    else:
+        with ThreadPoolExecutor(max_workers=num_threads) as ex:
+            list(ex.map(correct, range(src.shape[0])))
+
+    # Return the image
+    return out
@@ -8,6 +8,10 @@ It does this by comparing this array value to the mean of the surrounding
 values. If the array value exceeds a threshold, then it is replaced by the mean
 of the surrounding pixels.
 
+The stack version compares every pixel of a stack of images at once, with
+the mean or the median of its neighborhood, and the neighborhood can also
+reach across adjacent images of the stack.
+
 Written by: Andy Kiss
 Started: 2017-01-24
 Last modified: 2017-01-25
@@ -16,7 +20,8 @@ Last modified: 2017-01-25
 
 
 import numpy as np
-import scipy.ndimage.filters as filters
+import scipy.ndimage as filters
+from image_handling.median_filter import median_filter_hist
 
 
 def remove_outliers(arr, delta=100, radius=2):
@@ -38,56 +43,129 @@ def remove_outliers(arr, delta=100, radius=2):
         a new array with the outliers removed
 
     """
-    # Assume that the array is a 2D array that is much larger than the radius
-    h, w = arr.shape
-
-    # Make a duplicate array
-    arr_new = np.zeros((h, w))
-
-    # Make the location and averaging array
-    L = 2 * radius + 1
-    x0 = L * radius + radius
-    x_loc = np.concatenate((np.arange(0, x0, dtype=np.int),
-                            np.arange(x0 + 1, L*L, dtype=np.int)))
-    arr_avg = np.zeros((L * L, ))
-
-    # Start looping
-    for i in range(h):
-        loc_i = np.linspace(i - radius, i + radius,
-                            num=L, dtype=np.int)
-        for k in range(L):
-            if (loc_i[k] < 0):
-                loc_i[k] = np.abs(loc_i[k])
-            if (loc_i[k] > (h - 1)):
-                loc_i[k] = (h - 1) - (loc_i[k] - (h - 1))
-
-        for j in range(w):
-            loc_j = np.linspace(j - radius, j + radius,
-                                num=L, dtype=np.int)
-            for k in range(L):
-                if (loc_j[k] < 0):
-                    loc_j[k] = np.abs(loc_j[k])
-                if (loc_j[k] > (w - 1)):
-                    loc_j[k] = (w - 1) - (loc_j[k] - (w - 1))
-
-            # Build the average matrix
-            for ii in range(L):
-                for jj in range(L):
-                    arr_avg[jj + L*ii] = arr[loc_i[ii], loc_j[jj]]
-
-            # Calculate the mean
-            x_bar = np.mean(arr_avg[x_loc])
-
-            # check for outlier
-            if (arr[i, j] > (x_bar + delta)):
-                arr_new[i, j] = x_bar
-            else:
-                arr_new[i, j] = arr[i, j]
+
+    # The mean of the surrounding values (mirrored at the edges) is found
+    # for every pixel at once
+    arr = np.asarray(arr, dtype=np.float64)
+    arr_new = remove_outliers_stack(arr, delta=delta, radius=radius,
+                                    method='mean')
 
     # Return the new array
     return arr_new
 
 
+def _chunks(N, chunk):
+    """ Split N frames into blocks of chunk frames """
+    return [(a, min(a + chunk, N)) for a in range(0, N, chunk)]
+
+
+def remove_outliers_stack(img, delta=100, radius=2, method='mean',
+                          radius_t=0, mode='mirror', chunk=32, size=None,
+                          out=None):
+    """ Remove outliers from a stack of images (or a single image).
+
+    Each pixel is compared with a reference value of its neighborhood, and
+    if it is larger than the reference by more than delta it is replaced by
+    the reference. The reference of every pixel in a block of frames is
+    found with one filter call, and the stack is processed in blocks of
+    frames so only one block of reference values is held in memory.
+
+    Parameters
+    ----------
+    img -- NumPy array
+        the stack of images (N, H, W) or a single image (H, W)
+    delta -- float (default=100)
+        the difference necessary to replace a value with the reference
+    radius -- integer (default=2)
+        the radius of the neighborhood in each image; the neighborhood is
+        (2 * radius + 1) pixels wide
+    method -- string (default='mean')
+        'mean' -- the mean of the neighborhood, without the pixel itself
+        'median' -- the median of the neighborhood, with the pixel itself
+        'histogram' -- the same median found with median_filter_hist,
+                       which is faster for a large radius (radius_t must
+                       be 0)
+    radius_t -- integer (default=0)
+        the radius of the neighborhood across adjacent images of the stack
+        (0 compares each image only with itself)
+    mode -- string (default='mirror')
+        how the edges of the images (and of the stack) are extended, as in
+        scipy.ndimage ('mirror' reflects about the edge pixel)
+    chunk -- integer (default=32)
+        the number of images processed at once
+    size -- integer (optional)
+        the width of the neighborhood in each image, used instead of radius
+        (it can be even, as the size of scipy.ndimage.median_filter)
+    out -- NumPy array (optional)
+        an array for the result, which can be img itself to remove the
+        outliers in place; a new float array is made if not provided
+
+    Returns
+    -------
+    out -- NumPy array
+        the stack with the outliers removed
+
+    """
+
+    # Treat a single image as a stack of one
+    if (method not in ('mean', 'median', 'histogram')):
+        raise ValueError('The method must be \'mean\', \'median\', or '
+                         '\'histogram\'.')
+    if (method == 'histogram' and radius_t != 0):
+        raise ValueError('The histogram median does not reach across '
+                         'images (radius_t must be 0).')
+    ftype = np.result_type(img.dtype, np.float32)
+    if (out is None):
+        out = np.empty(img.shape, dtype=ftype)
+    src = img if (img.ndim == 3) else img[np.newaxis]
+    dst = out if (out.ndim == 3) else out[np.newaxis]
+    N = src.shape[0]
+    L = (2 * radius + 1) if (size is None) else size
+    Lt = 2 * radius_t + 1
+    size = (Lt, L, L)
+    num = Lt * L * L
+
+    # Replace the outliers of a block of images with the reference values
+    def apply(a, b, ref):
+        mask = (src[a:b] - ref) > delta
+        if (dst is not src):
+            np.copyto(dst[a:b], src[a:b], casting='unsafe')
+        np.copyto(dst[a:b], ref, casting='unsafe', where=mask)
+
+    # The results of a block are written after the reference of the next
+    # block is found, so the images it needs are never changed first when
+    # the outliers are removed in place
+    pending = None
+    for (a, b) in _chunks(N, max(chunk, radius_t, 1)):
+        lo = max(0, a - radius_t)
+        hi = min(N, b + radius_t)
+        tmp = np.asarray(src[lo:hi], dtype=ftype)
+
+        # Find the reference values of the block
+        if (method == 'mean'):
+            ref = filters.uniform_filter(tmp, size=size, mode=mode)
+            ref *= num
+            ref -= tmp
+            ref /= (num - 1)
+        elif (method == 'median'):
+            ref = filters.median_filter(tmp, size=size, mode=mode)
+        else:
+            ref = np.empty(tmp.shape, dtype=ftype)
+            for k in range(tmp.shape[0]):
+                median_filter_hist(tmp[k], size=L, mode=mode, out=ref[k])
+        ref = ref[a - lo:b - lo]
+        del tmp
+
+        if (pending is not None):
+            apply(*pending)
+        pending = (a, b, ref)
+    if (pending is not None):
+        apply(*pending)
+
+    # Return the new stack
+    return out
+
+
 def remove_outliers_scipy(arr, delta=100, radius=3):
     """ Remove outliers from a 2D NumPy array using SciPy.
     Based on the algorithm in TomoPy
@@ -122,3 +200,92 @@ def remove_outliers_scipy(arr, delta=100, radius=3):
 
     # Return the new array
     return arr_new
+
+
+def outlier_scratch(shape):
+    """ Allocate the scratch buffers of remove_outliers_scipy_stack
+
+    Parameters
+    ----------
+    shape -- tuple of integers
+        the (height, width) of one image
+
+    Returns
+    -------
+    scratch -- tuple of NumPy arrays
+        the median (float32), the difference (float32) and the outlier mask
+        (boolean) of one image
+
+    """
+
+    return (np.empty(shape, dtype=np.float32),
+            np.empty(shape, dtype=np.float32),
+            np.empty(shape, dtype=bool))
+
+
+def remove_outliers_scipy_stack(img, delta=100, radius=3, out=None,
+                                scratch=None, method='scipy'):
+    """ Remove outliers from a stack of images using SciPy, without
+    allocating memory for each image.
+
+    This finds the outliers of each image as remove_outliers_scipy does, but
+    the median, the difference, and the outlier mask of each image are
+    computed in float32 into the scratch buffers, and the outliers are
+    replaced with a masked copy. Nothing is allocated for each image, so the
+    same buffers can be passed to every call in a processing loop.
+
+    The input is only changed if out is img, in which case the outliers are
+    replaced in place (each image is filtered before it is changed, so the
+    result is the same). Otherwise the result is written to out, or to a new
+    float32 array.
+
+    Parameters
+    ----------
+    img -- NumPy array
+        the stack of images (N, H, W) or a single image (H, W)
+    delta -- float (default=100)
+        the difference necessary to replace a value with the median
+    radius -- integer (default=3)
+        the width of the median window (the size of the median filter, as in
+        remove_outliers_scipy)
+    out -- NumPy array (optional)
+        an array with the shape of img for the result (img itself to remove
+        the outliers in place)
+    scratch -- tuple of NumPy arrays (optional)
+        the buffers from outlier_scratch for the shape of one image; they
+        are allocated once for the call if not provided
+    method -- string (default='scipy')
+        'scipy' -- scipy.ndimage.median_filter
+        'histogram' -- median_filter_hist, which gives the same median and
+                       is faster for wide windows (from about 9 pixels) but
+                       allocates its own buffers
+    Returns
+    -------
+    out -- NumPy array
+        the stack with the outliers removed
+
+    """
+
+    # Treat a single image as a stack of one
+    if (out is None):
+        out = np.empty(img.shape, dtype=np.float32)
+    src = img if (img.ndim == 3) else img[np.newaxis]
+    dst = out if (out.ndim == 3) else out[np.newaxis]
+    if (scratch is None):
+        scratch = outlier_scratch(src.shape[1:])
+    (med, diff, mask) = scratch
+
+    # Replace the outliers of each image with the median
+    for i in range(src.shape[0]):
+        if (method == 'histogram'):
+            median_filter_hist(src[i], size=radius, out=med)
+        else:
+            filters.median_filter(src[i], size=radius, output=med)
+        np.subtract(src[i], med, out=diff, casting='unsafe')
+        np.greater(diff, delta, out=mask)
+        if (dst is not src):
+            np.copyto(dst[i], src[i], casting='unsafe')
+        np.copyto(dst[i], med, casting='unsafe', where=mask)
+
+    # Return the new stack
+    return out
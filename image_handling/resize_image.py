@@ -3,101 +3,201 @@
 """
 Bin the image.
 
+The images are binned by combining strided views of the image (one view for
+each position in a block), so no Python loop runs over the pixels. A stack is
+binned a few images at a time, so only a small temporary array is needed.
+
 Written by: Andy Kiss
 Started: 2017-01-25
-Last modified: 2017-01-25
+Last modified: 2026-10-18
 
 """
 
 
 # Import modules
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from skimage.transform import resize
 
 
-def bin_image(img, B=1, method='average'):
+# Size (in bytes) of the images binned at once
+_CHUNK_BYTES = 64 * 1024**2
+
+
+def _reduce_blocks(src, by, bx, method, dst):
+    """ Reduce the (by, bx) blocks of a stack into dst
+
+    The height and width of src must be multiples of by and bx. The columns
+    of each block are combined first and then the rows, each with a strided
+    ufunc over the whole stack.
+    """
+    (n, h, w) = src.shape
+    if (method == 'max'):
+        (op, dtype) = (np.maximum, src.dtype)
+    else:
+        (op, dtype) = (np.add, np.result_type(src.dtype, np.float32))
+
+    # Combine the columns of each block
+    tmp = np.empty((n, h, w // bx), dtype=dtype)
+    np.copyto(tmp, src[:, :, 0::bx], casting='unsafe')
+    for k in range(1, bx):
+        op(tmp, src[:, :, k::bx], out=tmp, casting='unsafe')
+
+    # Combine the rows of each block (sums are kept in the float data type
+    # until the end, so an integer dst can not overflow or be divided)
+    acc = dst if (dst.dtype == dtype) else np.empty(dst.shape, dtype=dtype)
+    np.copyto(acc, tmp[:, 0::by])
+    for k in range(1, by):
+        op(acc, tmp[:, k::by], out=acc)
+    if (method == 'average'):
+        acc /= (by * bx)
+    if (acc is not dst):
+        np.copyto(dst, acc, casting='unsafe')
+
+
+def _bin(img, by, bx, method='average', edge='crop', dtype=None, out=None,
+         num_threads=4):
+    """ Bin an image or a stack of images
+
+    Parameters
+    ----------
+    img -- NumPy array
+        an image (H, W) or a stack of images (N, H, W)
+    by, bx -- integers
+        the amount of binning in the vertical and horizontal directions
+    method -- string (default='average')
+        'average' (or 'mean') -- the mean of each block
+        'sum' -- the sum of each block
+        'max' -- the largest value of each block
+    edge -- string (default='crop')
+        what to do with the pixels left over when the size is not a multiple
+        of the binning
+        'crop' -- leave them out
+        'pad' -- repeat the last row and column to fill the last blocks
+        'partial' -- bin the smaller blocks at the edges on their own
+    dtype -- NumPy dtype (optional)
+        the data type of the result; float32 (float64 for float64 images)
+        for 'average' and 'sum', and the data type of img for 'max'
+    out -- NumPy array (optional)
+        an array for the binned images
+    num_threads -- integer (default=4)
+        the number of threads binning blocks of images
+
+    Returns
+    -------
+    out -- NumPy array
+        the binned image(s)
+
+    """
+
+    # Check the inputs
+    if (method == 'mean'):
+        method = 'average'
+    if (method not in ('average', 'sum', 'max')):
+        raise ValueError('Bin method "%s" not found.' % (method))
+    if (edge not in ('crop', 'pad', 'partial')):
+        raise ValueError('Bin edge "%s" not found.' % (edge))
+    if (img.ndim not in (2, 3)):
+        raise ValueError('The image must be 2D or 3D.')
+    src = img if (img.ndim == 3) else img[np.newaxis]
+    (N, H, W) = src.shape
+    (H0, W0) = (H - H % by, W - W % bx)
+
+    # Allocate the result
+    if (edge == 'crop'):
+        shape = (N, H // by, W // bx)
+    else:
+        shape = (N, -(-H // by), -(-W // bx))
+    if (out is None):
+        if (dtype is None and method == 'max'):
+            dtype = img.dtype
+        elif (dtype is None):
+            dtype = np.result_type(img.dtype, np.float32)
+        out = np.empty(shape[1:] if (img.ndim == 2) else shape, dtype=dtype)
+    dst = out.reshape(shape)
+
+    # The full blocks, then the blocks at the right and bottom edges
+    regions = [(0, H0, 0, W0, by, bx)]
+    if (edge != 'crop'):
+        if (W0 < W):
+            regions.append((0, H0, W0, W, by, W - W0))
+        if (H0 < H):
+            regions.append((H0, H, 0, W0, H - H0, bx))
+        if (H0 < H and W0 < W):
+            regions.append((H0, H, W0, W, H - H0, W - W0))
+
+    # Bin a few images at a time
+    def bin_chunk(a):
+        b = min(a + chunk, N)
+        for (r0, r1, c0, c1, bh, bw) in regions:
+            part = src[a:b, r0:r1, c0:c1]
+            if (part.size == 0):
+                continue
+            (i, j) = (r0 // by, c0 // bx)
+            (h, w) = ((r1 - r0) // bh, (c1 - c0) // bw)
+            if (edge == 'pad' and (bh, bw) != (by, bx)):
+                part = np.pad(part, ((0, 0), (0, by - bh), (0, bx - bw)),
+                              mode='edge')
+                (bh, bw) = (by, bx)
+            _reduce_blocks(part, bh, bw, method, dst[a:b, i:i + h, j:j + w])
+
+    # The ufuncs release the GIL, so the blocks are binned in parallel
+    chunk = max(1, _CHUNK_BYTES // max(1, H * W * src.itemsize))
+    if (num_threads > 1 and N > chunk):
+        with ThreadPoolExecutor(max_workers=num_threads) as ex:
+            list(ex.map(bin_chunk, range(0, N, chunk)))
+    else:
+        for a in range(0, N, chunk):
+            bin_chunk(a)
+
+    return out
+
+
+def bin_image(img, B=1, method='average', edge='crop', out=None,
+              num_threads=4):
     """
     Bin the image in the horizontal and verticle direction
 
     Parameters
     ----------
     img -- NumPy array
-        an array representing the image
-    B -- int
-        an integer representing the amount of binning
+        an array representing the image (or a stack of images)
+    B -- int or tuple of integers
+        an integer representing the amount of binning, or the amount of
+        binning in the verticle and horizontal directions
     method -- string (optional)
         average -- this will average the pixels when resizing
         sum -- this will sum the pixels when resizing
+        max -- this will keep the largest pixel when resizing
+    edge -- string (optional)
+        crop -- leave out the pixels past the last full block
+        pad -- repeat the last row and column to fill the last blocks
+        partial -- bin the smaller blocks at the edges on their own
+    out -- NumPy array (optional)
+        an array for the binned image
+    num_threads -- int (optional)
+        the number of threads used for a stack of images
 
     Returns
     -------
     proj -- NumPy array
-        returns the binned image
+        returns the binned image (float32 unless out is given, for 'average'
+        and 'sum')
     """
 
-    # Get the starting image size
-    if (img.ndim == 2):
-        N = 1
-        (H, V) = img.shape
-    elif (img.ndim == 3):
-        (N, H, V) = img.shape
-    else:
-        print('Bin image ERROR! image is not the right size')
-        return
-
-    # Get the new size
-    (H_new, V_new) = (H // B, V // B)
+    # Get the binning in each direction
+    (by, bx) = (B, B) if (np.ndim(B) == 0) else B
 
-    # Resize the image
-    if (method == 'average'):
-        """
-        if (N == 1):
-            I = resize(img, (H_new, V_new))
-        else:
-            I = np.zeros((N, H_new, V_new), dtype=np.float32)
-            for i in range(N):
-                I[i, :, :] = resize(img[i, :, :], (H_new, V_new))
-        """
-        if (N == 1):
-            I = np.zeros((H_new, V_new), dtype=np.float32)
-            for i in range(H_new):
-                for j in range(V_new):
-                    x = i * B
-                    y = j * B
-                    I[i, j] = np.mean(img[x:x+B, y:y+B])
-        else:
-            I = np.zeros((N, H_new, V_new), dtype=np.float32)
-            for ii in range(N):
-                for i in range(H_new):
-                    for j in range(V_new):
-                        x = i * B
-                        y = j * B
-                        I[ii, i, j] = np.mean(img[ii, x:x+B, y:y+B])
-    elif (method == 'sum'):
-        if (N == 1):
-            I = np.zeros((H_new, V_new), dtype=np.float32)
-            for i in range(H_new):
-                for j in range(V_new):
-                    x = i * B
-                    y = j * B
-                    I[i, j] = np.sum(img[x:x+B, y:y+B])
-        else:
-            I = np.zeros((N, H_new, V_new), dtype=np.float32)
-            for ii in range(N):
-                for i in range(H_new):
-                    for j in range(V_new):
-                        x = i * B
-                        y = j * B
-                        I[ii, i, j] = np.sum(img[ii, x:x+B, y:y+B])
-    else:
-        print('Bin Image ERROR! method not found.')
-        return
+    # Bin the image
+    dtype = None if (method == 'max') else np.float32
+    I = _bin(img, int(by), int(bx), method=method, edge=edge, dtype=dtype,
+             out=out, num_threads=num_threads)
 
     # Return the new image
     return I
 
 
-def bin_image_stack(img, bin_size=(1, 1), method='average'):
+def bin_image_stack(img, bin_size=(1, 1), method='average', edge='crop',
+                    out=None, num_threads=4):
     """
     Bin the image in the horizontal and verticle direction
 
@@ -111,6 +211,15 @@ def bin_image_stack(img, bin_size=(1, 1), method='average'):
     method -- string (optional)
         average -- this will average the pixels when resizing
         sum -- this will sum the pixels when resizing
+        max -- this will keep the largest pixel when resizing
+    edge -- string (optional)
+        crop -- leave out the pixels past the last full block
+        pad -- repeat the last row and column to fill the last blocks
+        partial -- bin the smaller blocks at the edges on their own
+    out -- NumPy array (optional)
+        an array for the binned image(s)
+    num_threads -- int (optional)
+        the number of threads used for a stack of images
 
     Returns
     -------
@@ -118,23 +227,13 @@ def bin_image_stack(img, bin_size=(1, 1), method='average'):
         returns the binned image(s)
     """
 
-    if (bin_size == (1, 1)):
+    if (tuple(bin_size) == (1, 1) and out is None):
         return img
 
-    if (img.ndim != 3):
-        img = img[np.newaxis]
-
     (n, m) = bin_size
-    ims = img[:, :img.shape[1] - np.mod(img.shape[1], n),
-                 :img.shape[2] - np.mod(img.shape[2], m)]
-
-    if (method == 'average'):
-        ims = ims.reshape(ims.shape[0], ims.shape[1]//n, n,
-                                        ims.shape[2]//m, m).mean(4).mean(2)
-    elif (method == 'sum'):
-        ims = ims.reshape(ims.shape[0], ims.shape[1]//n, n,
-                                        ims.shape[2]//m, m).sum(4).sum(2)
-    else:
-        print('Method \"' + method + '\" not found.')
+    ims = _bin(img, int(n), int(m), method=method, edge=edge, out=out,
+               num_threads=num_threads)
 
+    if (out is not None):
+        return out
     return ims.squeeze()
@@ -7,6 +7,7 @@ Created on Wed Jan 25 22:39:41 2017
 
 
 import os
+import copy
 import numpy as np
 import txm_image
 import image_handling
@@ -17,10 +18,18 @@ fn_scanlog = '20170727_170555_Marcellus_t24.log'
 path = r'E:\201707_beamtime\20170727'
 
 
-# Despeckling images
+# Despeckling images (DS_rad is the width of the median window; DS_rad_t is
+# the radius across adjacent images of a stack, used for the references and
+# for the projections with flag_big_memory)
 flag_despeckle = True
 DS_delta = 500
 DS_rad = 3
+DS_rad_t = 0
+
+# True -- Find the same median with a running histogram, which is faster for
+#         a wide window (DS_rad from about 9) but can not use DS_rad_t
+# False -- Use the SciPy median filter
+flag_DS_hist = False
 
 # Bin images
 flag_bin = True
@@ -51,6 +60,15 @@ flag_clear_big = True
 # False -- Make tiff files
 flag_bim = True
 
+# Number of background threads writing the projection files
+# (0 -- write the files in the main thread)
+N_io = 4
+
+# True -- Skip the outputs that were already finished (manifest.json in the
+#         processing folder) and are up to date
+# False -- Process everything again
+flag_resume = True
+
 
 # %% Load scanlog information
 if (path[-1] != '\\' and path[-1] != '/'):
@@ -77,6 +95,23 @@ try:
 except:
     os.mkdir(path_process)
 
+# Manifest of the finished outputs (changing a parameter redoes the stage)
+params = {'flag_despeckle': flag_despeckle, 'DS_delta': DS_delta,
+          'DS_rad': DS_rad, 'DS_rad_t': DS_rad_t,
+          'flag_DS_hist': flag_DS_hist, 'flag_bin': flag_bin, 'B': B,
+          't_ref': t_ref, 't_proj': t_proj, 'flag_average': flag_average,
+          'flag_360_mosaic': flag_360_mosaic, 'new_xy': new_xy,
+          'flag_bim': flag_bim}
+fn_manifest = path + path_process + 'manifest.json'
+ckpt_ref = txm_image.checkpoint(fn_manifest, 'references', params)
+ckpt_proj = txm_image.checkpoint(fn_manifest, 'projections', params)
+if (not flag_resume):
+    ckpt_ref.reset()
+    ckpt_proj.reset()
+ext_out = '.bim' if (flag_bim) else '.tif'
+DS_method = 'histogram' if (flag_DS_hist) else 'median'
+fn_ref = []
+
 # Check for dark field images
 if (LOG.flag_df is True):
     print('Processing dark field images...', end='')
@@ -92,27 +127,37 @@ if (LOG.flag_df is True):
     for i in range(len(ls_rm)):
         fn.remove(ls_rm[i])
 
-    # Read in the dark field files and average them
-    df, _ = txm_image.read_file(fn[0], verbose=False)
-    if (flag_average):
-        df_avg = image_handling.average_image_stack(df)
+    # Use the finished file if it is up to date
+    fn_out = path + path_process + 'df_avg' + ext_out
+    fn_in = [path + path_df + i for i in fn]
+    if (ckpt_ref.is_done(fn_out, fn_in)):
+        df, _ = txm_image.read_file(fn_out, verbose=False)
     else:
-        df_avg = image_handling.median_image_stack(df)
-
-    # Bin the image
-    if (flag_bin):
-        df_avg = image_handling.bin_image(df_avg, B=B, method='average')
-
-    # Move to the process directory and write the file
-    os.chdir('../'+path_process)
-    if (flag_bim):
-        txm_image.write_file('df_avg.bim', df_avg, verbose=False)
-    else:
-        txm_image.write_file('df_avg.tif', df_avg, verbose=False)
-
-    # Garbage clean up
-    df = df_avg
-    del df_avg
+        # Read in the dark field files and average them
+        df, _ = txm_image.read_file(fn[0], verbose=False)
+        if (flag_average):
+            df_avg = image_handling.average_image_stack(df)
+        else:
+            df_avg = image_handling.median_image_stack(df)
+
+        # Bin the image
+        if (flag_bin):
+            df_avg = image_handling.bin_image(df_avg, B=B, method='average')
+
+        # Move to the process directory and write the file
+        os.chdir('../'+path_process)
+        if (flag_bim):
+            txm_image.write_file('df_avg.bim', df_avg, verbose=False)
+        else:
+            txm_image.write_file('df_avg.tif', df_avg, verbose=False)
+
+        # Garbage clean up
+        df = df_avg
+        del df_avg
+
+        # Record the finished file
+        ckpt_ref.done(fn_out, fn_in)
+    fn_ref.append(fn_out)
 
     # Return to the master directory
     os.chdir('..')
@@ -138,39 +183,48 @@ if (LOG.flag_ref is True):
     for i in range(len(ls_rm)):
         fn.remove(ls_rm[i])
 
-    # Read in the dark field files
-    ff1, _ = txm_image.read_file(fn[0], verbose=False)
-
-    # Despeckle images
-    if (flag_despeckle):
-        for i in range(ff1.shape[0]):
-            ff1[i, :, :] = image_handling.remove_outliers_scipy(ff1[i, :, :],
-                                                                delta=DS_delta,
-                                                                radius=DS_rad)
-
-    # Average them
-    if (flag_average):
-        ff1_avg = image_handling.average_image_stack(ff1)
+    # Use the finished file if it is up to date
+    fn_out = path + path_process + 'ff1_avg' + ext_out
+    fn_in = [path + path_ref1 + i for i in fn]
+    if (ckpt_ref.is_done(fn_out, fn_in)):
+        ff1, _ = txm_image.read_file(fn_out, verbose=False)
     else:
-        ff1_avg = image_handling.median_image_stack(ff1)
-
-    # Bin the images
-    if (flag_bin):
-        ff1_avg = image_handling.bin_image(ff1_avg, B=B, method='average')
-
-    # Scale the references
-    ff1_avg = (t_proj / t_ref) * ff1_avg
-
-    # Move to the process directory and write the file
-    os.chdir('../'+path_process)
-    if (flag_bim):
-        txm_image.write_file('ff1_avg.bim', ff1_avg, verbose=False)
-    else:
-        txm_image.write_file('ff1_avg.tif', ff1_avg, verbose=False)
-
-    # Garbage clean up
-    ff1 = ff1_avg
-    del ff1_avg
+        # Read in the dark field files
+        ff1, _ = txm_image.read_file(fn[0], verbose=False)
+
+        # Despeckle images
+        if (flag_despeckle):
+            image_handling.remove_outliers_stack(
+                ff1, delta=DS_delta, size=DS_rad, method=DS_method,
+                radius_t=DS_rad_t, mode='reflect', out=ff1)
+
+        # Average them
+        if (flag_average):
+            ff1_avg = image_handling.average_image_stack(ff1)
+        else:
+            ff1_avg = image_handling.median_image_stack(ff1)
+
+        # Bin the images
+        if (flag_bin):
+            ff1_avg = image_handling.bin_image(ff1_avg, B=B, method='average')
+
+        # Scale the references
+        ff1_avg = (t_proj / t_ref) * ff1_avg
+
+        # Move to the process directory and write the file
+        os.chdir('../'+path_process)
+        if (flag_bim):
+            txm_image.write_file('ff1_avg.bim', ff1_avg, verbose=False)
+        else:
+            txm_image.write_file('ff1_avg.tif', ff1_avg, verbose=False)
+
+        # Garbage clean up
+        ff1 = ff1_avg
+        del ff1_avg
+
+        # Record the finished file
+        ckpt_ref.done(fn_out, fn_in)
+    fn_ref.append(fn_out)
 
     # Return to the master directory
     os.chdir('..')
@@ -200,39 +254,48 @@ if (ind_ff < 0):
     for i in range(len(ls_rm)):
         fn.remove(ls_rm[i])
 
-    # Read in the FLAT field files
-    ff2, _ = txm_image.read_file(fn[0], verbose=False)
-
-    # Despeckle images
-    if (flag_despeckle):
-        for i in range(ff2.shape[0]):
-            ff2[i, :, :] = image_handling.remove_outliers_scipy(ff2[i, :, :],
-                                                                delta=DS_delta,
-                                                                radius=DS_rad)
-
-    # And average them
-    if (flag_average):
-        ff2_avg = image_handling.average_image_stack(ff2)
+    # Use the finished file if it is up to date
+    fn_out = path + path_process + 'ff2_avg' + ext_out
+    fn_in = [path + path_ref2 + i for i in fn]
+    if (ckpt_ref.is_done(fn_out, fn_in)):
+        ff2, _ = txm_image.read_file(fn_out, verbose=False)
     else:
-        ff2_avg = image_handling.median_image_stack(ff2)
-
-    # Bin the images
-    if (flag_bin):
-        ff2_avg = image_handling.bin_image(ff2_avg, B=B, method='average')
-
-    # Scale the references
-    ff2_avg = (t_proj / t_ref) * ff2_avg
-
-    # Move to the process directory and write the file
-    os.chdir('../'+path_process)
-    if (flag_bim):
-        txm_image.write_file('ff2_avg.bim', ff2_avg, verbose=False)
-    else:
-        txm_image.write_file('ff2_avg.tif', ff2_avg, verbose=False)
-
-    # Garbage clean up
-    ff2 = ff2_avg
-    del ff2_avg
+        # Read in the FLAT field files
+        ff2, _ = txm_image.read_file(fn[0], verbose=False)
+
+        # Despeckle images
+        if (flag_despeckle):
+            image_handling.remove_outliers_stack(
+                ff2, delta=DS_delta, size=DS_rad, method=DS_method,
+                radius_t=DS_rad_t, mode='reflect', out=ff2)
+
+        # And average them
+        if (flag_average):
+            ff2_avg = image_handling.average_image_stack(ff2)
+        else:
+            ff2_avg = image_handling.median_image_stack(ff2)
+
+        # Bin the images
+        if (flag_bin):
+            ff2_avg = image_handling.bin_image(ff2_avg, B=B, method='average')
+
+        # Scale the references
+        ff2_avg = (t_proj / t_ref) * ff2_avg
+
+        # Move to the process directory and write the file
+        os.chdir('../'+path_process)
+        if (flag_bim):
+            txm_image.write_file('ff2_avg.bim', ff2_avg, verbose=False)
+        else:
+            txm_image.write_file('ff2_avg.tif', ff2_avg, verbose=False)
+
+        # Garbage clean up
+        ff2 = ff2_avg
+        del ff2_avg
+
+        # Record the finished file
+        ckpt_ref.done(fn_out, fn_in)
+    fn_ref.append(fn_out)
 
     # Return to the master directory
     os.chdir('..')
@@ -241,6 +304,9 @@ if (ind_ff < 0):
 else:
     ff2 = ff1
 
+# Save the finished references
+ckpt_ref.save()
+
 
 # %% Start processing projections
 
@@ -260,25 +326,25 @@ N = len(ls_dir)
 print('\nFound %d files.' % (N))
 
 # Process data
+fn_proj = [path + path_proj + i for i in ls_dir]
 if (flag_big_memory is True):
+    # The BIM files of the projections (one for each average of exposures)
+    N_bim = 0
+    for fn in fn_proj:
+        N_bim += txm_image.formats.tiff.tiff_stack_size(fn)
+    if (LOG.num_exp > 1):
+        N_bim = N_bim // LOG.num_exp
+    fn_bim = [path + path_process + 'bim/proj_%06d.bim' % (i)
+              for i in range(N_bim)]
+if (flag_big_memory is True and N_bim > 0 and
+        all([ckpt_proj.is_done(fn, fn_proj + fn_ref) for fn in fn_bim])):
+    # All the projections were already written
+    print('The projection files are up to date.')
+    img = None
+elif (flag_big_memory is True):
     # Load all the projection Tiff files
     print('Loading projection images...', end='')
-    img, _ = txm_image.read_file(path + path_proj + ls_dir[0], verbose=False)
-    if (N > 1 and img.ndim == 2):
-        img_tmp = np.zeros((1, img.shape[0], img.shape[1]), dtype=np.float32)
-        img_tmp[0, :, :] = img
-        img = img_tmp
-        del img_tmp
-    # img_tmp, _ = txm_image.read_file(path + path_proj + ls_dir[0], verbose=False)
-    # img = np.zeros((1, img_tmp.shape[0], img_tmp.shape[1]), dtype=np.float32)
-    # img[0, :, :] = img_tmp
-    if (img.shape[0] != (LOG.num_proj * LOG.num_mos * LOG.num_exp)):
-        if (N > 1):
-            # tmp_img = np.zeros((1, img_tmp.shape[0], img_tmp.shape[1]), dtype=np.float32)
-            for i in np.arange(1, N):
-                tmp_img, _ = txm_image.read_file(path + path_proj + ls_dir[i],
-                                                 verbose=False)
-                img = np.append(img, tmp_img, axis=0)
+    img = txm_image.load_projections(LOG, fn_proj, num_threads=max(N_io, 1))
     print('done')
     # N_proj = np.size(img)[0]
     N_proj = img.shape[0]
@@ -286,13 +352,11 @@ if (flag_big_memory is True):
 
     # Despeckle the images
     if (flag_despeckle):
-        print('Removing outliers...      ', end='')
-        for i in range(N_proj):
-            print('\b\b\b\b\b\b(%3d%%)' % (100 * i // N_proj), end='')
-            img[i, :, :] = image_handling.remove_outliers_scipy(img[i, :, :],
-                                                                delta=DS_delta,
-                                                                radius=DS_rad)
-        print('\b\b\b\b\b\bdone  ')
+        print('Removing outliers...', end='')
+        image_handling.remove_outliers_stack(
+            img, delta=DS_delta, size=DS_rad, method=DS_method,
+            radius_t=DS_rad_t, mode='reflect', out=img)
+        print('done')
 
     # Bin the images
     if (flag_bin):
@@ -322,23 +386,27 @@ if (flag_big_memory is True):
 
     # Reference correct the images
     # Needs to be split between first half and second half
-    print('Applying reference correction...      ', end='')
+    print('Applying reference correction...', end='')
     N_proj = img.shape[0]
     Nh = N_proj // 2
-    for i in range(Nh):
-        print('\b\b\b\b\b\b(%3d%%)' % (100 * i // N_proj), end='')
-        img[i, :, :] = image_handling.external_reference(img[i, :, :], ff1, df)
-    for i in np.arange(Nh, N_proj):
-        print('\b\b\b\b\b\b(%3d%%)' % (100 * i // N_proj), end='')
-        img[i, :, :] = image_handling.external_reference(img[i, :, :], ff2, df)
-    print('\b\b\b\b\b\bdone  ')
+    image_handling.external_reference_stack(img[:Nh], ff1, df, out=img[:Nh])
+    image_handling.external_reference_stack(img[Nh:], ff2, df, out=img[Nh:])
+    print('done')
 
     # Make the meta data
     # Write the individual bim files
     os.chdir(path + path_process)
     print('Saving files...', end='')
-    txm_image.add_metadata_to_img(LOG, img, outdir='bim/', flag_Nexp=1, verbose=True)
+    txm_image.add_metadata_to_img(LOG, img, outdir='bim/', flag_Nexp=1,
+                                  verbose=True, num_threads=N_io)
     print('done')
+
+    # Record the finished projections
+    fn_bim = [path + path_process + 'bim/proj_%06d.bim' % (i)
+              for i in range(img.shape[0])]
+    for fn in fn_bim:
+        ckpt_proj.done(fn, fn_proj + fn_ref)
+    ckpt_proj.save()
 else:
     # Find total number of images
     N_total = 0
@@ -353,6 +421,22 @@ else:
     if (flag_bin):
         meta_tmp.pixelsize = B * meta_tmp.pixelsize
 
+    # Write the files in the background while the next image is processed
+    if (N_io > 0):
+        writer = txm_image.async_writer(num_threads=N_io)
+
+    # Scratch buffers of the outlier removal
+    scratch = None
+
+    # Prepare the references once for every image
+    ref1 = image_handling.log_reference(ff1, df)
+    ref2 = image_handling.log_reference(ff2, df)
+
+    # Write a projection and record it in the manifest
+    def write_proj(fn_out, img, meta, fn_in):
+        txm_image.write_file(fn_out, img, meta, verbose=False)
+        ckpt_proj.done(fn_out, fn_in)
+
     # Start looping through stacks
     N_count = 0
     for i in range(N):
@@ -362,27 +446,8 @@ else:
             # Output to screen
             print('Processing image (%06d/%06d)...' % (N_count+1, N_total),
                   end='')
-            # Load the image
-            img = txm_image.formats.tiff.read_tiff(fn, ind=ii)
-
-            # Despeckle the image
-            if (flag_despeckle):
-                img = image_handling.remove_outliers_scipy(img, delta=DS_delta,
-                                                           radius=DS_rad)
-            # Bin the images
-            if (flag_bin):
-                img = image_handling.bin_image_stack(img,
-                                                     bin_size=(B, B),
-                                                     method='average')
-
-            # Reference correct
-            if (ii < Nh):
-                img = image_handling.external_reference(img, ff1, df)
-            else:
-                img = image_handling.external_reference(img, ff2, df)
 
             # Modify metadata for the image
-            meta_tmp.height, meta_tmp.width = np.shape(img)
             th = LOG.th_start + np.floor(ii / np.double(LOG.num_exp) / np.double(LOG.num_mos)) * LOG.th_step
             meta_tmp.angles = np.deg2rad(th)
             meta_tmp.MotPos[3] = th
@@ -405,12 +470,62 @@ else:
                     fn_out = 'proj%09.4f_b.bim' % (th)
                 if (th >= 360):
                     continue
+
+            # Skip the image if it was already written
+            fn_out = path + path_process + fn_out
+            if (ckpt_proj.is_done(fn_out, [fn] + fn_ref)):
+                N_count += 1
+                print('done')
+                continue
+
+            # Load the image
+            img = txm_image.formats.tiff.read_tiff(fn, ind=ii,
+                                                   dtype=np.float32)
+
+            # Despeckle the image (the buffers are reused for every image)
+            if (flag_despeckle):
+                if (scratch is None):
+                    scratch = image_handling.outlier_scratch(img.shape)
+                image_handling.remove_outliers_scipy_stack(
+                    img, delta=DS_delta, radius=DS_rad, out=img,
+                    scratch=scratch,
+                    method='histogram' if (flag_DS_hist) else 'scipy')
+            # Bin the images
+            if (flag_bin):
+                img = image_handling.bin_image_stack(img,
+                                                     bin_size=(B, B),
+                                                     method='average')
+
+            # Reference correct
+            if (ii < Nh):
+                img = image_handling.external_reference_stack(img, ref1,
+                                                              out=img)
+            else:
+                img = image_handling.external_reference_stack(img, ref2,
+                                                              out=img)
+
+            # Set the size of the image
+            meta_tmp.height, meta_tmp.width = np.shape(img)
+
             # Write
             os.chdir(path + path_process)
-            txm_image.write_file(fn_out, img, meta_tmp, verbose=False)
+            if (N_io > 0):
+                writer.submit(write_proj, fn_out, img,
+                              copy.deepcopy(meta_tmp), [fn] + fn_ref)
+            else:
+                write_proj(fn_out, img, meta_tmp, [fn] + fn_ref)
             N_count += 1
             print('done')
 
+    # Wait for the files to be written
+    if (N_io > 0):
+        print('Finishing writing files...', end='')
+        writer.close()
+        print('done')
+
+    # Record the projections written since the last save
+    ckpt_proj.save()
+
 
 # %% Clear big memory items
 if (flag_clear_big):
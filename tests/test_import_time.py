@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+"""
+Check that importing txm_image and image_handling stays fast. Each package
+is imported in a new Python process (after NumPy, which every worker needs
+anyway), and it must not load any of the heavy modules that are only loaded
+when they are used, nor take longer than the budget.
+
+"""
+
+
+import os
+import subprocess
+import sys
+import pytest
+
+
+# The largest allowed import time (in seconds), of the fastest of N_runs
+budget = 0.25
+N_runs = 3
+
+# Modules that must not be loaded by importing the packages
+heavy = ['PIL', 'skimage', 'pywt', 'scipy', 'astra', 'matplotlib']
+
+# Code run in each new process
+code = ('import sys, time; import numpy; t = time.perf_counter(); '
+        'import %s; t = time.perf_counter() - t; '
+        'print(t); print(\' \'.join([m for m in %r if m in sys.modules]))')
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize('pkg', ['txm_image', 'image_handling'])
+def test_import(pkg):
+    times = []
+    for i in range(N_runs):
+        out = subprocess.check_output([sys.executable, '-c', code %
+                                       (pkg, heavy)], cwd=root)
+        lines = out.decode().splitlines() + ['']
+        times.append(float(lines[0]))
+        loaded = lines[1].split()
+        assert loaded == [], 'loaded heavy modules: %s' % (', '.join(loaded))
+    assert min(times) <= budget
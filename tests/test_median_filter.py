@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+"""
+Check that the histogram median filter gives the same result as SciPy.
+
+"""
+
+
+import numpy as np
+import pytest
+import scipy.ndimage
+import image_handling
+
+
+def projection(shape=(96, 80), counts=3000, seed=0):
+    """ Poisson counts through a smooth object, with bright outliers """
+    rng = np.random.default_rng(seed)
+    (y, x) = np.mgrid[:shape[0], :shape[1]] / float(max(shape))
+    mu = 0.8 * np.exp(-((y - 0.5)**2 + (x - 0.4)**2) / 0.2**2)
+    img = rng.poisson(counts * np.exp(-mu))
+    ind = rng.integers(0, img.size, size=img.size // 100)
+    img.flat[ind] += 4000
+    return img
+
+
+@pytest.mark.parametrize('dtype', [np.uint16, np.float32, np.float64])
+@pytest.mark.parametrize('size', [2, 3, 8, 11])
+@pytest.mark.parametrize('mode', ['reflect', 'mirror', 'nearest', 'wrap'])
+def test_same_as_scipy(dtype, size, mode):
+    img = projection().astype(dtype)
+    a = scipy.ndimage.median_filter(img, size=size, mode=mode)
+    b = image_handling.median_filter_hist(img, size=size, mode=mode,
+                                          min_size=0, max_bins=20000)
+    assert b.dtype == a.dtype
+    assert np.array_equal(a, b)
+
+
+def test_many_distinct_values():
+    img = np.log(projection().astype(np.float32) + 1.5)
+    a = scipy.ndimage.median_filter(img, size=9)
+    b = image_handling.median_filter_hist(img, size=9, min_size=0)
+    assert np.array_equal(a, b)
+
+
+def test_remove_outliers_histogram():
+    img = projection().astype(np.float32)
+    a = image_handling.remove_outliers_stack(img, delta=200, radius=4,
+                                             method='median')
+    b = image_handling.remove_outliers_stack(img, delta=200, radius=4,
+                                             method='histogram')
+    assert np.array_equal(a, b)
+    a = image_handling.remove_outliers_scipy_stack(img, delta=200, radius=9)
+    b = image_handling.remove_outliers_scipy_stack(img, delta=200, radius=9,
+                                                   method='histogram')
+    assert np.array_equal(a, b)
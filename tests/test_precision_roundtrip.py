@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+
+"""
+Check that images read from reduced precision files can be written back with
+their own metadata.
+
+"""
+
+
+import numpy as np
+import pytest
+from txm_image.formats import bim, bimstack, precision
+
+
+@pytest.mark.parametrize('storage', ['float16', 'uint16'])
+def test_write_bim_with_read_meta(tmp_path, storage):
+    img = np.linspace(-3, 250, 12 * 17, dtype=np.float32).reshape(12, 17)
+    fn = str(tmp_path / 'a.bim')
+    bim.write_bim(fn, img, storage=storage)
+    (img1, meta) = bim.read_bim(fn)
+    assert precision.parse_datatype(meta.datatype)[0] == storage
+
+    # Write the decoded image back as float32 with the metadata of the file
+    bim.write_bim(fn, img1, meta)
+    (img2, meta2) = bim.read_bim(fn)
+    assert meta2.datatype == 'float32'
+    assert np.array_equal(img2, img1)
+
+    # The same for a stack of files
+    bim.write_bim_stack(str(tmp_path / 's_%02d.bim'), img1[np.newaxis], meta)
+    (img3, _) = bim.read_bim(str(tmp_path / 's_00.bim'))
+    assert np.array_equal(img3, img1)
+
+
+@pytest.mark.parametrize('storage', ['float16', 'uint16'])
+def test_create_bimstack_with_read_meta(tmp_path, storage):
+    img = np.linspace(-3, 250, 12 * 17, dtype=np.float32).reshape(12, 17)
+    fn = str(tmp_path / 'a.bim')
+    bim.write_bim(fn, img, storage=storage)
+    (img1, meta) = bim.read_bim(fn)
+
+    fn = str(tmp_path / 'a.bimstack')
+    bimstack.write_bimstack(fn, img1[np.newaxis], meta)
+    (img2, _) = bimstack.read_bimstack(fn, 0)
+    assert np.array_equal(np.squeeze(img2), img1)
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64, np.uint16])
+def test_create_bimstack_datatype(tmp_path, dtype):
+    img = np.arange(2 * 12 * 17).reshape(2, 12, 17).astype(dtype)
+    fn = str(tmp_path / 'a.bimstack')
+    bimstack.write_bimstack(fn, img, dtype=dtype)
+    table = bimstack.read_header(fn)
+    assert table['datatype'][0] == np.dtype(dtype).name
+    (img1, _) = bimstack.read_bimstack(fn)
+    assert np.array_equal(img1, img)
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+"""
+Check that files without a known extension are found from their contents.
+
+"""
+
+
+import numpy as np
+from txm_image.formats import binfile, binsino, registry
+
+
+def test_sniff_binsino_and_binprj(tmp_path):
+    rng = np.random.default_rng(0)
+    fn = str(tmp_path / 'sino')
+    binsino.write_binsino(fn, rng.random((40, 30)).astype(np.float32),
+                          np.linspace(0, 180, 30))
+    assert registry.find_format(fn).name == 'binsino'
+
+    fn = str(tmp_path / 'proj')
+    binfile.write_bin(fn, (rng.random((40, 30)) * 1000).astype(np.float32))
+    assert registry.find_format(fn).name == 'binprj'
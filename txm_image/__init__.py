@@ -13,14 +13,21 @@ Started: 2017-01-24
 Last modified: 2017-02-07
 """
 
+import os
 import numpy as np
 import txm_image.formats
 import txm_image.microCT_scanlog
 from txm_image.add_metadata import add_metadata_to_img
 from txm_image.add_metadata import add_metadata_to_files
+from txm_image.async_writer import async_writer
+from txm_image.checkpoint import checkpoint
+from txm_image.formats.registry import find_format, register_format
+from txm_image.lazy_stack import lazy_stack
+from txm_image.projection_loader import load_projections
+from txm_image.transpose import projections_to_sinograms
 
 
-def read_file(fn, verbose=True):
+def read_file(fn, verbose=True, flag_memmap=False):
     """ A general function to read images
 
     Parameters
@@ -29,45 +36,29 @@ def read_file(fn, verbose=True):
         a string with the location of the file to be opened
     verbose -- boolean (default=True)
         a flag for extra output to the console
+    flag_memmap -- boolean (default=False)
+        return a read-only memory-mapped image for formats that support it
 
     Returns
     -------
     img -- NumPy array
         a NumPy array of the loaded image
     meta -- class metadata
-        a metadata class with the image information
+        a metadata class with the image information (for BIMSTACK files this
+        is the projection table of the stack)
 
     """
 
-    # Redirect to the correct import function
-    if (fn.endswith('.bim') or fn.endswith('.BIM')):
-        if (verbose):
-            print('Importing BIM file.')
-        img, meta = formats.bim.read_bim(fn)
-    elif (fn.endswith('.tif') or fn.endswith('.TIF')):
-        if (verbose):
-            print('Importing TIFF file.')
-        img = formats.tiff.read_tiff_stack_io(fn)
-        meta = None
-    elif (fn.endswith('.binprj') or fn.endswith('.BINPRJ')):
-        if (verbose):
-            print('Importing binprj file.')
-        img = formats.binfile.read_bin(fn)
-        meta = None
-    elif (fn.endswith('.binslice') or fn.endswith('.BINSLICE')):
-        if (verbose):
-            print('Importing binslice file.')
-        img = formats.binfile.read_bin(fn)
-        meta = None
-    elif (fn.endswith('.binsino') or fn.endswith('.BINSINO')):
-        if (verbose):
-            print('Importing binsino file.')
-        (img, meta) = formats.binsino.read_binsino(fn)
-        # meta = None
-    else:
+    # Find the format of the file
+    fmt = formats.registry.find_format(fn)
+    if (fmt is None):
         print('The image format was not found.')
-        img = None
-        meta = None
+        return None, None
+
+    # Read the file
+    if (verbose):
+        print('Importing %s file.' % (fmt.name))
+    (img, meta) = fmt.read(fn, flag_memmap=flag_memmap)
 
     return img, meta
 
@@ -82,7 +73,8 @@ def write_file(fn, img, meta=None, verbose=True):
     img -- NumPy array
         a NumPy array of the image
     meta -- class metadata (optional, default=None)
-        a metadata class with the image information
+        a metadata class with the image information (for BIMSTACK files this
+        can also be a list with a metadata class for each projection)
     verbose -- boolean (default=True)
         a flag for extra output to the console
 
@@ -92,28 +84,83 @@ def write_file(fn, img, meta=None, verbose=True):
 
     """
 
-    # Redirect to the correct import function
-    if (fn.endswith('.bim') or fn.endswith('.BIM')):
-        if (verbose):
-            print('Exporting BIM file.')
-        formats.bim.write_bim(fn, img, meta)
-    elif (fn.endswith('.tif') or fn.endswith('.TIF')):
-        if (verbose):
-            print('Exporting TIFF file.')
-        formats.tiff.write_tiff_stack_io(fn, img)
-    elif (fn.endswith('.binprj') or fn.endswith('.BINPRJ')):
-        if (verbose):
-            print('Exporting binprj file.')
-        formats.binfile.write_bin(fn, img)
-    elif (fn.endswith('.binslice') or fn.endswith('.BINSLICE')):
-        if (verbose):
-            print('Exporting binslice file.')
-        formats.binfile.write_bin(fn, img)
-    elif (fn.endswith('.binsino') or fn.endswith('.BINSINO')):
-        if (verbose):
-            print('Exporting binsino file.')
-        formats.binsino.write_binsino(fn, img, meta)
-    else:
+    # Find the format of the file (from the extension only, since the file
+    # may not exist yet)
+    fmt = formats.registry.find_format(fn, flag_sniff=False)
+    if (fmt is None):
         print('The image format was not found.')
+        return
+
+    # Write the file
+    if (verbose):
+        print('Exporting %s file.' % (fmt.name))
+    fmt.write(fn, img, meta)
 
     return
+
+
+def scan_headers(path, ext, verbose=True):
+    """ A general function to read the headers of all the images in a folder
+
+    Only the headers are read, so no pixel data is loaded.
+
+    Parameters
+    ----------
+    path -- string or list of strings
+        a string with the folder location of the files or a list of filenames
+    ext -- string
+        the filename extension of the files (this selects the format)
+    verbose -- boolean (default=True)
+        a flag for extra output to the console
+
+    Returns
+    -------
+    table -- NumPy structured array
+        an array with one record per file; every format has the fields 'fn',
+        'height', and 'width', and the remaining fields depend on the format
+        (see the scan_headers function of each format)
+
+    """
+
+    # Find the format of the extension
+    fmt = formats.registry.find_format_ext(ext)
+    if (fmt is None or not fmt.flag_header):
+        print('The image format was not found.')
+        return None
+
+    # Read the headers
+    if (verbose):
+        print('Scanning %s headers.' % (fmt.name))
+    table = fmt.scan_headers(path, ext)
+
+    return table
+
+
+def read_header(fn, verbose=True):
+    """ A general function to read the header of an image
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the location of the file to be opened
+    verbose -- boolean (default=True)
+        a flag for extra output to the console
+
+    Returns
+    -------
+    header -- NumPy record
+        a record with the same fields as the table from scan_headers (for
+        files holding several projections, such as BIMSTACK files, the table
+        with a record for each projection)
+
+    """
+
+    # Find the extension and scan the single file
+    ext = os.path.splitext(fn)[1]
+    table = scan_headers([fn], ext, verbose=verbose)
+    if (table is None):
+        return None
+    if (len(table) != 1):
+        return table
+
+    return table[0]
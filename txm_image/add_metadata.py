@@ -12,6 +12,7 @@ Last modified: 2017-02-07
 """
 
 import os
+import copy
 import numpy as np
 import txm_image
 
@@ -89,7 +90,8 @@ def add_metadata_to_files(scanlog, path, outdir='bim\\'):
 
 
 def add_metadata_to_img(scanlog, img, outdir='bim\\',
-                        flag_Nexp=0, verbose=False):
+                        flag_Nexp=0, verbose=False, flag_stack=False,
+                        num_threads=0):
     """
     Add metadata for images loaded in memory files
 
@@ -104,6 +106,12 @@ def add_metadata_to_img(scanlog, img, outdir='bim\\',
     flag_Nexp -- integer
         0 - use the scanlog file for number of exposures
         N - use N number of exposures
+    flag_stack -- boolean (default=False)
+        True - write all the projections to a single 'proj.bimstack' file
+        False - write each projection to its own 'proj_%06d.bim' file
+    num_threads -- integer (default=0)
+        0 - write the BIM files in the calling thread
+        N - write the BIM files with N background threads
 
     Returns
     -------
@@ -127,26 +135,51 @@ def add_metadata_to_img(scanlog, img, outdir='bim\\',
     th0 = scanlog.th_start
     del_th = scanlog.th_step
 
-    # Start moving through the files
+    # Calculate the angle and motor positions of each projection
     N = np.size(img, axis=0)
-    for i in range(N):
+    ind = np.arange(N)
+    meta.height, meta.width = img.shape[1:]
+    th = th0 + np.floor(ind / np.double(N_exp) / np.double(N_mos)) * del_th
+    MotPos = np.tile(np.ravel(meta.MotPos), (N, 1))
+    MotPos[:, 3] = th
+
+    # Convert postions to microns
+    MotPos[:, 0] = np.array(scanlog.X)[ind % N_mos] * -1000.
+    MotPos[:, 1] = np.array(scanlog.Y)[ind % N_mos] * 1000.
+
+    # Write the stack to a single file
+    if (flag_stack):
         if (verbose):
-            print('Working on image (%06d/%06d)...\r' % (i+1, N), end='')
-        tmp_img = img[i, :, :]
-        meta.height, meta.width = np.shape(tmp_img)
-        th = th0 + np.floor(i / np.double(N_exp) / np.double(N_mos)) * del_th
-        meta.angles = np.deg2rad(th)
-        meta.MotPos[3] = th
-
-        # Convert postions to microns
-        meta.MotPos[0] = scanlog.X[i % N_mos] * -1000.
-        meta.MotPos[1] = scanlog.Y[i % N_mos] * 1000.
-
-        # Write the file
-        tmp_str = 'proj_%06d.bim' % (i)
-        txm_image.write_file(outdir+tmp_str, tmp_img, meta, verbose=False)
+            print('Writing projection stack...', end='')
+        meta_stack = []
+        for i in range(N):
+            meta.angles = np.deg2rad(th[i])
+            meta.MotPos = MotPos[i]
+            meta_stack.append(copy.deepcopy(meta))
+        txm_image.write_file(outdir+'proj.bimstack', img, meta_stack,
+                             verbose=False)
         if (verbose):
             print('done')
+        return 0
+
+    # Write the files, packing the header template only once
+    if (verbose):
+        print('Writing %d projections...' % (N), end='')
+    fn = [outdir+'proj_%06d.bim' % (i) for i in range(N)]
+    if (num_threads > 0):
+        # Split the projections into blocks for the writer threads
+        writer = txm_image.async_writer(num_threads=num_threads)
+        step = max(1, -(-N // (4 * num_threads)))
+        for i in range(0, N, step):
+            writer.submit(txm_image.formats.bim.write_bim_stack,
+                          fn[i:i+step], img[i:i+step], meta,
+                          th=th[i:i+step], MotPos=MotPos[i:i+step])
+        writer.close()
+    else:
+        txm_image.formats.bim.write_bim_stack(fn, img, meta, th=th,
+                                              MotPos=MotPos)
+    if (verbose):
+        print('done')
 
     # Return
     return 0
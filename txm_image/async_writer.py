@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+"""
+Asynchronous Writer
+
+This class will write files in background threads, so the next image can be
+prepared while the previous one is written. Jobs are held in a bounded queue,
+so the main thread waits when the writers fall behind instead of holding an
+unlimited number of images in memory.
+
+Started: 2026-10-18
+Last modified: 2026-10-18
+
+"""
+
+import copy
+import queue
+import threading
+import txm_image
+
+
+class async_writer:
+    """
+    Write files with a pool of background threads
+
+    Parameters
+    ----------
+    num_threads -- integer (default=2)
+        the number of writer threads
+    max_queue -- integer (default=8)
+        the maximum number of jobs waiting to be written
+
+    Example
+    -------
+    writer = async_writer(num_threads=4)
+    for i in range(N):
+        img = ...
+        writer.write('proj_%06d.bim' % (i), img, meta)
+    writer.close()
+
+    """
+    def __init__(self, num_threads=2, max_queue=8):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.errors = []
+        self.threads = []
+        for i in range(max(num_threads, 1)):
+            t = threading.Thread(target=self._run)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def _run(self):
+        """ Take jobs from the queue until the stop signal (None) """
+        while (True):
+            job = self.queue.get()
+            if (job is None):
+                self.queue.task_done()
+                break
+            (func, args, kwargs) = job
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                self.errors.append(e)
+            self.queue.task_done()
+
+    def submit(self, func, *args, **kwargs):
+        """ Add a function call to the queue (waits if the queue is full)
+
+        The arguments must not be changed until the call has run.
+        """
+        if (len(self.threads) == 0):
+            raise RuntimeError('The writer has been closed.')
+        self.queue.put((func, args, kwargs))
+
+    def write(self, fn, img, meta=None):
+        """ Add a file to the queue (waits if the queue is full)
+
+        Parameters
+        ----------
+        fn -- string
+            a string with the location of the file to be written (use a full
+            path, since the working directory may change before it is written)
+        img -- NumPy array
+            a NumPy array of the image; it must not be changed until it has
+            been written
+        meta -- class metadata (optional, default=None)
+            a metadata class with the image information; a copy is queued, so
+            it can be changed for the next image straight away
+
+        Returns
+        -------
+        None
+
+        """
+        self.submit(txm_image.write_file, fn, img, copy.deepcopy(meta),
+                    verbose=False)
+
+    def flush(self):
+        """ Wait until every queued job has been written
+
+        Any error raised by a writer thread is raised here.
+        """
+        self.queue.join()
+        if (len(self.errors) > 0):
+            e = self.errors[0]
+            self.errors = []
+            raise e
+
+    def close(self):
+        """ Write every queued job and stop the writer threads """
+        for t in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
+        if (len(self.errors) > 0):
+            e = self.errors[0]
+            self.errors = []
+            raise e
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+"""
+Checkpoint
+
+This class will keep a manifest of the outputs that a processing stage has
+finished, so a script that is stopped part way through can be run again and
+only redo the work that is missing or out of date.
+
+Each output is recorded with a fingerprint (size and modification time) of
+the output file and of the input files it was made from. An output is done
+if it is in the manifest, its file has not changed, and its inputs have not
+changed. The parameters of the stage are recorded as well, and changing any
+of them starts the stage again from the beginning.
+
+The manifest is a JSON file that can hold several stages. It is written to a
+temporary file and then moved over the old manifest, so a crash while it is
+being written never leaves a broken manifest.
+
+Example
+-------
+ckpt = checkpoint(path + 'manifest.json', 'sinograms',
+                  params={'rot_axis': rot_axis})
+for i in range(N):
+    if (ckpt.is_done(fn_out[i], [fn_in[i]])):
+        continue
+    ...
+    ckpt.done(fn_out[i], [fn_in[i]])
+ckpt.save()
+
+Started: 2026-10-18
+Last modified: 2026-10-18
+
+"""
+
+import json
+import os
+import threading
+import time
+
+
+def fingerprint(fn):
+    """ The size and modification time (in ns) of a file (None if it does
+    not exist) """
+    try:
+        st = os.stat(fn)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _params_key(params):
+    """ A string that changes when any of the parameters change """
+    return json.dumps(params, sort_keys=True, default=str)
+
+
+class checkpoint:
+    """
+    Record the finished outputs of a processing stage
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the location of the manifest (JSON) file
+    stage -- string
+        the name of the stage
+    params -- dictionary (optional)
+        the parameters of the stage; the recorded outputs are discarded if
+        they were made with different parameters
+    save_interval -- float (default=10.0)
+        the longest time (in seconds) between saving the manifest when
+        outputs are recorded (0 saves after every output)
+
+    """
+    def __init__(self, fn, stage, params=None, save_interval=10.0):
+        self.fn = fn
+        self.stage = stage
+        self.params = _params_key(params)
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._last_save = time.time()
+
+        # Load the recorded outputs of the stage
+        data = self._load()
+        entry = data.get(stage, {})
+        if (entry.get('params') == self.params):
+            self.outputs = entry.get('outputs', {})
+        else:
+            self.outputs = {}
+
+    def _load(self):
+        """ Read all the stages of the manifest """
+        if (not os.path.isfile(self.fn)):
+            return {}
+        try:
+            f = open(self.fn, 'r')
+            data = json.load(f)
+            f.close()
+        except ValueError:
+            print('Warning: The manifest %s could not be read.' % (self.fn))
+            return {}
+        return data
+
+    def is_done(self, output, inputs=()):
+        """ Check if an output is finished and up to date
+
+        Parameters
+        ----------
+        output -- string
+            the output file (or the name of an output that is not a file)
+        inputs -- list of strings (optional)
+            the input files the output is made from
+
+        Returns
+        -------
+        flag -- boolean
+            True if the output does not need to be made again
+
+        """
+        with self._lock:
+            entry = self.outputs.get(output)
+        if (entry is None):
+            return False
+        if (entry['output'] is not None and
+                fingerprint(output) != entry['output']):
+            return False
+        record = dict([(i, fingerprint(i)) for i in inputs])
+        return record == entry['inputs']
+
+    def done(self, output, inputs=(), flag_file=True):
+        """ Record a finished output
+
+        Parameters
+        ----------
+        output -- string
+            the output file (or the name of an output that is not a file)
+        inputs -- list of strings (optional)
+            the input files the output was made from
+        flag_file -- boolean (default=True)
+            record the fingerprint of the output file (use False for outputs
+            that are not files, such as a slice of a volume)
+
+        Returns
+        -------
+        None
+
+        """
+        entry = {'output': fingerprint(output) if (flag_file) else None,
+                 'inputs': dict([(i, fingerprint(i)) for i in inputs])}
+        with self._lock:
+            self.outputs[output] = entry
+            flag_save = (time.time() - self._last_save >= self.save_interval)
+        if (flag_save):
+            self.save()
+
+    def reset(self):
+        """ Forget every recorded output of the stage """
+        with self._lock:
+            self.outputs = {}
+        self.save()
+
+    def save(self):
+        """ Write the manifest (the other stages in the file are kept) """
+        with self._lock:
+            data = self._load()
+            data[self.stage] = {'params': self.params,
+                                'outputs': dict(self.outputs)}
+            tmp = self.fn + '.tmp'
+            f = open(tmp, 'w')
+            json.dump(data, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            os.replace(tmp, self.fn)
+            self._last_save = time.time()
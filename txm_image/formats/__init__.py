@@ -1,8 +1,19 @@
 # -*- coding: utf-8 -*-
 
-from txm_image.formats import bim
-from txm_image.formats import binfile
-from txm_image.formats import binsino
-from txm_image.formats import tiff
+# The format modules are imported the first time they are used, so importing
+# txm_image does not load the dependencies of every format
+import importlib
 
-__all__ = ['bim', 'binfile', 'binsino', 'tiff']
+__all__ = ['bim', 'bimstack', 'binfile', 'binsino', 'binz',
+           'precision', 'registry', 'tiff', 'volume']
+
+
+def __getattr__(name):
+    if (name in __all__):
+        return importlib.import_module('txm_image.formats.' + name)
+    raise AttributeError("module 'txm_image.formats' has no attribute '%s'" %
+                         (name))
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + __all__)
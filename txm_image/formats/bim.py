@@ -14,6 +14,9 @@ Last modified: 2017-02-07
 
 
 import numpy as np
+from txm_image.formats import precision
+from txm_image.formats.utils import list_files, read_array
+from txm_image.formats.utils import read_array_roi, roi_range
 
 
 class metadata:
@@ -130,106 +133,387 @@ def create_metadata_from_scanlog(scanlog):
     return meta
 
 
-def read_bim(fn_img):
-    """ Function to read a BIM file
+def _bytechar2str(inchar):
+    """ Convert the byte characters to a string
 
     Parameters
     ----------
-    fn_img -- string
-        a string with the location of the filename
+    inchar -- bytes
+        the byte characters read from the file
+
+    Returns
+    -------
+    outstr -- string
+        the decoded string (undecodable characters are replaced by spaces)
+
+    """
+
+    try:
+        outstr = str(inchar, 'utf-8')
+    except:
+        outstr = ''
+        for i in inchar:
+            try:
+                outstr += str(bytes([i]), 'utf-8')
+            except:
+                outstr += ' '
+    return outstr
+
+
+def _read_bim_header(f):
+    """ Read and parse the header of an open BIM file
+
+    The string lengths are read first so that the size of the remaining
+    header is known, and the rest of the header is then read with a single
+    call and parsed from the buffer.
+
+    Parameters
+    ----------
+    f -- file object
+        a BIM file opened in binary mode and positioned at the start
 
     Returns
     -------
-    img -- NumPy array
-        a NumPy array of the image
     meta -- class metadata
         a metadata class with the image information
+    offset -- integer
+        the byte offset of the image data in the file
 
     """
 
-    # Define a local function to convert the byte characters to a string
-    def bytechar2str(inchar):
-        try:
-            outstr = str(inchar, 'utf-8')
-        except:
-            outstr = ''
-            for i in inchar:
-                try:
-                    outstr += str(i, 'utf-8')
-                except:
-                    outstr += ' '
-        return outstr
-
-    # Open the file
-    f = open(fn_img, 'rb')
-
     # Initialize metadata variable
     meta = metadata()
 
-    # Start reading in data
     # Read in string lengths
-    tmp = np.fromfile(f, dtype=np.uint32, count=4)
-    MotPosL = tmp[0]
-    datatypeL = tmp[1]
-    dateL = tmp[2]
-    AxisNamesL = tmp[3]
+    buf = f.read(16)
+    tmp = np.frombuffer(buf, dtype=np.uint32, count=4)
+    MotPosL = int(tmp[0])
+    datatypeL = int(tmp[1])
+    dateL = int(tmp[2])
+    AxisNamesL = int(tmp[3])
+
+    # Read in the rest of the header in one call
+    size = 36 + 4 * MotPosL + AxisNamesL + 8 + datatypeL + dateL
+    buf = f.read(size)
 
     # Read in image properties
-    tmp = np.fromfile(f, dtype=np.uint32, count=2)
+    tmp = np.frombuffer(buf, dtype=np.uint32, count=2, offset=0)
     meta.width = tmp[0]  # pixels
     meta.height = tmp[1]  # pixels
-    tmp = np.fromfile(f, dtype=np.float64, count=1)
-    meta.angles = tmp[0]  # radians
-    tmp = np.fromfile(f, dtype=np.float32, count=1)
-    meta.pixelsize = tmp[0]  # microns
-    tmp = np.fromfile(f, dtype=np.uint32, count=2)
+    meta.angles = np.frombuffer(buf, dtype=np.float64, count=1,
+                                offset=8)[0]  # radians
+    meta.pixelsize = np.frombuffer(buf, dtype=np.float32, count=1,
+                                   offset=16)[0]  # microns
+    tmp = np.frombuffer(buf, dtype=np.uint32, count=2, offset=20)
     meta.HBin = tmp[0]  # pixels
     meta.VBin = tmp[1]  # pixels
-    tmp = np.fromfile(f, dtype=np.float64, count=1)
-    meta.energy = tmp[0]  # eV
+    meta.energy = np.frombuffer(buf, dtype=np.float64, count=1,
+                                offset=28)[0]  # eV
 
     # Read motor positions into array
-    tmp = np.fromfile(f, dtype=np.float32, count=MotPosL)
-    meta.MotPos = tmp
+    a = 36
+    meta.MotPos = np.frombuffer(buf, dtype=np.float32, count=MotPosL,
+                                offset=a).copy()
+    a += 4 * MotPosL
 
     # Read motor labels
-    tmp = np.fromfile(f, dtype='c', count=AxisNamesL)
-    # meta.AxisNames = ''.join([chr(i) for i in tmp])
-    # meta.AxisNames = ''.join(tmp)
-    # meta.AxisNames = str(tmp, 'utf-8')
-    meta.AxisNames = bytechar2str(tmp)
+    meta.AxisNames = _bytechar2str(buf[a:a+AxisNamesL])
+    a += AxisNamesL
 
-    tmp = np.fromfile(f, dtype=np.float32, count=1)
-    meta.ExpTimes = tmp[0]  # seconds
-    tmp = np.fromfile(f, dtype=np.uint32, count=1)
-    meta.ImagesTaken = tmp[0]  # number of images taken
+    meta.ExpTimes = np.frombuffer(buf, dtype=np.float32, count=1,
+                                  offset=a)[0]  # seconds
+    meta.ImagesTaken = np.frombuffer(buf, dtype=np.uint32, count=1,
+                                     offset=a+4)[0]  # number of images taken
+    a += 8
 
     # Read in datatype
-    tmp = np.fromfile(f, dtype='c', count=datatypeL)
-    # meta.datatype = ''.join(tmp)
-    # meta.datatype = ''.join([chr(i) for i in tmp])
-    meta.datatype = bytechar2str(tmp)
+    meta.datatype = _bytechar2str(buf[a:a+datatypeL])
+    a += datatypeL
 
     # Read in date
-    tmp = np.fromfile(f, dtype='c', count=dateL)
-    # meta.date = ''.join(tmp)
-    # meta.date = ''.join([chr(i) for i in tmp])
-    meta.date = bytechar2str(tmp)
+    meta.date = _bytechar2str(buf[a:a+dateL])
+
+    # Return the metadata and the start of the image data
+    return meta, 16 + size
+
+
+def read_bim(fn_img, flag_memmap=False, dtype=np.float32, out=None,
+             rows=None, cols=None):
+    """ Function to read a BIM file
+
+    Parameters
+    ----------
+    fn_img -- string
+        a string with the location of the filename
+    flag_memmap -- boolean (default=False)
+        True -- return the image as a read-only memory-mapped view of the
+                file (Fortran-ordered), so pixel data is only loaded from
+                disk when it is accessed
+        False -- read the image into memory
+    dtype -- NumPy dtype (default=np.float32)
+        the data type of the returned image (None keeps the data type of the
+        file)
+    out -- NumPy array (optional)
+        an array to read the image into, which is returned as img
+    rows, cols -- tuple of integers or slice (optional)
+        the (start, stop) of the rows and columns to read; only the columns
+        in the region are read from the file (the image is Fortran-ordered),
+        and the whole image is read if not provided
+
+    Returns
+    -------
+    img -- NumPy array
+        a NumPy array of the image (a NumPy memmap if flag_memmap is True,
+        except for reduced precision files, which are always decoded into
+        memory)
+    meta -- class metadata
+        a metadata class with the image information (the height and width
+        are those of the region that was read)
+
+    """
+
+    # Open the file and read the header
+    f = open(fn_img, 'rb')
+    meta, offset = _read_bim_header(f)
+    shape = (int(meta.height), int(meta.width))
+    (mode, scale, zero) = precision.parse_datatype(meta.datatype)
+    (r0, r1) = roi_range(rows, shape[0])
+    (c0, c1) = roi_range(cols, shape[1])
+    flag_roi = ((r0, r1, c0, c1) != (0, shape[0], 0, shape[1]))
+    if (flag_roi):
+        meta.height, meta.width = (r1 - r0, c1 - c0)
 
     # Read in image data
-    img = np.fromfile(f, dtype=np.float32, count=meta.height*meta.width)
-    img = np.reshape(img, (meta.height, meta.width), order='F')
+    if (mode != 'float32'):
+        # Read the stored values and decode them
+        tmp = read_array_roi(f, offset, shape, precision.storage_dtype(mode),
+                             order='F', rows=(r0, r1), cols=(c0, c1))
+        f.close()
+        if (dtype is None):
+            dtype = np.float32
+        img = precision.decode(tmp, mode, scale, zero, dtype=dtype, out=out)
+    elif (flag_memmap and out is None):
+        f.close()
+        img = np.memmap(fn_img, dtype=np.float32, mode='r', offset=offset,
+                        shape=shape, order='F')
+        if (flag_roi):
+            img = img[r0:r1, c0:c1]
+    elif (flag_roi):
+        img = read_array_roi(f, offset, shape, np.float32, order='F',
+                             rows=(r0, r1), cols=(c0, c1), dtype=dtype,
+                             out=out)
+        f.close()
+    else:
+        img = read_array(f, offset, shape, np.float32, order='F',
+                         dtype=dtype, out=out)
 
-    # Close the file
-    f.close
+        # Close the file
+        f.close()
 
     # Return data
     return img, meta
 
 
-def write_bim(fn, img, meta=None):
+def read_header(fn_img):
+    """ Function to read only the header of a BIM file
+
+    Parameters
+    ----------
+    fn_img -- string
+        a string with the location of the filename
+
+    Returns
+    -------
+    meta -- class metadata
+        a metadata class with the image information
+
+    """
+
+    # Open the file and read the header
+    f = open(fn_img, 'rb')
+    meta, _ = _read_bim_header(f)
+    f.close()
+
+    # Return the metadata
+    return meta
+
+
+def scan_headers(path, ext='.bim'):
+    """ Read the headers of all the BIM files in a folder
+
+    Only the header of each file is read, so no pixel data is loaded.
+
+    Parameters
+    ----------
+    path -- string or list of strings
+        a string with the folder location of the files or a list of filenames
+    ext -- string (default='.bim')
+        the filename extension of the files
+
+    Returns
+    -------
+    table -- NumPy structured array
+        an array with one record per file with the fields 'fn', 'width',
+        'height', 'angles', 'pixelsize', 'HBin', 'VBin', 'energy', 'MotPos',
+        'ExpTimes', 'ImagesTaken', 'datatype', 'date', and 'offset' (the byte
+        offset of the image data), so for example the angles of all the
+        projections are table['MotPos'][:, 3]
+
+    """
+
+    # Find the files and read the headers
+    fn = list_files(path, ext)
+    meta = [None] * len(fn)
+    offset = [0] * len(fn)
+    for i in range(len(fn)):
+        f = open(fn[i], 'rb')
+        meta[i], offset[i] = _read_bim_header(f)
+        f.close()
+
+    # Build the table
+    MotPosL = max([len(m.MotPos) for m in meta] + [1])
+    fnL = max([len(i) for i in fn] + [1])
+    dt = np.dtype([('fn', 'U%d' % (fnL)),
+                   ('width', np.uint32), ('height', np.uint32),
+                   ('angles', np.float64), ('pixelsize', np.float32),
+                   ('HBin', np.uint32), ('VBin', np.uint32),
+                   ('energy', np.float64), ('MotPos', np.float32, (MotPosL,)),
+                   ('ExpTimes', np.float32), ('ImagesTaken', np.uint32),
+                   ('datatype', 'U64'), ('date', 'U32'),
+                   ('offset', np.int64)])
+    table = np.zeros((len(fn), ), dtype=dt)
+    for i in range(len(fn)):
+        m = meta[i]
+        table[i] = (fn[i], m.width, m.height, m.angles, m.pixelsize,
+                    m.HBin, m.VBin, m.energy, 0, m.ExpTimes, m.ImagesTaken,
+                    m.datatype, m.date, offset[i])
+        table['MotPos'][i, :len(m.MotPos)] = m.MotPos
+
+    # Return the table
+    return table
+
+
+def _header_dtype(MotPosL, AxisNamesL, datatypeL, dateL):
+    """ The (packed) data type of a BIM header with the given string lengths
+    """
+    fields = [('lengths', '<u4', (4, )), ('width', '<u4'), ('height', '<u4'),
+              ('angles', '<f8'), ('pixelsize', '<f4'), ('HBin', '<u4'),
+              ('VBin', '<u4'), ('energy', '<f8'),
+              ('MotPos', '<f4', (MotPosL, )), ('AxisNames', 'S%d'),
+              ('ExpTimes', '<f4'), ('ImagesTaken', '<u4'),
+              ('datatype', 'S%d'), ('date', 'S%d')]
+    L = {'AxisNames': AxisNamesL, 'datatype': datatypeL, 'date': dateL}
+    dt = []
+    for field in fields:
+        if (field[0] in L):
+            if (L[field[0]] == 0):
+                continue
+            field = (field[0], field[1] % (L[field[0]]))
+        dt.append(field)
+    return np.dtype(dt)
+
+
+def pack_bim_header(meta, img=None, datatype=None):
+    """ Pack the header of a BIM file into a single array
+
+    Parameters
+    ----------
+    meta -- class metadata
+        a metadata class with the image information
+    img -- NumPy array (optional)
+        the image; its shape is used for the width and height when provided
+    datatype -- string (optional)
+        the datatype string of the stored pixels (see
+        txm_image.formats.precision); 'float32' if not provided, since
+        meta.datatype describes the file the metadata was read from and not
+        the pixels being written
+
+    Returns
+    -------
+    hdr -- NumPy structured array
+        a single record with the header; hdr.tobytes() is the header as it is
+        stored in the file
+
+    """
+
+    # Encode the strings
+    MotPos = np.ravel(np.array(meta.MotPos, dtype=np.float32))
+    AxisNames = meta.AxisNames.encode('utf-8')
+    if (datatype is None):
+        datatype = precision.format_datatype('float32')
+    datatype = datatype.encode('utf-8')
+    date = meta.date.encode('utf-8')
+
+    # Fill in the header
+    hdr = np.zeros((1, ), dtype=_header_dtype(len(MotPos), len(AxisNames),
+                                             len(datatype), len(date)))
+    hdr['lengths'] = [len(MotPos), len(datatype), len(date), len(AxisNames)]
+    if (img is None):
+        (hdr['height'], hdr['width']) = (meta.height, meta.width)
+    else:
+        (hdr['height'], hdr['width']) = img.shape
+    hdr['angles'] = meta.angles
+    hdr['pixelsize'] = meta.pixelsize
+    hdr['HBin'] = meta.HBin
+    hdr['VBin'] = meta.VBin
+    hdr['energy'] = meta.energy
+    hdr['MotPos'] = MotPos
+    hdr['ExpTimes'] = meta.ExpTimes
+    hdr['ImagesTaken'] = meta.ImagesTaken
+    for (key, val) in (('AxisNames', AxisNames), ('datatype', datatype),
+                       ('date', date)):
+        if (len(val) > 0):
+            hdr[key] = val
+
+    return hdr
+
+
+def _file_buffer(hdr, shape, dtype=np.float32):
+    """ Allocate a buffer for a whole BIM file
+
+    Parameters
+    ----------
+    hdr -- NumPy structured array
+        the packed header from pack_bim_header
+    shape -- tuple of integers
+        the shape of the image (height, width)
+    dtype -- NumPy dtype (default=np.float32)
+        the data type of the stored image
+
+    Returns
+    -------
+    buf -- NumPy array
+        the bytes of the whole file
+    hdr_view -- NumPy structured array
+        the header as a view into buf
+    img_view -- NumPy array
+        the image (Fortran-ordered) as a view into buf
+
+    """
+
+    # Offset the start of the file so the image data is aligned
+    dtype = np.dtype(dtype)
+    size = hdr.dtype.itemsize
+    pad = -size % 16
+    tmp = np.empty((pad + size + dtype.itemsize * shape[0] * shape[1], ),
+                   dtype=np.uint8)
+    buf = tmp[pad:]
+
+    # Create the views of the header and the image
+    hdr_view = buf[:size].view(hdr.dtype)
+    hdr_view[...] = hdr
+    img_view = buf[size:].view(dtype).reshape(shape, order='F')
+
+    return buf, hdr_view, img_view
+
+
+def write_bim(fn, img, meta=None, storage='float32', scale=None,
+              offset=None):
     """ Function to write a BIM file
 
+    The header and the image are assembled in one buffer and written with a
+    single call.
+
     Parameters
     ----------
     fn -- string
@@ -238,6 +522,13 @@ def write_bim(fn, img, meta=None):
         a NumPy array with the image to be written
     meta -- class metadata (optional)
         a metadata class with the image information
+    storage -- string (default='float32')
+        the storage mode of the image ('float32', 'float16', or 'uint16'),
+        which is recorded as the datatype of the file (see
+        txm_image.formats.precision)
+    scale, offset -- float (optional)
+        the scale and offset of 'uint16' values; they are fitted to the
+        range of the image if not provided
 
     Returns
     -------
@@ -249,60 +540,97 @@ def write_bim(fn, img, meta=None):
     if (meta is None):
         meta = create_metadata(img)
 
-    # Open the file
+    # Assemble the file (converting and transposing the image in one step)
+    if (storage == 'float32'):
+        (buf, _, img_view) = _file_buffer(pack_bim_header(meta, img),
+                                          img.shape)
+        img_view[...] = img
+    else:
+        if (scale is None or offset is None):
+            (scale, offset) = precision.find_scale(img, storage)
+        datatype = precision.format_datatype(storage, scale, offset)
+        (buf, _, img_view) = _file_buffer(
+            pack_bim_header(meta, img, datatype=datatype), img.shape,
+            dtype=precision.storage_dtype(storage))
+        precision.encode(img, storage, scale, offset, out=img_view)
+
+    # Write the file
     f = open(fn, 'wb')
-
-    # Write string lengths
-    MotPosL = len(meta.MotPos)
-    datatypeL = len(meta.datatype)
-    dateL = len(meta.date)
-    AxisNamesL = len(meta.AxisNames)
-    tmp = np.array([MotPosL, datatypeL, dateL, AxisNamesL], dtype=np.uint32)
-    tmp.tofile(f)
-
-    # Write image properties
-    tmp = np.array([meta.width, meta.height], dtype=np.uint32)
-    tmp.tofile(f)
-    tmp = np.array([meta.angles], dtype=np.float64)
-    tmp.tofile(f)
-    tmp = np.array([meta.pixelsize], dtype=np.float32)
-    tmp.tofile(f)
-    tmp = np.array([meta.HBin, meta.VBin], dtype=np.uint32)
-    tmp.tofile(f)
-    tmp = np.array([meta.energy], dtype=np.float64)
-    tmp.tofile(f)
-
-    # Write motor positions
-    tmp = np.array(meta.MotPos, dtype=np.float32)
-    tmp.tofile(f)
-
-    # Write motor labels
-    # tmp = np.array(meta.AxisNames, dtype=np.chararray)
-    tmp = np.array(list(meta.AxisNames), dtype='c')
-    tmp.tofile(f)
-
-    tmp = np.array(meta.ExpTimes, dtype=np.float32)
-    tmp.tofile(f)
-    tmp = np.array(meta.ImagesTaken, dtype=np.uint32)
-    tmp.tofile(f)
-
-    # Write datatype
-    # tmp = np.array(meta.datatype, dtype=np.chararray)
-    tmp = np.array(list(meta.datatype), dtype='c')
-    tmp.tofile(f)
-
-    # Write date
-    # tmp = np.array(meta.date, dtype=np.chararray)
-    tmp = np.array(list(meta.date), dtype='c')
-    tmp.tofile(f)
-
-    # Write image data
-    tmp = img.astype(dtype=np.float32)
-    np.transpose(tmp).tofile(f)
-
-    # Close the file
-    f.close
+    f.write(buf)
+    f.close()
 
     # Return
     return
 
+
+def write_bim_stack(fn, img, meta=None, th=None, MotPos=None,
+                    storage='float32', scale=None, offset=None):
+    """ Function to write a stack of projections to BIM files
+
+    The header is packed once from the metadata template, and only the angle
+    and motor positions are changed for each projection. One buffer is
+    reused for every file, and each file is written with a single call.
+
+    Parameters
+    ----------
+    fn -- string or list of strings
+        a list with a filename for each projection, or a format string such
+        as 'proj_%06d.bim' that is filled in with the projection index
+    img -- NumPy array
+        a 3D stack of images (the first index is the projection)
+    meta -- class metadata (optional)
+        a metadata class with the information shared by all the projections
+    th -- NumPy array (optional)
+        the angle (in degrees) of each projection; it is stored in
+        MotPos[3] and (in radians) as the angle
+    MotPos -- NumPy array (optional)
+        the motor positions of each projection (projection, motor)
+    storage -- string (default='float32')
+        the storage mode of the images ('float32', 'float16', or 'uint16')
+    scale, offset -- float (optional)
+        the scale and offset of 'uint16' values; they are fitted to the
+        range of the whole stack if not provided, so every file shares them
+
+    Returns
+    -------
+    None
+
+    """
+
+    # Look for metadata and create some if not provided
+    N = img.shape[0]
+    if (meta is None):
+        meta = create_metadata(img[0])
+    if (isinstance(fn, str)):
+        fn = [fn % (i) for i in range(N)]
+
+    # Pack the header template and allocate the buffer
+    datatype = None
+    if (storage != 'float32'):
+        if (scale is None or offset is None):
+            (scale, offset) = precision.find_scale(img, storage)
+        datatype = precision.format_datatype(storage, scale, offset)
+    (buf, hdr, img_view) = _file_buffer(
+        pack_bim_header(meta, img[0], datatype=datatype), img.shape[1:],
+        dtype=precision.storage_dtype(storage))
+
+    # Write the projections
+    for i in range(N):
+        # Update the fields that change
+        if (MotPos is not None):
+            hdr['MotPos'][0, :MotPos.shape[1]] = MotPos[i]
+        if (th is not None):
+            hdr['angles'] = np.deg2rad(th[i])
+            hdr['MotPos'][0, 3] = th[i]
+        if (storage == 'float32'):
+            img_view[...] = img[i]
+        else:
+            precision.encode(img[i], storage, scale, offset, out=img_view)
+
+        # Write the file
+        f = open(fn[i], 'wb')
+        f.write(buf)
+        f.close()
+
+    # Return
+    return
@@ -0,0 +1,593 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module will load and write BIMSTACK files, which hold a whole stack of
+projections in a single file.
+
+The metadata that is shared by all the projections (image size, pixel size,
+binning, energy, axis names, ...) is stored once in the file header. The
+projections are stored in chunks, and each chunk begins with a table of the
+metadata that changes between projections (angle, motor positions, exposure
+time, and number of images taken) followed by the (C-ordered) image data.
+Projections can be appended to the file, and any projection can be read by
+index or by angle, either into memory or as a memory-mapped view.
+
+File layout (little-endian)
+---------------------------
+header -- _HEADER record followed by the AxisNames, datatype and date strings
+chunk -- _CHUNK record, then `capacity` records of the projection table, then
+         `capacity` images; the table and the images both start on a
+         _ALIGN byte boundary
+
+Started: 2026-10-18
+Last modified: 2026-10-18
+"""
+
+
+import numpy as np
+from txm_image.formats import bim
+from txm_image.formats import precision
+from txm_image.formats.utils import list_files
+
+
+# Magic bytes and version of the file format
+_MAGIC = b'BIMSTACK'
+_VERSION = 1
+
+# Alignment (in bytes) of the projection tables and the image data
+_ALIGN = 4096
+
+# Fixed part of the file header
+_HEADER = np.dtype([('magic', 'S8'), ('version', '<u4'),
+                    ('header_size', '<u4'), ('height', '<u4'),
+                    ('width', '<u4'), ('dtype', 'S8'), ('chunk_size', '<u4'),
+                    ('MotPosL', '<u4'), ('pixelsize', '<f4'),
+                    ('HBin', '<u4'), ('VBin', '<u4'), ('energy', '<f8'),
+                    ('AxisNamesL', '<u4'), ('datatypeL', '<u4'),
+                    ('dateL', '<u4')])
+
+# Chunk header
+_CHUNK = np.dtype([('magic', 'S4'), ('count', '<u4'), ('capacity', '<u4'),
+                   ('reserved', '<u4')])
+
+
+def _align(n):
+    """ Round a number of bytes up to the next _ALIGN boundary """
+    return -(-n // _ALIGN) * _ALIGN
+
+
+def _record_dtype(MotPosL):
+    """ The data type of one entry in the projection table """
+    return np.dtype([('angles', '<f8'), ('MotPos', '<f4', (MotPosL, )),
+                     ('ExpTimes', '<f4'), ('ImagesTaken', '<u4')])
+
+
+class _stack_info:
+    """
+    Define a class to hold the layout of an open BIMSTACK file
+    """
+    def __init__(self):
+        self.header = []
+        self.AxisNames = []
+        self.datatype = []
+        self.date = []
+        self.dtype = []
+        self.storage = []
+        self.record = []
+        self.frame_bytes = []
+        self.chunks = []
+
+
+def _chunk_layout(info, start, capacity):
+    """ Return the offsets of the table, the image data, and the end of a
+    chunk that starts at byte `start` """
+    table = _align(start + _CHUNK.itemsize)
+    data = _align(table + capacity * info.record.itemsize)
+    end = data + capacity * info.frame_bytes
+    return table, data, end
+
+
+def _read_info(f):
+    """ Read the header and find the chunks of an open BIMSTACK file
+
+    Parameters
+    ----------
+    f -- file object
+        a BIMSTACK file opened in binary mode
+
+    Returns
+    -------
+    info -- class _stack_info
+        the layout of the file, or None if it is not a BIMSTACK file
+
+    """
+
+    # Read the fixed part of the header
+    f.seek(0)
+    buf = f.read(_HEADER.itemsize)
+    if (len(buf) < _HEADER.itemsize or not buf.startswith(_MAGIC)):
+        return None
+    info = _stack_info()
+    info.header = np.frombuffer(buf, dtype=_HEADER)[0]
+    hdr = info.header
+
+    # Read the shared strings
+    buf = f.read(int(hdr['header_size']) - _HEADER.itemsize)
+    a = int(hdr['AxisNamesL'])
+    b = a + int(hdr['datatypeL'])
+    c = b + int(hdr['dateL'])
+    info.AxisNames = bim._bytechar2str(buf[:a])
+    info.datatype = bim._bytechar2str(buf[a:b])
+    info.date = bim._bytechar2str(buf[b:c])
+
+    # Data types of the images and the projection table
+    info.dtype = np.dtype(hdr['dtype'].decode('ascii'))
+    info.storage = precision.parse_datatype(info.datatype)
+    info.record = _record_dtype(int(hdr['MotPosL']))
+    info.frame_bytes = int(hdr['height']) * int(hdr['width']) * \
+        info.dtype.itemsize
+
+    # Walk through the chunks
+    start = _align(int(hdr['header_size']))
+    while (True):
+        f.seek(start)
+        buf = f.read(_CHUNK.itemsize)
+        if (len(buf) < _CHUNK.itemsize):
+            break
+        chunk = np.frombuffer(buf, dtype=_CHUNK)[0]
+        if (chunk['magic'] != b'CHNK'):
+            break
+        capacity = int(chunk['capacity'])
+        (table, data, end) = _chunk_layout(info, start, capacity)
+        info.chunks.append([start, int(chunk['count']), capacity, table,
+                            data])
+        start = end
+
+    return info
+
+
+def _locate(info, ind):
+    """ Find the chunk and the position in the chunk of projection `ind` """
+    for chunk in info.chunks:
+        if (ind < chunk[1]):
+            return chunk, ind
+        ind -= chunk[1]
+    raise IndexError('Projection index out of range.')
+
+
+def _num_frames(info):
+    """ The total number of projections in the file """
+    return sum([chunk[1] for chunk in info.chunks])
+
+
+def _make_records(info, meta, N):
+    """ Build the projection table entries from one or N metadata classes """
+    if (not isinstance(meta, (list, tuple))):
+        meta = [meta] * N
+    records = np.zeros((N, ), dtype=info.record)
+    L = int(info.header['MotPosL'])
+    for i in range(N):
+        MotPos = np.ravel(np.array(meta[i].MotPos, dtype=np.float32))[:L]
+        records['angles'][i] = meta[i].angles
+        records['MotPos'][i, :len(MotPos)] = MotPos
+        records['ExpTimes'][i] = meta[i].ExpTimes
+        records['ImagesTaken'][i] = meta[i].ImagesTaken
+    return records
+
+
+def create_bimstack(fn, meta, chunk_size=64, dtype=np.float32, storage=None,
+                    scale=1.0, offset=0.0):
+    """ Create an empty BIMSTACK file
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename
+    meta -- class metadata
+        a metadata class with the information shared by all the projections
+        (the height and width must be set)
+    chunk_size -- integer (default=64)
+        the number of projections in each new chunk when appending
+    dtype -- NumPy dtype (default=np.float32)
+        the data type of the stored images
+    storage -- string (optional)
+        a reduced precision storage mode ('float16' or 'uint16'), which
+        replaces dtype and is recorded as the datatype of the file (see
+        txm_image.formats.precision)
+    scale, offset -- float (default=1.0, 0.0)
+        the scale and offset of 'uint16' values, shared by every projection
+        that is appended
+
+    Returns
+    -------
+    None
+
+    """
+
+    # Encode the strings
+    AxisNames = meta.AxisNames.encode('utf-8')
+    if (storage is None):
+        # The pixels are stored as dtype, so meta.datatype (from the file the
+        # metadata was read from) must not be copied
+        datatype = np.dtype(dtype).name.encode('utf-8')
+    else:
+        dtype = precision.storage_dtype(storage)
+        datatype = precision.format_datatype(storage, scale,
+                                             offset).encode('utf-8')
+    date = meta.date.encode('utf-8')
+
+    # Fill in the header
+    hdr = np.zeros((1, ), dtype=_HEADER)
+    hdr['magic'] = _MAGIC
+    hdr['version'] = _VERSION
+    hdr['header_size'] = _HEADER.itemsize + len(AxisNames) + \
+        len(datatype) + len(date)
+    hdr['height'] = meta.height
+    hdr['width'] = meta.width
+    hdr['dtype'] = np.dtype(dtype).newbyteorder('<').str.encode('ascii')
+    hdr['chunk_size'] = chunk_size
+    hdr['MotPosL'] = len(np.ravel(meta.MotPos))
+    hdr['pixelsize'] = meta.pixelsize
+    hdr['HBin'] = meta.HBin
+    hdr['VBin'] = meta.VBin
+    hdr['energy'] = meta.energy
+    hdr['AxisNamesL'] = len(AxisNames)
+    hdr['datatypeL'] = len(datatype)
+    hdr['dateL'] = len(date)
+
+    # Write the header
+    f = open(fn, 'wb')
+    f.write(hdr.tobytes() + AxisNames + datatype + date)
+    f.close()
+
+    return
+
+
+def append_bimstack(fn, img, meta):
+    """ Append projections to a BIMSTACK file
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename
+    img -- NumPy array
+        a 2D image or a 3D stack of images (the first index is the projection)
+    meta -- class metadata or list of class metadata
+        the metadata for each projection (the angle, motor positions,
+        exposure time, and number of images taken are stored); a single
+        metadata class is used for all the projections
+
+    Returns
+    -------
+    N -- integer
+        the number of projections in the file
+
+    """
+
+    # Make sure there is a stack of images
+    if (img.ndim == 2):
+        img = img[np.newaxis]
+    N = img.shape[0]
+
+    # Open the file
+    f = open(fn, 'r+b')
+    info = _read_info(f)
+    records = _make_records(info, meta, N)
+
+    # Fill the last chunk and then add new chunks
+    i = 0
+    while (i < N):
+        if (len(info.chunks) == 0 or info.chunks[-1][1] == info.chunks[-1][2]):
+            # Add a new chunk at the end of the file
+            if (len(info.chunks) == 0):
+                start = _align(int(info.header['header_size']))
+            else:
+                start = _chunk_layout(info, info.chunks[-1][0],
+                                      info.chunks[-1][2])[2]
+            capacity = max(int(info.header['chunk_size']), 1)
+            (table, data, end) = _chunk_layout(info, start, capacity)
+            f.truncate(end)
+            info.chunks.append([start, 0, capacity, table, data])
+        chunk = info.chunks[-1]
+
+        # Write as many projections as will fit in the chunk
+        n = min(N - i, chunk[2] - chunk[1])
+        f.seek(chunk[3] + chunk[1] * info.record.itemsize)
+        f.write(records[i:i+n].tobytes())
+        f.seek(chunk[4] + chunk[1] * info.frame_bytes)
+        if (info.storage[0] == 'float32'):
+            np.ascontiguousarray(img[i:i+n], dtype=info.dtype).tofile(f)
+        else:
+            precision.encode(img[i:i+n], *info.storage).tofile(f)
+
+        # Update the chunk header
+        chunk[1] += n
+        tmp = np.array([(b'CHNK', chunk[1], chunk[2], 0)], dtype=_CHUNK)
+        f.seek(chunk[0])
+        f.write(tmp.tobytes())
+        i += n
+
+    # Close the file
+    N = _num_frames(info)
+    f.close()
+
+    return N
+
+
+def write_bimstack(fn, img, meta=None, dtype=np.float32, storage=None,
+                   scale=None, offset=None):
+    """ Write a stack of projections to a BIMSTACK file
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename
+    img -- NumPy array
+        a 3D stack of images (the first index is the projection)
+    meta -- class metadata or list of class metadata (optional)
+        the metadata for each projection; a single metadata class is used for
+        all the projections, and default metadata is created if not provided
+    dtype -- NumPy dtype (default=np.float32)
+        the data type of the stored images
+    storage -- string (optional)
+        a reduced precision storage mode ('float16' or 'uint16'), which
+        replaces dtype
+    scale, offset -- float (optional)
+        the scale and offset of 'uint16' values; they are fitted to the
+        range of the stack if not provided
+
+    Returns
+    -------
+    None
+
+    """
+
+    # Make sure there is a stack of images
+    if (img.ndim == 2):
+        img = img[np.newaxis]
+
+    # Look for metadata and create some if not provided
+    if (meta is None):
+        meta = bim.create_metadata(img[0])
+    if (isinstance(meta, (list, tuple))):
+        template = meta[0]
+    else:
+        template = meta
+    template.height, template.width = img.shape[1:]
+
+    # Fit the range of reduced precision values
+    if (storage is not None and (scale is None or offset is None)):
+        (scale, offset) = precision.find_scale(img, storage)
+
+    # Write everything into a single chunk
+    create_bimstack(fn, template, chunk_size=img.shape[0], dtype=dtype,
+                    storage=storage, scale=scale, offset=offset)
+    append_bimstack(fn, img, meta)
+
+    return
+
+
+def read_header(fn):
+    """ Read the projection table of a BIMSTACK file
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename
+
+    Returns
+    -------
+    table -- NumPy structured array
+        an array with one record per projection with the same fields as
+        bim.scan_headers, plus 'index' (the position in the stack)
+
+    """
+
+    return scan_headers([fn])
+
+
+def scan_headers(path, ext='.bimstack'):
+    """ Read the projection tables of all the BIMSTACK files in a folder
+
+    Parameters
+    ----------
+    path -- string or list of strings
+        a string with the folder location of the files or a list of filenames
+    ext -- string (default='.bimstack')
+        the filename extension of the files
+
+    Returns
+    -------
+    table -- NumPy structured array
+        an array with one record per projection with the same fields as
+        bim.scan_headers, plus 'index' (the position of the projection in its
+        file)
+
+    """
+
+    # Find the files and read the layouts
+    fn = list_files(path, ext)
+    infos = []
+    for i in range(len(fn)):
+        f = open(fn[i], 'rb')
+        infos.append(_read_info(f))
+        f.close()
+
+    # Build the table
+    MotPosL = max([int(i.header['MotPosL']) for i in infos] + [1])
+    fnL = max([len(i) for i in fn] + [1])
+    dt = np.dtype([('fn', 'U%d' % (fnL)), ('index', np.int64),
+                   ('width', np.uint32), ('height', np.uint32),
+                   ('angles', np.float64), ('pixelsize', np.float32),
+                   ('HBin', np.uint32), ('VBin', np.uint32),
+                   ('energy', np.float64), ('MotPos', np.float32, (MotPosL,)),
+                   ('ExpTimes', np.float32), ('ImagesTaken', np.uint32),
+                   ('datatype', 'U64'), ('date', 'U32'),
+                   ('offset', np.int64)])
+    tables = []
+    for i in range(len(fn)):
+        info = infos[i]
+        f = open(fn[i], 'rb')
+        for chunk in info.chunks:
+            n = chunk[1]
+            f.seek(chunk[3])
+            rec = np.frombuffer(f.read(n * info.record.itemsize),
+                                dtype=info.record)
+            table = np.zeros((n, ), dtype=dt)
+            table['fn'] = fn[i]
+            table['width'] = info.header['width']
+            table['height'] = info.header['height']
+            table['pixelsize'] = info.header['pixelsize']
+            table['HBin'] = info.header['HBin']
+            table['VBin'] = info.header['VBin']
+            table['energy'] = info.header['energy']
+            table['datatype'] = info.datatype
+            table['date'] = info.date
+            table['angles'] = rec['angles']
+            table['MotPos'][:, :rec['MotPos'].shape[1]] = rec['MotPos']
+            table['ExpTimes'] = rec['ExpTimes']
+            table['ImagesTaken'] = rec['ImagesTaken']
+            table['offset'] = chunk[4] + \
+                np.arange(n, dtype=np.int64) * info.frame_bytes
+            tables.append(table)
+        f.close()
+    if (len(tables) == 0):
+        return np.zeros((0, ), dtype=dt)
+    table = np.concatenate(tables)
+
+    # Number the projections in each file
+    for i in range(len(fn)):
+        loc = (table['fn'] == fn[i])
+        table['index'][loc] = np.arange(np.count_nonzero(loc))
+
+    # Return the table
+    return table
+
+
+def read_bimstack(fn, ind=None, flag_memmap=False, out=None):
+    """ Read projections from a BIMSTACK file
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename
+    ind -- integer, slice, or list of integers (optional)
+        the projections to read; all the projections are read if not
+        provided
+    flag_memmap -- boolean (default=False)
+        True -- return read-only memory-mapped views of the file, so pixel
+                data is only loaded from disk when it is accessed (a stack
+                that spans several chunks is joined into a new array, and
+                reduced precision images are always decoded into memory)
+        False -- read the images into memory
+    out -- NumPy array (optional)
+        an array to read the images into, which is returned as img
+
+    Returns
+    -------
+    img -- NumPy array
+        a 2D image for an integer index, otherwise a 3D stack of images
+    table -- NumPy structured array
+        the projection table entries of the images that were read
+
+    """
+
+    # Read the layout and the projection table
+    f = open(fn, 'rb')
+    info = _read_info(f)
+    f.close()
+    table = read_header(fn)
+    N = len(table)
+    (h, w) = (int(info.header['height']), int(info.header['width']))
+
+    # Find the requested projections
+    if (ind is None):
+        loc = np.arange(N)
+    elif (isinstance(ind, slice)):
+        loc = np.arange(N)[ind]
+    else:
+        loc = np.atleast_1d(np.arange(N)[ind])
+
+    # Copy the projections into the output array
+    single = (ind is not None and np.ndim(ind) == 0 and
+              not isinstance(ind, slice))
+    if (out is not None):
+        dst = out[np.newaxis] if (single) else out
+        start = 0
+        for chunk in info.chunks:
+            mm = np.memmap(fn, dtype=info.dtype, mode='r', offset=chunk[4],
+                           shape=(chunk[1], h, w))
+            for k in np.nonzero((loc >= start) & (loc < start + chunk[1]))[0]:
+                precision.decode(mm[loc[k] - start], *info.storage,
+                                 out=dst[k])
+            start += chunk[1]
+            del mm
+        if (single):
+            return out, table[loc[0]]
+        return out, table[loc]
+
+    # Load each chunk that holds requested projections
+    parts = []
+    start = 0
+    for chunk in info.chunks:
+        sel = loc[(loc >= start) & (loc < start + chunk[1])] - start
+        start += chunk[1]
+        if (len(sel) == 0):
+            continue
+        mm = np.memmap(fn, dtype=info.dtype, mode='r', offset=chunk[4],
+                       shape=(chunk[1], h, w))
+        if (flag_memmap and len(sel) == chunk[1] and
+                np.all(sel == np.arange(chunk[1]))):
+            parts.append(mm)
+        elif (flag_memmap and len(sel) == 1):
+            parts.append(mm[sel[0]:sel[0]+1])
+        else:
+            parts.append(np.array(mm[sel]))
+        del mm
+
+    # Join the chunks
+    if (len(parts) == 1):
+        img = parts[0]
+    elif (len(parts) == 0):
+        img = np.zeros((0, h, w), dtype=info.dtype)
+    else:
+        img = np.concatenate(parts)
+
+    # Decode reduced precision images
+    if (info.storage[0] != 'float32'):
+        img = precision.decode(img, *info.storage)
+
+    # Return a single image for an integer index
+    if (single):
+        return img[0], table[loc[0]]
+
+    return img, table[loc]
+
+
+def read_bimstack_angle(fn, th, flag_memmap=False):
+    """ Read the projection closest to an angle from a BIMSTACK file
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename
+    th -- float
+        the angle (in degrees, compared to MotPos[3])
+    flag_memmap -- boolean (default=False)
+        return a read-only memory-mapped view of the projection
+
+    Returns
+    -------
+    img -- NumPy array
+        a NumPy array of the image
+    record -- NumPy record
+        the projection table entry of the image
+
+    """
+
+    # Find the closest angle
+    table = read_header(fn)
+    ind = int(np.argmin(np.abs(table['MotPos'][:, 3] - th)))
+
+    # Read the projection
+    return read_bimstack(fn, ind, flag_memmap=flag_memmap)
@@ -12,15 +12,24 @@ Last modified: 2017-02-07
 
 
 import numpy as np
+from txm_image.formats.utils import list_files, read_array_roi
 
 
-def read_bin(fn):
+def read_bin(fn, dtype=np.float32, out=None, rows=None, cols=None):
     """" Function to read a binprj or binslice file
 
     Parameters
     ----------
     fn -- string
         a string with the filename
+    dtype -- NumPy dtype (default=np.float32)
+        the data type of the returned image
+    out -- NumPy array (optional)
+        an array to read the image into, which is returned as img
+    rows, cols -- tuple of integers or slice (optional)
+        the (start, stop) of the rows and columns to read; only the columns
+        in the region are read from the file (the image is Fortran-ordered),
+        and the whole image is read if not provided
 
     Returns
     -------
@@ -34,23 +43,81 @@ def read_bin(fn):
 
     # Get the size of the file
     tmp = np.fromfile(f, dtype=np.float32, count=2)
-    h = np.int(tmp[0])
-    w = np.int(tmp[1])
-
-    # Initialize image array
-    img = np.zeros((h, w), dtype='float32')
+    h = int(tmp[0])
+    w = int(tmp[1])
 
     # Read in values
-    img = np.fromfile(f, dtype=np.float32, count=h*w)
-    img = np.reshape(img, (h, w), order='F')
+    img = read_array_roi(f, 8, (h, w), np.float32, order='F', rows=rows,
+                         cols=cols, dtype=dtype, out=out)
 
     # Close the file
-    f.close
+    f.close()
 
     # Return the image as a NumPy array
     return img
 
 
+def read_header(fn):
+    """ Function to read only the image size of a binprj or binslice file
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename
+
+    Returns
+    -------
+    h -- integer
+        the height of the image
+    w -- integer
+        the width of the image
+
+    """
+
+    # Open the file and read the size of the image
+    f = open(fn, 'rb')
+    tmp = np.frombuffer(f.read(8), dtype=np.float32, count=2)
+    f.close()
+
+    # Return the size
+    return int(tmp[0]), int(tmp[1])
+
+
+def scan_headers(path, ext='.binprj'):
+    """ Read the image sizes of all the binprj or binslice files in a folder
+
+    Parameters
+    ----------
+    path -- string or list of strings
+        a string with the folder location of the files or a list of filenames
+    ext -- string (default='.binprj')
+        the filename extension of the files
+
+    Returns
+    -------
+    table -- NumPy structured array
+        an array with one record per file with the fields 'fn', 'height',
+        'width', and 'offset' (the byte offset of the image data)
+
+    """
+
+    # Find the files
+    fn = list_files(path, ext)
+    fnL = max([len(i) for i in fn] + [1])
+    dt = np.dtype([('fn', 'U%d' % (fnL)),
+                   ('height', np.uint32), ('width', np.uint32),
+                   ('offset', np.int64)])
+    table = np.zeros((len(fn), ), dtype=dt)
+
+    # Read the sizes
+    for i in range(len(fn)):
+        (h, w) = read_header(fn[i])
+        table[i] = (fn[i], h, w, 8)
+
+    # Return the table
+    return table
+
+
 def write_bin(fn, img):
     """ Function to write a binprj or binslice file
 
@@ -5,6 +5,18 @@ This module will load BINSINO files.
 The read functions will return a NumPy array of the image and angle information
 The write functions will require the image in a NumPy array.
 
+It will also load BINSINOVOL files, which hold the sinograms of every detector
+row in a single file. The angles are stored once in the header, and the
+sinograms are stored row after row so any row can be read directly or through
+a memory map.
+
+BINSINOVOL layout (little-endian)
+---------------------------------
+header -- _VOL_HEADER record followed by the angles (float32); version 1
+          files have no storage, scale and zero fields
+data -- starts on a _VOL_ALIGN byte boundary, C-ordered with the shape
+        (row, angle, column)
+
 Written by: Andy Kiss
 Started: 2017-01-24
 Last modified: 2017-02-07
@@ -12,22 +24,44 @@ Last modified: 2017-02-07
 
 
 import numpy as np
+from txm_image.formats import precision
+from txm_image.formats.utils import list_files, roi_range
+
 
+# Magic bytes, header, and data alignment of BINSINOVOL files
+_VOL_MAGIC = b'BINSINOV'
+_VOL_HEADER_V1 = np.dtype([('magic', 'S8'), ('version', '<u4'),
+                           ('header_size', '<u4'), ('rows', '<u4'),
+                           ('angles', '<u4'), ('cols', '<u4'),
+                           ('dtype', 'S8'), ('offset', '<u8')])
+_VOL_HEADER = np.dtype(_VOL_HEADER_V1.descr +
+                       [('storage', 'S8'), ('scale', '<f8'), ('zero', '<f8')])
+_VOL_ALIGN = 4096
 
-def read_binsino(fn):
+
+def read_binsino(fn, dtype=np.float32, out=None, rows=None, cols=None):
     """ Function to read a binsino file
 
     Parameters
     ----------
     fn -- string
         a string with the file name
+    dtype -- NumPy dtype (default=np.float32)
+        the data type of the returned sinogram
+    out -- NumPy array (optional)
+        an array to read the sinogram into, which is returned as img
+    rows, cols -- tuple of integers or slice (optional)
+        the (start, stop) of the rows (detector columns) and columns (angles)
+        of the sinogram to read; only the angles in the region are read from
+        the file (the sinogram is Fortran-ordered), and the whole sinogram is
+        read if not provided
 
     Returns
     -------
     img -- NumPy array
         a NumPy array of the image
     th -- NumPy array
-        a NumPy array of the angles
+        a NumPy array of the angles (of the region)
 
     """
 
@@ -36,26 +70,110 @@ def read_binsino(fn):
 
     # Get the size of the file
     tmp = np.fromfile(f, dtype=np.float32, count=2)
-    h = np.int(tmp[0])
-    w = np.int(tmp[1])
+    h = int(tmp[0])
+    w = int(tmp[1])
 
-    # Read in all the data
-    tmp = np.fromfile(f, dtype=np.float32, count=w*h)
-    tmp = np.reshape(tmp, (h, w), order='F')
+    # Map the angles in the region, including the row of angles
+    (r0, r1) = roi_range(rows, h - 1)
+    (c0, c1) = roi_range(cols, w)
+    tmp = np.memmap(f, dtype=np.float32, mode='r', offset=8 + 4 * h * c0,
+                    shape=(h, c1 - c0), order='F')
 
     # Isolate the angle information
-    th = tmp[0, :]
+    th = np.array(tmp[0, :])
 
     # Isolate the sinogram
-    sino = tmp[1:, :]
+    if (out is None):
+        if (dtype is None):
+            dtype = np.float32
+        sino = np.empty((r1 - r0, c1 - c0), dtype=dtype, order='F')
+    else:
+        sino = out
+    np.copyto(sino, tmp[1 + r0:1 + r1, :], casting='unsafe')
+    del tmp
 
     # Close the file
-    f.close
+    f.close()
 
     # Return the sinogram and angle information
     return sino, th
 
 
+def read_header(fn):
+    """ Function to read the size and angles of a binsino file
+
+    The angles are read through a memory map, so the sinogram itself is not
+    loaded.
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the file name
+
+    Returns
+    -------
+    shape -- tuple of integers
+        the shape of the sinogram
+    th -- NumPy array
+        a NumPy array of the angles
+
+    """
+
+    # Open the file and read the size
+    f = open(fn, 'rb')
+    tmp = np.frombuffer(f.read(8), dtype=np.float32, count=2)
+    f.close()
+    h = int(tmp[0])
+    w = int(tmp[1])
+
+    # The angles are the first row of the Fortran-ordered data
+    tmp = np.memmap(fn, dtype=np.float32, mode='r', offset=8,
+                    shape=(h, w), order='F')
+    th = np.array(tmp[0, :])
+    del tmp
+
+    # Return the size and the angles
+    return (h - 1, w), th
+
+
+def scan_headers(path, ext='.binsino'):
+    """ Read the sinogram sizes of all the binsino files in a folder
+
+    Parameters
+    ----------
+    path -- string or list of strings
+        a string with the folder location of the files or a list of filenames
+    ext -- string (default='.binsino')
+        the filename extension of the files
+
+    Returns
+    -------
+    table -- NumPy structured array
+        an array with one record per file with the fields 'fn', 'height' and
+        'width' (the shape of the sinogram), and 'offset' (the byte offset of
+        the data, including the row of angles)
+
+    """
+
+    # Find the files
+    fn = list_files(path, ext)
+    fnL = max([len(i) for i in fn] + [1])
+    dt = np.dtype([('fn', 'U%d' % (fnL)),
+                   ('height', np.uint32), ('width', np.uint32),
+                   ('offset', np.int64)])
+    table = np.zeros((len(fn), ), dtype=dt)
+
+    # Read the sizes
+    for i in range(len(fn)):
+        f = open(fn[i], 'rb')
+        tmp = np.frombuffer(f.read(8), dtype=np.float32, count=2)
+        f.close()
+        table[i] = (fn[i], int(tmp[0]) - 1, int(tmp[1]), 8)
+
+    # Return the table
+    return table
+
+
 def write_binsino(fn, sino, th):
     """ Function to write a binsino file
 
@@ -102,3 +220,324 @@ def write_binsino(fn, sino, th):
     # Return success
     return 0
 
+
+def create_binsinovol(fn, rows, cols, th, dtype=np.float32, storage=None,
+                      scale=1.0, offset=0.0):
+    """ Create an empty BINSINOVOL file
+
+    The file is allocated at its full size, so the sinograms can be written
+    in any order.
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename
+    rows -- integer
+        the number of sinograms (detector rows)
+    cols -- integer
+        the width of each sinogram (detector columns)
+    th -- NumPy array
+        a NumPy array with the angle information
+    dtype -- NumPy dtype (default=np.float32)
+        the data type of the stored sinograms
+    storage -- string (optional)
+        a reduced precision storage mode ('float16' or 'uint16'), which
+        replaces dtype (see txm_image.formats.precision)
+    scale, offset -- float (default=1.0, 0.0)
+        the scale and offset of 'uint16' values, shared by every sinogram
+
+    Returns
+    -------
+    None
+
+    """
+
+    # Fill in the header
+    th = np.array(th, dtype='<f4').ravel()
+    if (storage is None):
+        storage = 'float32'
+    else:
+        dtype = precision.storage_dtype(storage)
+    hdr = np.zeros((1, ), dtype=_VOL_HEADER)
+    hdr['magic'] = _VOL_MAGIC
+    hdr['version'] = 2
+    hdr['header_size'] = _VOL_HEADER.itemsize + th.nbytes
+    hdr['rows'] = rows
+    hdr['angles'] = len(th)
+    hdr['cols'] = cols
+    hdr['dtype'] = np.dtype(dtype).newbyteorder('<').str.encode('ascii')
+    hdr['storage'] = storage.encode('ascii')
+    hdr['scale'] = scale
+    hdr['zero'] = offset
+    start = -(-int(hdr['header_size'][0]) // _VOL_ALIGN) * _VOL_ALIGN
+    hdr['offset'] = start
+
+    # Write the header and allocate the file
+    f = open(fn, 'wb')
+    f.write(hdr.tobytes())
+    f.write(th.tobytes())
+    f.truncate(start + rows * len(th) * cols * np.dtype(dtype).itemsize)
+    f.close()
+
+    return
+
+
+def _read_vol_header(fn):
+    """ Read the header record and the angles of a BINSINOVOL file
+
+    Returns the header as a dictionary (with 'storage', 'scale' and 'zero'
+    filled in for version 1 files) and the angles, or None for both if it
+    is not a BINSINOVOL file.
+    """
+
+    # Read the fixed part of the header
+    f = open(fn, 'rb')
+    buf = f.read(_VOL_HEADER_V1.itemsize)
+    hdr = np.frombuffer(buf, dtype=_VOL_HEADER_V1)[0]
+    if (hdr['magic'] != _VOL_MAGIC):
+        f.close()
+        print('Error: %s is not a BINSINOVOL file.' % (fn))
+        return None, None
+    if (hdr['version'] >= 2):
+        buf += f.read(_VOL_HEADER.itemsize - _VOL_HEADER_V1.itemsize)
+        hdr = np.frombuffer(buf, dtype=_VOL_HEADER)[0]
+        storage = (hdr['storage'].decode('ascii'), float(hdr['scale']),
+                   float(hdr['zero']))
+    else:
+        storage = ('float32', 1.0, 0.0)
+    hdr = dict([(key, hdr[key]) for key in _VOL_HEADER_V1.names])
+    (hdr['storage'], hdr['scale'], hdr['zero']) = storage
+
+    # Read the angles
+    th = np.fromfile(f, dtype='<f4', count=int(hdr['angles']))
+    f.close()
+
+    return hdr, th
+
+
+def read_binsinovol_header(fn):
+    """ Read the header of a BINSINOVOL file
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename
+
+    Returns
+    -------
+    shape -- tuple of integers
+        the shape of the stored data (row, angle, column)
+    th -- NumPy array
+        a NumPy array of the angles
+    dtype -- NumPy dtype
+        the data type of the stored sinograms (the stored values of a
+        reduced precision file, which read_binsinovol decodes)
+    offset -- integer
+        the byte offset of the data
+
+    """
+
+    # Read the header and the angles
+    (hdr, th) = _read_vol_header(fn)
+    if (hdr is None):
+        return None
+
+    # Return the layout
+    shape = (int(hdr['rows']), int(hdr['angles']), int(hdr['cols']))
+    dtype = np.dtype(hdr['dtype'].decode('ascii'))
+    return shape, th, dtype, int(hdr['offset'])
+
+
+def read_binsinovol_storage(fn):
+    """ Read the storage mode of a BINSINOVOL file
+
+    The rows of the memmap from open_binsinovol are the stored values, which
+    are decoded with precision.decode and these values if the storage is not
+    'float32'.
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename
+
+    Returns
+    -------
+    storage -- string
+        the storage mode ('float32', 'float16', or 'uint16')
+    scale, offset -- float
+        the scale and offset of the stored values
+
+    ValueError is raised if fn is not a BINSINOVOL file.
+
+    """
+
+    (hdr, _) = _read_vol_header(fn)
+    if (hdr is None):
+        raise ValueError('%s is not a BINSINOVOL file.' % (fn))
+
+    return hdr['storage'], float(hdr['scale']), float(hdr['zero'])
+
+
+def open_binsinovol(fn, mode='r'):
+    """ Memory map all the sinograms of a BINSINOVOL file
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename
+    mode -- string (default='r')
+        the memory map mode ('r' for read-only, 'r+' to modify the sinograms
+        in place)
+
+    Returns
+    -------
+    vol -- NumPy memmap
+        the data with the shape (row, angle, column), so vol[i] is the
+        sinogram of row i with each row representing a different angle (the
+        stored values of a reduced precision file are not decoded)
+    th -- NumPy array
+        a NumPy array of the angles
+
+    """
+
+    (shape, th, dtype, offset) = read_binsinovol_header(fn)
+    vol = np.memmap(fn, dtype=dtype, mode=mode, offset=offset, shape=shape)
+
+    return vol, th
+
+
+def read_binsinovol(fn, ind=None, flag_memmap=False, dtype=None, out=None):
+    """ Read sinograms from a BINSINOVOL file
+
+    The sinograms have the same orientation as read_binsino, (column, angle).
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename
+    ind -- integer or slice (optional)
+        the detector rows to read; all the rows are read if not provided
+    flag_memmap -- boolean (default=False)
+        return a read-only memory-mapped view instead of reading into memory
+        (reduced precision files are always decoded into memory)
+    dtype -- NumPy dtype (optional)
+        the data type of the returned sinograms; the data type of the file is
+        kept if not provided (float32 for reduced precision files)
+    out -- NumPy array (optional)
+        an array to read the sinograms into, which is returned as sino
+
+    Returns
+    -------
+    sino -- NumPy array
+        the sinogram (column, angle) for an integer index, otherwise a 3D
+        array (row, column, angle)
+    th -- NumPy array
+        a NumPy array of the angles
+
+    """
+
+    # Memory map the file
+    (vol, th) = open_binsinovol(fn)
+    (hdr, _) = _read_vol_header(fn)
+
+    # Select the rows
+    if (ind is None):
+        sino = vol.transpose(0, 2, 1)
+    else:
+        sino = vol[ind].swapaxes(-1, -2)
+
+    # Load the sinograms
+    if (hdr['storage'] != 'float32'):
+        if (dtype is None):
+            dtype = np.float32
+        sino = precision.decode(sino, hdr['storage'], hdr['scale'],
+                                hdr['zero'], dtype=dtype, out=out)
+    elif (out is not None):
+        np.copyto(out, sino, casting='unsafe')
+        sino = out
+    elif (not flag_memmap):
+        sino = np.array(sino, dtype=dtype)
+
+    return sino, th
+
+
+def write_binsinovol_row(fn, ind, sino):
+    """ Write one sinogram into an existing BINSINOVOL file
+
+    Parameters
+    ----------
+    fn -- string or NumPy memmap
+        a string with the filename, or the memmap from open_binsinovol
+        opened with mode 'r+' (use the filename for a reduced precision
+        file, so the values are encoded)
+    ind -- integer
+        the detector row of the sinogram
+    sino -- NumPy array
+        a NumPy array of the sinogram (column, angle)
+
+    Returns
+    -------
+    None
+
+    """
+
+    # Open the file if needed
+    if (isinstance(fn, str)):
+        (vol, _) = open_binsinovol(fn, mode='r+')
+        (hdr, _) = _read_vol_header(fn)
+        if (hdr['storage'] != 'float32'):
+            sino = precision.encode(sino, hdr['storage'], hdr['scale'],
+                                    hdr['zero'])
+    else:
+        vol = fn
+
+    # Write the sinogram
+    vol[ind] = sino.T
+
+    return
+
+
+def write_binsinovol(fn, sino, th, storage=None, scale=None, offset=None):
+    """ Write all the sinograms to a BINSINOVOL file
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename
+    sino -- NumPy array
+        a 3D array (row, column, angle); for a projection stack proj with
+        the shape (angle, row, column) use proj.transpose(1, 2, 0)
+    th -- NumPy array
+        a NumPy array with the angle information
+    storage -- string (optional)
+        a reduced precision storage mode ('float16' or 'uint16')
+    scale, offset -- float (optional)
+        the scale and offset of 'uint16' values; they are fitted to the
+        range of the sinograms if not provided
+
+    Returns
+    -------
+    0 -- for success
+
+    """
+
+    # Create the file
+    (rows, cols, _) = sino.shape
+    if (storage is None):
+        (storage, scale, offset) = ('float32', 1.0, 0.0)
+    elif (scale is None or offset is None):
+        (scale, offset) = precision.find_scale(sino, storage)
+    create_binsinovol(fn, rows, cols, th, storage=storage, scale=scale,
+                      offset=offset)
+
+    # Write the sinograms row by row
+    (vol, _) = open_binsinovol(fn, mode='r+')
+    for i in range(rows):
+        if (storage == 'float32'):
+            vol[i] = sino[i].T
+        else:
+            vol[i] = precision.encode(sino[i].T, storage, scale, offset)
+    vol.flush()
+    del vol
+
+    return 0
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module will load and write BINZ files, which store an array (such as a
+projection stack or a sinogram volume) as losslessly compressed chunks.
+
+The array is split into chunks along the first axis. Before compression the
+bytes of each chunk are shuffled, so the first byte of every value is stored
+together, then the second byte, and so on. For float32 data the high bytes
+change slowly, so the shuffled chunks compress much better. The chunks are
+compressed and decompressed with the standard library codecs (zlib or lzma)
+on a pool of threads, which release the GIL while they work.
+
+File layout (little-endian)
+---------------------------
+header -- _HEADER record
+chunks -- the compressed chunks, one after the other
+index -- the (offset, nbytes) of every chunk, found at header['index']
+
+Started: 2026-10-18
+Last modified: 2026-10-18
+"""
+
+
+import lzma
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+
+# Magic bytes and the file header
+_MAGIC = b'BINZ'
+_MAX_DIMS = 4
+_HEADER = np.dtype([('magic', 'S4'), ('version', '<u4'), ('ndim', '<u4'),
+                    ('shuffle', '<u4'), ('shape', '<u8', (_MAX_DIMS, )),
+                    ('dtype', 'S8'), ('codec', 'S8'), ('level', '<i4'),
+                    ('reserved', '<u4'), ('chunk', '<u8'),
+                    ('num_chunks', '<u8'), ('index', '<u8')])
+
+# Entry of the chunk index
+_INDEX = np.dtype([('offset', '<u8'), ('nbytes', '<u8')])
+
+# Default chunk size (in bytes, before compression)
+_CHUNK_BYTES = 4 * 1024 * 1024
+
+
+def _compress(arr, codec, level, flag_shuffle):
+    """ Shuffle the bytes of an array and compress them """
+    arr = np.ascontiguousarray(arr)
+    if (flag_shuffle and arr.dtype.itemsize > 1):
+        buf = arr.reshape(-1).view(np.uint8).reshape((-1, arr.dtype.itemsize))
+        buf = np.ascontiguousarray(buf.T)
+    else:
+        buf = arr
+    if (codec == 'zlib'):
+        return zlib.compress(buf, level)
+    elif (codec == 'lzma'):
+        return lzma.compress(buf, preset=level)
+    return buf.tobytes()
+
+
+def _decompress(data, codec, flag_shuffle, out):
+    """ Decompress a chunk and unshuffle the bytes into an array """
+    if (codec == 'zlib'):
+        data = zlib.decompress(data)
+    elif (codec == 'lzma'):
+        data = lzma.decompress(data)
+    buf = np.frombuffer(data, dtype=np.uint8)
+    itemsize = out.dtype.itemsize
+    if (flag_shuffle and itemsize > 1):
+        buf = buf.reshape((itemsize, -1)).T
+    buf = buf.reshape(out.shape + (itemsize, ))
+    out.view(np.uint8).reshape(buf.shape)[...] = buf
+    return out
+
+
+def read_header(fn):
+    """ Read the header of a BINZ file
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename
+
+    Returns
+    -------
+    hdr -- NumPy record
+        the header ('shape', 'dtype', 'codec', 'level', 'shuffle', 'chunk',
+        'num_chunks')
+    index -- NumPy structured array
+        the offset and size of every compressed chunk
+
+    """
+
+    f = open(fn, 'rb')
+    hdr = np.frombuffer(f.read(_HEADER.itemsize), dtype=_HEADER)[0]
+    if (hdr['magic'] != _MAGIC):
+        f.close()
+        print('Error: %s is not a BINZ file.' % (fn))
+        return None, None
+    f.seek(int(hdr['index']))
+    index = np.frombuffer(f.read(int(hdr['num_chunks']) * _INDEX.itemsize),
+                          dtype=_INDEX)
+    f.close()
+
+    return hdr, index
+
+
+def write_binz(fn, img, codec='zlib', level=1, flag_shuffle=True,
+               chunk=None, num_threads=4):
+    """ Write an array to a compressed BINZ file
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename
+    img -- NumPy array
+        the array to write (up to 4 dimensions)
+    codec -- string (default='zlib')
+        'zlib' -- fast compression
+        'lzma' -- slower, smaller compression
+        'none' -- no compression
+    level -- integer (default=1)
+        the compression level (zlib 0-9, lzma preset 0-9)
+    flag_shuffle -- boolean (default=True)
+        shuffle the bytes of the values before compression
+    chunk -- integer (optional)
+        the number of entries along the first axis in each chunk; chunks of
+        about 4 MB are used if not provided
+    num_threads -- integer (default=4)
+        the number of threads compressing the chunks
+
+    Returns
+    -------
+    None
+
+    """
+
+    # Work out the chunks
+    if (img.ndim == 0 or img.ndim > _MAX_DIMS):
+        print('Error: BINZ files hold arrays with 1 to %d dimensions.' %
+              (_MAX_DIMS))
+        return
+    N = img.shape[0]
+    if (chunk is None):
+        chunk = max(1, _CHUNK_BYTES // max(1, img[:1].nbytes))
+    starts = list(range(0, N, chunk))
+
+    # Fill in the header
+    hdr = np.zeros((1, ), dtype=_HEADER)
+    hdr['magic'] = _MAGIC
+    hdr['version'] = 1
+    hdr['ndim'] = img.ndim
+    hdr['shuffle'] = flag_shuffle
+    hdr['shape'][0, :img.ndim] = img.shape
+    hdr['dtype'] = img.dtype.newbyteorder('<').str.encode('ascii')
+    hdr['codec'] = codec.encode('ascii')
+    hdr['level'] = level
+    hdr['chunk'] = chunk
+    hdr['num_chunks'] = len(starts)
+    index = np.zeros((len(starts), ), dtype=_INDEX)
+
+    # Compress the chunks in parallel, a few at a time, and write them
+    f = open(fn, 'wb')
+    f.write(hdr.tobytes())
+    pos = _HEADER.itemsize
+    img_le = img.astype(img.dtype.newbyteorder('<'), copy=False)
+    with ThreadPoolExecutor(max_workers=max(num_threads, 1)) as ex:
+        step = 2 * max(num_threads, 1)
+        for a in range(0, len(starts), step):
+            jobs = [ex.submit(_compress, img_le[i:i+chunk], codec, level,
+                              flag_shuffle) for i in starts[a:a+step]]
+            for (k, job) in enumerate(jobs):
+                data = job.result()
+                f.write(data)
+                index[a + k] = (pos, len(data))
+                pos += len(data)
+
+    # Write the chunk index and its location
+    f.write(index.tobytes())
+    hdr['index'] = pos
+    f.seek(0)
+    f.write(hdr.tobytes())
+    f.close()
+
+    return
+
+
+def read_binz(fn, ind=None, num_threads=4, out=None):
+    """ Read an array (or part of it) from a BINZ file
+
+    Only the chunks holding the requested entries are read, and they are
+    decompressed in parallel straight into the output array.
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename
+    ind -- integer or slice (optional)
+        the entries along the first axis to read; the whole array is read if
+        not provided
+    num_threads -- integer (default=4)
+        the number of threads decompressing the chunks
+    out -- NumPy array (optional)
+        an array to read into, which is returned as img
+
+    Returns
+    -------
+    img -- NumPy array
+        the array
+
+    """
+
+    # Read the header and find the requested entries
+    (hdr, index) = read_header(fn)
+    if (hdr is None):
+        return None
+    shape = tuple([int(i) for i in hdr['shape'][:int(hdr['ndim'])]])
+    dtype = np.dtype(hdr['dtype'].decode('ascii'))
+    codec = hdr['codec'].decode('ascii')
+    flag_shuffle = bool(hdr['shuffle'])
+    chunk = int(hdr['chunk'])
+    if (ind is None):
+        ind = slice(None)
+    single = not isinstance(ind, slice)
+    if (single):
+        if (ind < -shape[0] or ind >= shape[0]):
+            raise IndexError('index %d is out of bounds for %d entries' %
+                             (ind, shape[0]))
+        ind = ind % shape[0]
+        ind = slice(ind, ind + 1)
+    (a, b, step) = ind.indices(shape[0])
+    rows = np.arange(a, b, step)
+
+    # Allocate the output (an out array that can not be reshaped without a
+    # copy is filled in from a temporary array at the end)
+    if (out is not None and out.flags.c_contiguous):
+        img = out.reshape((len(rows), ) + shape[1:])
+    else:
+        img = np.empty((len(rows), ) + shape[1:], dtype=dtype)
+
+    # Define the work for each chunk (each thread uses its own handle)
+    def read_chunk(i):
+        sel = np.nonzero((rows >= i * chunk) & (rows < (i + 1) * chunk))[0]
+        n = min(chunk, shape[0] - i * chunk)
+        f = open(fn, 'rb')
+        f.seek(int(index[i]['offset']))
+        data = f.read(int(index[i]['nbytes']))
+        f.close()
+        if (len(sel) == n and img.dtype == dtype and
+                img[sel[0]:sel[0]+n].flags.c_contiguous and step == 1):
+            _decompress(data, codec, flag_shuffle, img[sel[0]:sel[0]+n])
+        else:
+            tmp = np.empty((n, ) + shape[1:], dtype=dtype)
+            _decompress(data, codec, flag_shuffle, tmp)
+            img[sel] = tmp[rows[sel] - i * chunk]
+
+    # Decompress the chunks that hold the requested entries
+    chunks = np.unique(rows // chunk)
+    if (num_threads > 1 and len(chunks) > 1):
+        with ThreadPoolExecutor(max_workers=num_threads) as ex:
+            list(ex.map(read_chunk, chunks))
+    else:
+        for i in chunks:
+            read_chunk(i)
+
+    # Return the array
+    if (out is not None):
+        if (not np.shares_memory(img, out)):
+            np.copyto(out, img.reshape(out.shape), casting='unsafe')
+        return out
+    if (single):
+        return img[0]
+    return img
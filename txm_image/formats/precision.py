@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module will convert images to and from the reduced precision storage
+modes of the file formats.
+
+Storage modes
+-------------
+'float32' -- the values are stored unchanged (4 bytes per pixel)
+'float16' -- the values are stored as half precision floats (2 bytes per
+             pixel, about 3 significant digits, largest value 65504)
+'uint16' -- the values are scaled to 16-bit integers (2 bytes per pixel),
+            value = stored * scale + offset
+
+The mode, scale and offset are recorded in the header of each file as a
+datatype string such as 'uint16 scale=0.0001 offset=-0.5', and the values
+are decoded when the file is read.
+
+Started: 2026-10-18
+Last modified: 2026-10-18
+"""
+
+
+import numpy as np
+
+
+# Data type of the stored values for each mode
+_STORAGE = {'float32': np.dtype('<f4'), 'float16': np.dtype('<f2'),
+            'uint16': np.dtype('<u2')}
+
+
+def storage_dtype(mode):
+    """ The data type of the stored values for a storage mode """
+    if (mode not in _STORAGE):
+        raise ValueError('Unknown storage mode: %s' % (mode))
+    return _STORAGE[mode]
+
+
+def format_datatype(mode, scale=1.0, offset=0.0):
+    """ The datatype string that records a storage mode in a header """
+    if (mode == 'uint16'):
+        return '%s scale=%.10g offset=%.10g' % (mode, scale, offset)
+    return mode
+
+
+def parse_datatype(datatype):
+    """ Read a datatype string from a header
+
+    Parameters
+    ----------
+    datatype -- string
+        the datatype string of the file
+
+    Returns
+    -------
+    mode -- string
+        the storage mode ('float32' for any string without a reduced
+        precision mode, such as older files)
+    scale -- float
+        the scale of the stored values
+    offset -- float
+        the offset of the stored values
+
+    """
+
+    tmp = datatype.split()
+    if (len(tmp) == 0 or tmp[0] not in _STORAGE):
+        return 'float32', 1.0, 0.0
+    values = {'scale': 1.0, 'offset': 0.0}
+    for item in tmp[1:]:
+        (key, _, val) = item.partition('=')
+        if (key in values):
+            values[key] = float(val)
+    return tmp[0], values['scale'], values['offset']
+
+
+def find_scale(img, mode):
+    """ Find the scale and offset that fit the range of an image
+
+    Parameters
+    ----------
+    img -- NumPy array
+        the image or the stack of images that will be stored
+    mode -- string
+        the storage mode
+
+    Returns
+    -------
+    scale -- float
+        the scale, so the largest finite value is stored as 65535 ('uint16')
+    offset -- float
+        the offset, so the smallest finite value is stored as 0 ('uint16')
+
+    """
+
+    if (mode != 'uint16'):
+        return 1.0, 0.0
+    tmp = img[np.isfinite(img)]
+    if (tmp.size == 0):
+        return 1.0, 0.0
+    (lo, hi) = (float(tmp.min()), float(tmp.max()))
+    if (hi <= lo):
+        return 1.0, lo
+
+    # Round to the digits kept in the datatype string
+    scale = float('%.10g' % ((hi - lo) / 65535.0))
+    offset = float('%.10g' % (lo))
+    return scale, offset
+
+
+def encode(img, mode, scale=1.0, offset=0.0, out=None):
+    """ Convert an image to its stored values
+
+    Parameters
+    ----------
+    img -- NumPy array
+        the image
+    mode -- string
+        the storage mode
+    scale, offset -- float (default=1.0, 0.0)
+        the scale and offset of the stored values ('uint16'); values outside
+        the range are clipped and NaN is stored as 0
+    out -- NumPy array (optional)
+        an array to write the stored values into
+
+    Returns
+    -------
+    data -- NumPy array
+        the stored values
+
+    """
+
+    dtype = storage_dtype(mode)
+    if (mode != 'uint16'):
+        if (out is None):
+            return np.asarray(img).astype(dtype)
+        np.copyto(out, img, casting='unsafe')
+        return out
+
+    # Scale, round and clip to the range of uint16
+    tmp = np.subtract(img, offset, dtype=np.float32)
+    tmp /= scale
+    np.rint(tmp, out=tmp)
+    np.clip(tmp, 0, 65535, out=tmp)
+    tmp[np.isnan(tmp)] = 0
+    if (out is None):
+        return tmp.astype(dtype)
+    np.copyto(out, tmp, casting='unsafe')
+    return out
+
+
+def decode(data, mode, scale=1.0, offset=0.0, dtype=np.float32, out=None):
+    """ Convert stored values back to an image
+
+    Parameters
+    ----------
+    data -- NumPy array
+        the stored values
+    mode -- string
+        the storage mode
+    scale, offset -- float (default=1.0, 0.0)
+        the scale and offset of the stored values ('uint16')
+    dtype -- NumPy dtype (default=np.float32)
+        the data type of the returned image
+    out -- NumPy array (optional)
+        an array to write the image into, which is returned as img
+
+    Returns
+    -------
+    img -- NumPy array
+        the image
+
+    """
+
+    if (out is None):
+        out = np.empty(np.shape(data), dtype=dtype)
+    np.copyto(out, data, casting='unsafe')
+    if (mode == 'uint16'):
+        out *= scale
+        out += offset
+    return out
@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module will keep a registry of the file formats, so the general read and
+write functions can find the right format for a file.
+
+Each format registers the filename extensions it uses, how to recognize its
+files from their first bytes (so files with an unknown or doubled extension
+can still be read), what it can do (memory mapping, reading only the
+headers, reading part of a chunked file), and its read, write and header
+functions. The functions are given as 'module:function' strings and the
+module is only imported the first time the function is used, so the
+dependencies of a format are not loaded until a file of that format is read
+or written.
+
+Example
+-------
+register_format('myformat', ('.myf', ), 'mypackage.myformat:read_myf',
+                writer='mypackage.myformat:write_myf', magic=b'MYF1')
+fmt = find_format('scan.myf')
+(img, meta) = fmt.read('scan.myf')
+
+Started: 2026-10-18
+Last modified: 2026-10-18
+"""
+
+
+import importlib
+import os
+import numpy as np
+
+
+# Registered formats, in the order they are checked
+_formats = []
+
+
+def _resolve(func):
+    """ Import the function given by a 'module:function' string """
+    if (func is None or callable(func)):
+        return func
+    (module, name) = func.split(':')
+    return getattr(importlib.import_module(module), name)
+
+
+class file_format:
+    """
+    Define a class to hold a registered file format
+
+    Parameters
+    ----------
+    name -- string
+        the name of the format (used in the console output)
+    suffixes -- tuple of strings
+        the filename extensions of the format (such as '.bim')
+    reader -- string or function
+        reader(fn) returns (img, meta), or only img if flag_meta is False
+    writer -- string or function (optional)
+        writer(fn, img, meta), or writer(fn, img) if flag_meta is False
+    header -- string or function (optional)
+        header(path, ext) returns the table of headers of the files in a
+        folder (see scan_headers of the formats)
+    magic -- bytes or tuple of bytes (optional)
+        the first bytes of every file of the format
+    sniff -- string or function (optional)
+        sniff(fn) returns True for a file of the format, for formats without
+        magic bytes
+    flag_meta -- boolean (default=True)
+        the reader returns metadata and the writer takes it
+    flag_memmap -- boolean (default=False)
+        the reader takes flag_memmap to return a memory-mapped image
+    flag_header -- boolean (default=False)
+        the headers can be read without reading the pixel data
+    flag_chunked -- boolean (default=False)
+        part of a file can be read without reading the rest of it
+
+    """
+    def __init__(self, name, suffixes, reader, writer=None, header=None,
+                 magic=None, sniff=None, flag_meta=True, flag_memmap=False,
+                 flag_header=False, flag_chunked=False):
+        self.name = name
+        self.suffixes = tuple([i.lower() for i in suffixes])
+        self.reader = reader
+        self.writer = writer
+        self.header = header
+        if (isinstance(magic, bytes)):
+            magic = (magic, )
+        self.magic = magic
+        self.sniff = sniff
+        self.flag_meta = flag_meta
+        self.flag_memmap = flag_memmap
+        self.flag_header = flag_header or (header is not None)
+        self.flag_chunked = flag_chunked
+
+    def read(self, fn, flag_memmap=False):
+        """ Read a file, returning (img, meta) """
+        reader = _resolve(self.reader)
+        if (flag_memmap and self.flag_memmap):
+            out = reader(fn, flag_memmap=True)
+        else:
+            out = reader(fn)
+        if (self.flag_meta):
+            return out
+        return out, None
+
+    def write(self, fn, img, meta=None):
+        """ Write a file """
+        if (self.writer is None):
+            raise ValueError('The %s format cannot be written.' % (self.name))
+        writer = _resolve(self.writer)
+        if (self.flag_meta):
+            return writer(fn, img, meta)
+        return writer(fn, img)
+
+    def scan_headers(self, path, ext):
+        """ Read the headers of the files of the format in a folder """
+        if (self.header is None):
+            raise ValueError('The %s format has no header reader.' %
+                             (self.name))
+        return _resolve(self.header)(path, ext)
+
+    def match(self, fn):
+        """ The length of the longest extension of the format that ends the
+        filename (0 if none match) """
+        fn = fn.lower()
+        L = [len(i) for i in self.suffixes if (fn.endswith(i))]
+        return max(L + [0])
+
+    def is_format(self, fn, buf=None):
+        """ Check the first bytes (or the sniff function) of a file """
+        if (self.magic is not None):
+            if (buf is None):
+                f = open(fn, 'rb')
+                buf = f.read(16)
+                f.close()
+            return any([buf.startswith(i) for i in self.magic])
+        if (self.sniff is not None):
+            return bool(_resolve(self.sniff)(fn))
+        return False
+
+
+def register_format(name, suffixes, reader, writer=None, header=None,
+                    magic=None, sniff=None, flag_meta=True, flag_memmap=False,
+                    flag_header=False, flag_chunked=False):
+    """ Register a file format
+
+    A format with the same name is replaced. The parameters are described in
+    the file_format class.
+
+    Returns
+    -------
+    fmt -- class file_format
+        the registered format
+
+    """
+
+    fmt = file_format(name, suffixes, reader, writer=writer, header=header,
+                      magic=magic, sniff=sniff, flag_meta=flag_meta,
+                      flag_memmap=flag_memmap, flag_header=flag_header,
+                      flag_chunked=flag_chunked)
+    for i in range(len(_formats)):
+        if (_formats[i].name == name):
+            _formats[i] = fmt
+            return fmt
+    _formats.append(fmt)
+
+    return fmt
+
+
+def get_format(name):
+    """ Return the registered format with a name (None if not found) """
+    for fmt in _formats:
+        if (fmt.name == name):
+            return fmt
+    return None
+
+
+def list_formats():
+    """ Return the registered formats """
+    return list(_formats)
+
+
+def find_format(fn, flag_sniff=True):
+    """ Find the format of a file
+
+    The format with the longest matching filename extension is used. If no
+    extension matches and the file exists, the first bytes of the file are
+    checked against the registered formats.
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename
+    flag_sniff -- boolean (default=True)
+        check the contents of the file when the extension is unknown
+
+    Returns
+    -------
+    fmt -- class file_format
+        the format of the file (None if it was not found)
+
+    """
+
+    # Check the extensions
+    L = [fmt.match(fn) for fmt in _formats]
+    if (len(L) > 0 and max(L) > 0):
+        return _formats[int(np.argmax(L))]
+
+    # Check the contents
+    if (not flag_sniff or not os.path.isfile(fn)):
+        return None
+    f = open(fn, 'rb')
+    buf = f.read(16)
+    f.close()
+    for fmt in _formats:
+        if (fmt.magic is not None and fmt.is_format(fn, buf)):
+            return fmt
+    for fmt in _formats:
+        if (fmt.magic is None and fmt.is_format(fn, buf)):
+            return fmt
+
+    return None
+
+
+def find_format_ext(ext):
+    """ Find the format of a filename extension (None if not found) """
+    return find_format('_' + ext, flag_sniff=False)
+
+
+# Checks for the formats without magic bytes
+def _sniff_bim(fn):
+    """ A BIM file is exactly as long as its header and float32 image """
+    size = os.path.getsize(fn)
+    f = open(fn, 'rb')
+    tmp = np.frombuffer(f.read(24), dtype='<u4')
+    f.close()
+    if (len(tmp) < 6 or np.any(tmp[:4] > 4096)):
+        return False
+    (MotPosL, datatypeL, dateL, AxisNamesL, w, h) = [int(i) for i in tmp]
+    header = 60 + 4 * MotPosL + AxisNamesL + datatypeL + dateL
+    return (size - header) in (4 * w * h, 2 * w * h) and w * h > 0
+
+
+def _sniff_bin(fn):
+    """ A binprj file is exactly as long as its size and float32 image """
+    size = os.path.getsize(fn)
+    f = open(fn, 'rb')
+    tmp = np.frombuffer(f.read(8), dtype='<f4')
+    f.close()
+    if (len(tmp) < 2 or not np.all(np.isfinite(tmp)) or np.any(tmp < 1) or
+            np.any(tmp != np.round(tmp))):
+        return False
+    return size == 8 + 4 * int(tmp[0]) * int(tmp[1])
+
+
+def _sniff_binsino(fn):
+    """ A binsino file has the size of a binprj file, and the first value of
+    each column is the angle of that column, which changes monotonically """
+    if (not _sniff_bin(fn)):
+        return False
+    f = open(fn, 'rb')
+    tmp = np.frombuffer(f.read(8), dtype='<f4')
+    (h, w) = (int(tmp[0]), int(tmp[1]))
+    if (h < 2 or w < 2):
+        f.close()
+        return False
+    th = np.memmap(f, dtype='<f4', mode='r', offset=8, shape=(w, h))[:, 0]
+    d = np.diff(np.array(th, dtype=np.float64))
+    f.close()
+    return (bool(np.all(np.isfinite(d))) and np.any(d != 0) and
+            (np.all(d >= 0) or np.all(d <= 0)))
+
+
+def _sniff_mhd(fn):
+    """ A MetaImage header is a text file of 'key = value' lines """
+    f = open(fn, 'rb')
+    buf = f.read(256)
+    f.close()
+    return (b'ObjectType' in buf or b'NDims' in buf) and b'=' in buf
+
+
+# Adapters for the formats whose functions do not return (img, meta)
+def _read_tiff(fn):
+    from txm_image.formats import tiff
+    return tiff.read_tiff_stack_io(fn)
+
+
+def _write_tiff(fn, img):
+    from txm_image.formats import tiff
+    return tiff.write_tiff_stack_io(fn, img)
+
+
+def _read_binz(fn):
+    from txm_image.formats import binz
+    return binz.read_binz(fn)
+
+
+def _write_binz(fn, img):
+    from txm_image.formats import binz
+    return binz.write_binz(fn, img)
+
+
+def _read_mhd(fn, flag_memmap=False):
+    from txm_image.formats import volume
+    if (flag_memmap):
+        return volume.open_volume(fn), volume.read_mhd(fn)
+    return volume.read_volume(fn)
+
+
+def _write_mhd(fn, img, meta=None):
+    from txm_image.formats import volume
+    return volume.write_volume(fn, img)
+
+
+# The built-in formats
+register_format('BIM', ('.bim', ), 'txm_image.formats.bim:read_bim',
+                writer='txm_image.formats.bim:write_bim',
+                header='txm_image.formats.bim:scan_headers',
+                sniff=_sniff_bim, flag_memmap=True)
+register_format('BIMSTACK', ('.bimstack', ),
+                'txm_image.formats.bimstack:read_bimstack',
+                writer='txm_image.formats.bimstack:write_bimstack',
+                header='txm_image.formats.bimstack:scan_headers',
+                magic=b'BIMSTACK', flag_memmap=True, flag_chunked=True)
+register_format('TIFF', ('.tif', '.tiff'), _read_tiff, writer=_write_tiff,
+                header='txm_image.formats.tiff:scan_headers',
+                magic=(b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+'),
+                flag_meta=False, flag_chunked=True)
+# (binsino is checked before binprj, which has the same size rule)
+register_format('binsino', ('.binsino', ),
+                'txm_image.formats.binsino:read_binsino',
+                writer='txm_image.formats.binsino:write_binsino',
+                header='txm_image.formats.binsino:scan_headers',
+                sniff=_sniff_binsino)
+register_format('binprj', ('.binprj', '.binslice'),
+                'txm_image.formats.binfile:read_bin',
+                writer='txm_image.formats.binfile:write_bin',
+                header='txm_image.formats.binfile:scan_headers',
+                sniff=_sniff_bin, flag_meta=False)
+register_format('binsinovol', ('.binsinovol', ),
+                'txm_image.formats.binsino:read_binsinovol',
+                writer='txm_image.formats.binsino:write_binsinovol',
+                magic=b'BINSINOV', flag_memmap=True, flag_chunked=True)
+register_format('binz', ('.binz', ), _read_binz, writer=_write_binz,
+                magic=b'BINZ', flag_meta=False, flag_chunked=True)
+register_format('MHD', ('.mhd', ), _read_mhd, writer=_write_mhd,
+                sniff=_sniff_mhd, flag_memmap=True, flag_chunked=True)
@@ -11,13 +11,309 @@ Last modified: 2017-02-07
 """
 
 
-from PIL import Image
-from skimage.io import imread, imsave
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import txm_image
+from txm_image.formats.utils import list_files, roi_range
 
 
-def read_tiff(fn, ind=0):
+# Sizes (in bytes) of the TIFF field types
+_TIFF_TYPES = {1: 'u1', 2: 'u1', 3: 'u2', 4: 'u4', 5: 'u4', 6: 'i1',
+               7: 'u1', 8: 'i2', 9: 'i4', 10: 'i4', 11: 'f4', 12: 'f8',
+               16: 'u8', 17: 'i8', 18: 'u8'}
+
+# TIFF tags used by the page index
+_TAG_WIDTH = 256
+_TAG_HEIGHT = 257
+_TAG_BITS = 258
+_TAG_COMPRESSION = 259
+_TAG_STRIP_OFFSETS = 273
+_TAG_SAMPLES = 277
+_TAG_ROWS_PER_STRIP = 278
+_TAG_STRIP_COUNTS = 279
+_TAG_PLANAR = 284
+_TAG_PREDICTOR = 317
+_TAG_TILE_WIDTH = 322
+_TAG_SAMPLE_FORMAT = 339
+
+# Compression schemes that can be decoded without PIL
+_COMPRESSION_NONE = 1
+_COMPRESSION_DEFLATE = (8, 32946)
+
+# Page indexes that have been read, by filename
+_index_cache = {}
+
+
+class tiff_index:
+    """
+    Define a class to hold the location and layout of every page in a TIFF
+    file
+    """
+    def __init__(self):
+        self.fn = []
+        self.byteorder = []
+        self.bigtiff = []
+        self.pages = []
+        self.strip_offsets = []
+        self.strip_counts = []
+
+
+# Data type of the page table in the TIFF index
+_PAGE_DTYPE = np.dtype([('ifd', np.int64), ('height', np.uint32),
+                        ('width', np.uint32), ('samples', np.uint16),
+                        ('dtype', 'U4'), ('compression', np.uint16),
+                        ('predictor', np.uint16),
+                        ('rows_per_strip', np.uint32),
+                        ('contiguous', np.bool_), ('offset', np.int64)])
+
+
+def _read_ifd(f, ifd, byteorder, bigtiff):
+    """ Read the tags of one image file directory
+
+    Parameters
+    ----------
+    f -- file object
+        the TIFF file opened in binary mode
+    ifd -- integer
+        the byte offset of the image file directory
+    byteorder -- string
+        '<' for little-endian or '>' for big-endian files
+    bigtiff -- boolean
+        True for BigTIFF files
+
+    Returns
+    -------
+    tags -- dictionary
+        the values (as NumPy arrays) of the tags used by the index
+    next_ifd -- integer
+        the byte offset of the next image file directory (0 for the last)
+
+    """
+
+    # Read the number of entries and then all the entries in one call
+    if (bigtiff):
+        (cnt_t, entry_t, entry_size, inline) = ('u8', 'u8', 20, 8)
+    else:
+        (cnt_t, entry_t, entry_size, inline) = ('u2', 'u4', 12, 4)
+    f.seek(ifd)
+    cnt_size = np.dtype(cnt_t).itemsize
+    N = int(np.frombuffer(f.read(cnt_size), dtype=byteorder+cnt_t)[0])
+    buf = f.read(N * entry_size + inline)
+    entries = np.frombuffer(buf, count=N, dtype=np.dtype([
+        ('tag', byteorder+'u2'), ('type', byteorder+'u2'),
+        ('count', byteorder+entry_t), ('value', 'V%d' % (inline))]))
+    next_ifd = int(np.frombuffer(buf, dtype=byteorder+entry_t, count=1,
+                                 offset=N * entry_size)[0])
+
+    # Read the values of the tags
+    tags = {}
+    for entry in entries:
+        tag = int(entry['tag'])
+        if (tag not in (_TAG_WIDTH, _TAG_HEIGHT, _TAG_BITS, _TAG_COMPRESSION,
+                        _TAG_STRIP_OFFSETS, _TAG_SAMPLES, _TAG_ROWS_PER_STRIP,
+                        _TAG_STRIP_COUNTS, _TAG_PLANAR, _TAG_PREDICTOR,
+                        _TAG_TILE_WIDTH, _TAG_SAMPLE_FORMAT)):
+            continue
+        dtype = np.dtype(byteorder + _TIFF_TYPES.get(int(entry['type']),
+                                                     'u1'))
+        count = int(entry['count'])
+        size = count * dtype.itemsize
+        if (size <= inline):
+            val = np.frombuffer(entry['value'].tobytes(), dtype=dtype,
+                                count=count)
+        else:
+            pos = int(np.frombuffer(entry['value'].tobytes(),
+                                    dtype=byteorder+entry_t)[0])
+            f.seek(pos)
+            val = np.frombuffer(f.read(size), dtype=dtype, count=count)
+        tags[tag] = val.astype(np.int64)
+
+    return tags, next_ifd
+
+
+def read_tiff_index(fn):
+    """ Build an index of every page in a TIFF file
+
+    The image file directories are walked once, and the location, size, and
+    data type of every page are recorded. The index is cached for each file
+    (until the file is modified), so the number of pages and the location of
+    any page are then found in constant time.
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename
+
+    Returns
+    -------
+    index -- class tiff_index
+        the index of the pages; index.pages is a NumPy structured array with
+        one record per page
+
+    """
+
+    # Check the cache
+    key = os.path.abspath(fn)
+    stat = os.stat(fn)
+    if (key in _index_cache):
+        (mtime, size, index) = _index_cache[key]
+        if (mtime == stat.st_mtime and size == stat.st_size):
+            return index
+
+    # Read the header
+    index = tiff_index()
+    index.fn = fn
+    f = open(fn, 'rb')
+    buf = f.read(16)
+    if (buf[:2] == b'II'):
+        index.byteorder = '<'
+    elif (buf[:2] == b'MM'):
+        index.byteorder = '>'
+    else:
+        f.close()
+        raise ValueError('%s is not a TIFF file.' % (fn))
+    bo = index.byteorder
+    magic = int(np.frombuffer(buf, dtype=bo+'u2', count=1, offset=2)[0])
+    index.bigtiff = (magic == 43)
+    if (index.bigtiff):
+        ifd = int(np.frombuffer(buf, dtype=bo+'u8', count=1, offset=8)[0])
+    else:
+        ifd = int(np.frombuffer(buf, dtype=bo+'u4', count=1, offset=4)[0])
+
+    # Walk through the image file directories
+    pages = []
+    while (ifd != 0):
+        (tags, next_ifd) = _read_ifd(f, ifd, bo, index.bigtiff)
+        h = int(tags[_TAG_HEIGHT][0])
+        w = int(tags[_TAG_WIDTH][0])
+        bits = int(tags.get(_TAG_BITS, [1])[0])
+        samples = int(tags.get(_TAG_SAMPLES, [1])[0])
+        fmt = {1: 'u', 2: 'i', 3: 'f'}.get(
+            int(tags.get(_TAG_SAMPLE_FORMAT, [1])[0]), 'u')
+        compression = int(tags.get(_TAG_COMPRESSION, [1])[0])
+        predictor = int(tags.get(_TAG_PREDICTOR, [1])[0])
+        rps = int(min(tags.get(_TAG_ROWS_PER_STRIP, [h])[0], h))
+        offsets = tags.get(_TAG_STRIP_OFFSETS, np.zeros((0, ), np.int64))
+        counts = tags.get(_TAG_STRIP_COUNTS, np.zeros((0, ), np.int64))
+
+        # Pages that can not be read directly are left to PIL
+        if (bits % 8 != 0 or _TAG_TILE_WIDTH in tags or
+                (samples > 1 and int(tags.get(_TAG_PLANAR, [1])[0]) != 1)):
+            dtype = ''
+        else:
+            dtype = bo + fmt + str(bits // 8)
+            if (bits == 8):
+                dtype = '|' + fmt + '1'
+
+        # Check for uncompressed strips that follow each other on disk
+        contiguous = (dtype != '' and compression == _COMPRESSION_NONE and
+                      len(offsets) > 0 and
+                      np.all(offsets[1:] == offsets[:-1] + counts[:-1]))
+
+        pages.append((ifd, h, w, samples, dtype, compression, predictor,
+                      rps, contiguous, offsets[0] if len(offsets) else 0))
+        index.strip_offsets.append(offsets)
+        index.strip_counts.append(counts)
+        ifd = next_ifd
+    f.close()
+    index.pages = np.array(pages, dtype=_PAGE_DTYPE)
+
+    # Store the index in the cache
+    _index_cache[key] = (stat.st_mtime, stat.st_size, index)
+
+    return index
+
+
+def _read_page(f, index, ind, out=None, rows=None):
+    """ Read one page (or a band of its rows) of a TIFF file in its native
+    data type
+
+    Parameters
+    ----------
+    f -- file object
+        the TIFF file opened in binary mode
+    index -- class tiff_index
+        the index of the file
+    ind -- integer
+        the page to read
+    out -- NumPy array (optional)
+        an array with the data type of the page to read uncompressed pages
+        straight into (it is ignored for other pages)
+    rows -- tuple of integers (optional)
+        the (start, stop) of the rows to read; only the strips that hold
+        these rows are read and decoded
+
+    Returns
+    -------
+    img -- NumPy array
+        the page (rows, width) or (rows, width, samples), or None if the
+        page can not be decoded without PIL
+
+    """
+
+    page = index.pages[ind]
+    (h, w, s) = (int(page['height']), int(page['width']),
+                 int(page['samples']))
+    if (page['dtype'] == ''):
+        return None
+    dtype = np.dtype(str(page['dtype']))
+    (r0, r1) = roi_range(rows, h)
+    shape = (r1 - r0, w) if (s == 1) else (r1 - r0, w, s)
+
+    # Uncompressed pages stored in one block are read with one call
+    if (page['contiguous']):
+        f.seek(int(page['offset']) + r0 * w * s * dtype.itemsize)
+        if (out is not None and out.dtype == dtype and
+                out.shape == shape and out.flags.c_contiguous):
+            f.readinto(out)
+            return out
+        img = np.fromfile(f, dtype=dtype, count=(r1 - r0)*w*s)
+        return img.reshape(shape)
+
+    # Read and decode the strips
+    compression = int(page['compression'])
+    if (compression != _COMPRESSION_NONE and
+            compression not in _COMPRESSION_DEFLATE):
+        return None
+    if (int(page['predictor']) not in (1, 2)):
+        return None
+    buf = bytearray()
+    offsets = index.strip_offsets[ind]
+    counts = index.strip_counts[ind]
+    rps = max(int(page['rows_per_strip']), 1)
+    (k0, k1) = (r0 // rps, min(-(-r1 // rps), len(offsets)))
+    for i in range(k0, k1):
+        f.seek(int(offsets[i]))
+        tmp = f.read(int(counts[i]))
+        if (compression in _COMPRESSION_DEFLATE):
+            tmp = zlib.decompress(tmp)
+        buf += tmp
+    line = w * s * dtype.itemsize
+    skip = (r0 - k0 * rps) * line
+    img = np.frombuffer(buf, dtype=dtype, count=(r1 - r0)*w*s,
+                        offset=skip).reshape(shape)
+
+    # Undo the horizontal differencing
+    if (int(page['predictor']) == 2):
+        img = np.cumsum(img, axis=1, dtype=dtype)
+
+    return img
+
+
+def _read_page_pil(fn, ind):
+    """ Read one page of a TIFF file using PIL """
+    from PIL import Image
+    f = Image.open(fn)
+    f.seek(ind)
+    img = np.array(f)
+    f.close()
+    return img
+
+
+def read_tiff(fn, ind=0, dtype=np.float64, out=None, rows=None, cols=None):
     """ Load a TIFF file
 
     Parameters
@@ -26,6 +322,15 @@ def read_tiff(fn, ind=0):
         a string with the filename
     ind -- integer (default=0)
         a specific page to look at in the TIFF stack
+    dtype -- NumPy dtype (default=np.float64)
+        the data type of the returned image (None keeps the data type of the
+        file)
+    out -- NumPy array (optional)
+        an array to read the image into, which is returned as img
+    rows, cols -- tuple of integers or slice (optional)
+        the (start, stop) of the rows and columns to read; only the strips
+        that hold the rows are read, and the whole image is read if not
+        provided
 
     Returns
     -------
@@ -34,21 +339,32 @@ def read_tiff(fn, ind=0):
 
     """
 
-    # Open the file
-    f = Image.open(fn)
-    f.seek(ind)
-
-    # Initialize an array
-    [w, h] = f.size
-    img = np.empty((h, w))
+    # Find the page in the index
+    index = read_tiff_index(fn)
+    page = index.pages[ind]
+    rows = roi_range(rows, int(page['height']))
+    cols = roi_range(cols, int(page['width']))
+    flag_cols = (cols != (0, int(page['width'])))
 
-    # Read in the image stack
-    img[:, :] = np.array(f)
+    # Read in the rows of the page
+    f = open(fn, 'rb')
+    tmp = _read_page(f, index, ind, out=None if (flag_cols) else out,
+                     rows=rows)
+    f.close()
+    if (tmp is None):
+        tmp = _read_page_pil(fn, ind)[rows[0]:rows[1]]
+    if (flag_cols):
+        tmp = tmp[:, cols[0]:cols[1]]
 
-    # Close the file
-    f.close
+    # Copy into the requested array
+    if (out is not None):
+        if (tmp is not out):
+            np.copyto(out, tmp, casting='unsafe')
+        return out
+    if (dtype is not None and tmp.dtype != np.dtype(dtype)):
+        tmp = tmp.astype(dtype)
 
-    return img
+    return tmp
 
 
 def read_tiff_stack(fn):
@@ -66,38 +382,48 @@ def read_tiff_stack(fn):
 
     """
 
-    # Open the file
-    f = Image.open(fn)
-
-    N = txm_image.formats.tiff.tiff_stack_size(fn)
+    # Find the pages
+    index = read_tiff_index(fn)
+    N = len(index.pages)
 
     # Get image size
-    (w, h) = f.size
+    (h, w) = (int(index.pages[0]['height']), int(index.pages[0]['width']))
 
     # Initialize and read
     if (N == 1):
         img = np.empty((h, w), dtype=np.float32)
-        img[:, :] = np.array(f, dtype=np.float32)
     else:
         img = np.empty((N, h, w), dtype=np.float32)
-        # Read in the image stack
-        for i in range(N):
-            f.seek(i)
-            img[i, :, :] = np.array(f)
 
-    # Close the file
-    f.close
+    # Read in the image stack
+    f = open(fn, 'rb')
+    for i in range(N):
+        tmp = _read_page(f, index, i)
+        if (tmp is None):
+            tmp = _read_page_pil(fn, i)
+        img.reshape((N, h, w))[i, :, :] = tmp
+    f.close()
 
     return img
 
 
-def read_tiff_stack_io(fn):
+def read_tiff_stack_io(fn, num_threads=4, dtype=np.float32, out=None):
     """ Load a TIFF stack
 
+    The pages are decoded in parallel directly into the output array, so only
+    one copy of the stack is held in memory.
+
     Parameters
     ----------
     fn -- string
         a string with the filename
+    num_threads -- integer (default=4)
+        the number of threads used to decode the pages
+    dtype -- NumPy dtype (default=np.float32)
+        the data type of the returned images (None keeps the data type of the
+        file)
+    out -- NumPy array (optional)
+        an array to read the images into, which is returned as img
 
     Returns
     -------
@@ -106,16 +432,166 @@ def read_tiff_stack_io(fn):
 
     """
 
-    # Read the file
-    I = imread(fn)
-
-    # Convert to a NumPy array as float32
-    img = np.array(I, dtype=np.float32)
+    # Use scikit-image for stacks with pages of different sizes
+    index = read_tiff_index(fn)
+    if (not _uniform_pages(index)):
+        from skimage.io import imread
+        img = np.asarray(imread(fn), dtype=dtype)
+        if (out is not None):
+            np.copyto(out, img, casting='unsafe')
+            img = out
+        return img
 
-    # Garbage collection
-    del I
+    # Allocate the stack and decode the pages into it
+    page = index.pages[0]
+    N = len(index.pages)
+    shape = (N, ) + _page_shape(page)
+    if (out is not None):
+        img = out if (out.ndim == len(shape)) else out[np.newaxis]
+    else:
+        if (dtype is None):
+            if (page['dtype'] == ''):
+                dtype = _read_page_pil(fn, 0).dtype
+            else:
+                dtype = np.dtype(str(page['dtype']))
+        img = np.empty(shape, dtype=dtype)
+    _read_pages(fn, index, img, num_threads=num_threads)
 
     # Return img
+    if (out is not None):
+        return out
+    if (N == 1):
+        img = img[0]
+    return img
+
+
+def _page_shape(page):
+    """ The shape of a page from the TIFF index """
+    if (int(page['samples']) == 1):
+        return (int(page['height']), int(page['width']))
+    return (int(page['height']), int(page['width']), int(page['samples']))
+
+
+def _uniform_pages(index):
+    """ Check that every page has the same shape and data type """
+    pages = index.pages
+    return (len(pages) > 0 and
+            np.all(pages['height'] == pages['height'][0]) and
+            np.all(pages['width'] == pages['width'][0]) and
+            np.all(pages['samples'] == pages['samples'][0]) and
+            np.all(pages['dtype'] == pages['dtype'][0]))
+
+
+def _read_pages(fn, index, out, ind=None, num_threads=4):
+    """ Decode pages of a TIFF file into a preallocated array
+
+    The pages are split between the threads, and each thread opens its own
+    handle to the file. Decompression (zlib and PIL) releases the GIL, so the
+    pages are decoded in parallel.
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename
+    index -- class tiff_index
+        the index of the file
+    out -- NumPy array
+        the array to fill; out[i] receives the i-th requested page
+    ind -- list of integers (optional)
+        the pages to read; all the pages are read if not provided
+    num_threads -- integer (default=4)
+        the number of threads
+
+    Returns
+    -------
+    None
+
+    """
+
+    if (ind is None):
+        ind = range(len(index.pages))
+    ind = list(ind)
+
+    # Define the work for each thread
+    def read_group(group):
+        f = open(fn, 'rb')
+        for i in group:
+            dst = out[i]
+            tmp = _read_page(f, index, ind[i], out=dst)
+            if (tmp is None):
+                tmp = _read_page_pil(fn, ind[i])
+            if (tmp is not dst):
+                dst[...] = tmp
+        f.close()
+
+    # Split the pages between the threads
+    num_threads = max(1, min(num_threads, len(ind)))
+    groups = [range(i, len(ind), num_threads) for i in range(num_threads)]
+    if (num_threads == 1):
+        read_group(groups[0])
+    else:
+        with ThreadPoolExecutor(max_workers=num_threads) as ex:
+            list(ex.map(read_group, groups))
+
+    return
+
+
+def read_tiff_stack_native(fn, flag_memmap=True, num_threads=4):
+    """ Load a TIFF stack in its native data type
+
+    Uncompressed stacks whose pages are each stored in one block, with the
+    same spacing between pages (as written by the detector), are returned as
+    a read-only memory-mapped view of the file without copying any data.
+    Other stacks are decoded in parallel into a preallocated array.
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename
+    flag_memmap -- boolean (default=True)
+        True -- return a memory-mapped view when the layout allows it
+        False -- always read the stack into memory
+    num_threads -- integer (default=4)
+        the number of threads used to decode the pages
+
+    Returns
+    -------
+    img -- NumPy array
+        a 3D array (page, row, column) in the data type of the file
+
+    """
+
+    # Check the pages
+    index = read_tiff_index(fn)
+    if (not _uniform_pages(index)):
+        print('Error: The pages of the TIFF stack have different sizes.')
+        return None
+    pages = index.pages
+    N = len(pages)
+    shape = (N, ) + _page_shape(pages[0])
+    if (pages['dtype'][0] == ''):
+        dtype = _read_page_pil(fn, 0).dtype
+    else:
+        dtype = np.dtype(str(pages['dtype'][0]))
+
+    # Map evenly spaced, uncompressed pages directly
+    offsets = pages['offset']
+    stride = int(offsets[1] - offsets[0]) if (N > 1) else 0
+    if (flag_memmap and np.all(pages['contiguous']) and
+            np.all(np.diff(offsets) == stride)):
+        mm = np.memmap(fn, dtype=np.uint8, mode='r')
+        strides = [dtype.itemsize]
+        for n in shape[:1:-1]:
+            strides.insert(0, strides[0] * n)
+        strides = tuple([stride] + strides)
+        img = np.ndarray(shape, dtype=dtype, buffer=mm,
+                         offset=int(offsets[0]), strides=strides)
+        return img
+
+    # Decode the pages into a new array
+    img = np.empty(shape, dtype=dtype)
+    _read_pages(fn, index, img, num_threads=num_threads)
+
     return img
 
 
@@ -134,26 +610,84 @@ def tiff_stack_size(fn):
 
     """
 
-    # Open the file
-    f = Image.open(fn)
-
     # Determine the number of images in the TIFF stack
-    i = 0
-    f.seek(i)
-    while (True):
-        try:
-            f.seek(i)
-            i += 1
-        except EOFError:
-            break
-
-    # Close the file
-    f.close()
+    i = len(read_tiff_index(fn).pages)
 
     # Return the number of images in the stack
     return i
 
 
+def read_header(fn):
+    """ Read the size, data type, and number of pages of a TIFF file
+
+    Only the image file directories are read, so no pixel data is loaded.
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename
+
+    Returns
+    -------
+    h -- integer
+        the height of each page
+    w -- integer
+        the width of each page
+    N -- integer
+        the number of pages in the TIFF stack
+    dtype -- NumPy dtype
+        the data type of the pixels
+
+    """
+
+    # Get the size and the number of pages from the index
+    index = read_tiff_index(fn)
+    page = index.pages[0]
+    (h, w) = (int(page['height']), int(page['width']))
+    N = len(index.pages)
+    if (page['dtype'] == ''):
+        dtype = _read_page_pil(fn, 0).dtype
+    else:
+        dtype = np.dtype(str(page['dtype']))
+
+    return h, w, N, dtype
+
+
+def scan_headers(path, ext='.tif'):
+    """ Read the headers of all the TIFF files in a folder
+
+    Parameters
+    ----------
+    path -- string or list of strings
+        a string with the folder location of the files or a list of filenames
+    ext -- string (default='.tif')
+        the filename extension of the files
+
+    Returns
+    -------
+    table -- NumPy structured array
+        an array with one record per file with the fields 'fn', 'height',
+        'width', 'pages', and 'dtype'
+
+    """
+
+    # Find the files
+    fn = list_files(path, ext)
+    fnL = max([len(i) for i in fn] + [1])
+    dt = np.dtype([('fn', 'U%d' % (fnL)),
+                   ('height', np.uint32), ('width', np.uint32),
+                   ('pages', np.uint32), ('dtype', 'U8')])
+    table = np.zeros((len(fn), ), dtype=dt)
+
+    # Read the headers
+    for i in range(len(fn)):
+        (h, w, N, dtype) = read_header(fn[i])
+        table[i] = (fn[i], h, w, N, dtype.str)
+
+    # Return the table
+    return table
+
+
 def write_tiff(fn, img):
     """ Write a TIFF file
 
@@ -171,21 +705,298 @@ def write_tiff(fn, img):
     """
 
     # Convert the NumPy array to an Image and then save
+    from PIL import Image
     img_tmp = Image.fromarray(img)
     img_tmp.save(fn)
 
     return
 
 
-def write_tiff_stack_io(fn, img):
+# Layout of the pages written by tiff_writer: each page is an image file
+# directory followed by the pixel data in one strip, and every page takes the
+# same number of bytes, so the pages can be memory-mapped as one array
+_TAG_NEW_SUBFILE = 254
+_TAG_PHOTOMETRIC = 262
+_WRITER_ALIGN = 16
+
+
+def _align(n, size=_WRITER_ALIGN):
+    """ Round n up to a multiple of size """
+    return -(-n // size) * size
+
+
+class tiff_writer:
+    """
+    Write a TIFF (or BigTIFF) stack one page at a time
+
+    Only one page is held in memory at a time. Each page is written as an
+    image file directory followed by its uncompressed pixel data, and the
+    directory of the previous page is then linked to it, so the file is a
+    valid TIFF stack after every page.
+
+    If the number of pages is given, the image file directories of every
+    page are written when the file is created, and the file is extended to
+    its final size. The pages can then be written in any order (and from
+    several threads) with write_page.
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename
+    shape -- tuple of integers
+        the (height, width) of each page
+    dtype -- NumPy dtype (default=np.float32)
+        the data type of the pages
+    N -- integer (optional)
+        the number of pages, to write every image file directory up front
+    bigtiff -- boolean (optional)
+        True -- write a BigTIFF file (64-bit offsets, no 4 GB limit)
+        False -- write a classic TIFF file
+        None -- use BigTIFF if the pages (N must be given) pass 4 GB
+    mode -- string (default='w')
+        'w' -- create a new file
+        'a' -- add pages to the end of an existing file written in the same
+               byte order, page size, and data type
+
+    Example
+    -------
+    writer = tiff_writer('stack.tif', (h, w), np.float32)
+    for i in range(N):
+        writer.append(img[i])
+    writer.close()
+
+    """
+    def __init__(self, fn, shape, dtype=np.float32, N=None, bigtiff=None,
+                 mode='w'):
+        self.fn = fn
+        self.shape = (int(shape[0]), int(shape[1]))
+        self.dtype = np.dtype(dtype).newbyteorder('<')
+        if (self.dtype.kind not in 'uif'):
+            raise ValueError('TIFF pages of type %s cannot be written.' %
+                             (self.dtype))
+        self.N = N
+        self._lock = threading.Lock()
+        page_bytes = self.shape[0] * self.shape[1] * self.dtype.itemsize
+
+        # Open the file
+        if (mode == 'a' and os.path.isfile(fn) and os.path.getsize(fn) > 0):
+            self._open_append()
+        elif (mode in ('w', 'a')):
+            if (bigtiff is None):
+                bigtiff = (N is not None and
+                           _WRITER_ALIGN + N * (page_bytes + 512) >= 2**32)
+            self.bigtiff = bool(bigtiff)
+            self.f = open(fn, 'w+b')
+            if (self.bigtiff):
+                hdr = b'II' + np.array([43, 8, 0], '<u2').tobytes()
+                hdr += np.array([0], '<u8').tobytes()
+            else:
+                hdr = b'II' + np.array([42], '<u2').tobytes()
+                hdr += np.array([0], '<u4').tobytes()
+            self.f.write(hdr.ljust(_WRITER_ALIGN, b'\x00'))
+            self._next_ptr = 8 if (self.bigtiff) else 4
+            self.count = 0
+        else:
+            raise ValueError('The mode must be \'w\' or \'a\'.')
+
+        # Size of each page
+        if (self.bigtiff):
+            self._ifd_size = 8 + 12 * 20 + 8
+        else:
+            self._ifd_size = 2 + 12 * 12 + 4
+        self._page_bytes = page_bytes
+        self._stride = (_align(self._ifd_size) + _align(page_bytes))
+        self._start = _align(self.f.seek(0, 2))
+
+        # Write every image file directory up front
+        if (N is not None):
+            self._check_size(self._start + N * self._stride)
+            self.f.truncate(self._start + N * self._stride)
+            for i in range(N):
+                self._write_ifd(i, flag_last=(i == N - 1))
+            self._link(self._start)
+            self._next_ptr = (self._start + (N - 1) * self._stride +
+                              self._ifd_size - (8 if (self.bigtiff) else 4))
+            self.f.flush()
+
+    def _open_append(self):
+        """ Open an existing file to add pages to the end of it """
+        index = read_tiff_index(self.fn)
+        if (index.byteorder != '<'):
+            raise ValueError('Only little-endian TIFF files can be appended.')
+        last = index.pages[-1]
+        if ((int(last['height']), int(last['width'])) != self.shape or
+                int(last['samples']) != 1 or
+                np.dtype(str(last['dtype'])) != self.dtype):
+            raise ValueError('The pages of %s have a different size or data '
+                             'type.' % (self.fn))
+        self.bigtiff = bool(index.bigtiff)
+        self.count = 0
+        self.f = open(self.fn, 'r+b')
+
+        # Find the pointer to the next directory in the last directory
+        ifd = int(last['ifd'])
+        self.f.seek(ifd)
+        if (self.bigtiff):
+            cnt = int(np.frombuffer(self.f.read(8), '<u8')[0])
+            self._next_ptr = ifd + 8 + 20 * cnt
+        else:
+            cnt = int(np.frombuffer(self.f.read(2), '<u2')[0])
+            self._next_ptr = ifd + 2 + 12 * cnt
+
+    def _check_size(self, size):
+        """ Check that the file size fits the offsets of the format """
+        if (not self.bigtiff and size >= 2**32):
+            raise ValueError('The TIFF stack is larger than 4 GB, so it '
+                             'must be written with bigtiff=True.')
+
+    def _write_ifd(self, i, flag_last=True):
+        """ Write the image file directory of page i (counted from the first
+        page written by this writer) """
+        pos = self._start + i * self._stride
+        data = pos + _align(self._ifd_size)
+        (h, w) = self.shape
+        fmt = {'u': 1, 'i': 2, 'f': 3}[self.dtype.kind]
+        (LONG, OFFSET) = (4, 16 if (self.bigtiff) else 4)
+        tags = [(_TAG_NEW_SUBFILE, LONG, 0), (_TAG_WIDTH, LONG, w),
+                (_TAG_HEIGHT, LONG, h),
+                (_TAG_BITS, 3, 8 * self.dtype.itemsize),
+                (_TAG_COMPRESSION, 3, _COMPRESSION_NONE),
+                (_TAG_PHOTOMETRIC, 3, 1), (_TAG_STRIP_OFFSETS, OFFSET, data),
+                (_TAG_SAMPLES, 3, 1), (_TAG_ROWS_PER_STRIP, LONG, h),
+                (_TAG_STRIP_COUNTS, OFFSET, self._page_bytes),
+                (_TAG_PLANAR, 3, 1), (_TAG_SAMPLE_FORMAT, 3, fmt)]
+        next_ifd = 0 if (flag_last) else pos + self._stride
+
+        # Pack the entries (every value fits in its entry)
+        if (self.bigtiff):
+            entry = np.dtype([('tag', '<u2'), ('type', '<u2'),
+                              ('count', '<u8'), ('value', '<u8')])
+            (cnt_t, ptr_t) = ('<u8', '<u8')
+        else:
+            entry = np.dtype([('tag', '<u2'), ('type', '<u2'),
+                              ('count', '<u4'), ('value', '<u4')])
+            (cnt_t, ptr_t) = ('<u2', '<u4')
+        entries = np.zeros((len(tags), ), dtype=entry)
+        for k in range(len(tags)):
+            (tag, typ, val) = tags[k]
+            entries[k]['tag'] = tag
+            entries[k]['type'] = typ
+            entries[k]['count'] = 1
+            entries[k]['value'] = val
+        buf = (np.array([len(tags)], cnt_t).tobytes() + entries.tobytes() +
+               np.array([next_ifd], ptr_t).tobytes())
+        self.f.seek(pos)
+        self.f.write(buf)
+
+    def _link(self, pos):
+        """ Point the last written directory (or the header) to pos """
+        self.f.seek(self._next_ptr)
+        ptr_t = '<u8' if (self.bigtiff) else '<u4'
+        self.f.write(np.array([pos], ptr_t).tobytes())
+
+    def _page_data(self, img):
+        """ Check a page and return its bytes """
+        img = np.asarray(img)
+        if (img.shape != self.shape):
+            raise ValueError('The page has shape %s instead of %s.' %
+                             (img.shape, self.shape))
+        return np.ascontiguousarray(img, dtype=self.dtype)
+
+    def append(self, img):
+        """ Write the next page
+
+        Parameters
+        ----------
+        img -- NumPy array
+            the page (height, width); it is converted to the data type of
+            the stack
+
+        Returns
+        -------
+        None
+
+        """
+        if (self.N is not None):
+            if (self.count >= self.N):
+                raise ValueError('All %d pages have been written.' %
+                                 (self.N))
+            self.write_page(self.count, img)
+            self.count += 1
+            return
+
+        # Write the directory and the data, then link the previous page
+        img = self._page_data(img)
+        with self._lock:
+            pos = self._start + self.count * self._stride
+            self._check_size(pos + self._stride)
+            self._write_ifd(self.count)
+            self.f.seek(pos + _align(self._ifd_size))
+            self.f.write(img.tobytes())
+            self.f.write(b'\x00' * (_align(self._page_bytes) -
+                                    self._page_bytes))
+            self.f.flush()
+            self._link(pos)
+            self._next_ptr = pos + self._ifd_size - (8 if (self.bigtiff)
+                                                     else 4)
+            self.count += 1
+
+    def write_page(self, ind, img):
+        """ Write page ind of a stack created with N pages
+
+        Each call uses its own handle to the file, so pages can be written
+        from several threads at once.
+
+        Parameters
+        ----------
+        ind -- integer
+            the page to write (counted from the first page written by this
+            writer)
+        img -- NumPy array
+            the page (height, width)
+
+        Returns
+        -------
+        None
+
+        """
+        if (self.N is None):
+            raise ValueError('write_page needs the number of pages (N).')
+        if (ind < 0 or ind >= self.N):
+            raise IndexError('Page %d is outside the %d pages.' %
+                             (ind, self.N))
+        img = self._page_data(img)
+        f = open(self.fn, 'r+b')
+        f.seek(self._start + ind * self._stride + _align(self._ifd_size))
+        f.write(img.tobytes())
+        f.close()
+
+    def close(self):
+        """ Finish writing the file """
+        if (self.f is not None):
+            self.f.close()
+            self.f = None
+
+
+def write_tiff_stack_io(fn, img, bigtiff=None, num_threads=4):
     """ Write a TIFF stack
 
+    The pages are converted to float32 and written one at a time, so only one
+    page is copied at a time. Stacks larger than 4 GB are written as BigTIFF
+    files.
+
     Parameters
     ----------
     fn -- string
         a string with the filename
     img -- NumPy array
-        a NumPy array of the image
+        a NumPy array of the image or image stack (or a lazy_stack)
+    bigtiff -- boolean (optional)
+        True -- always write a BigTIFF file
+        False -- always write a classic TIFF file
+        None -- write a BigTIFF file only if the stack passes 4 GB
+    num_threads -- integer (default=4)
+        the number of threads writing the pages
 
     Returns
     -------
@@ -193,11 +1004,22 @@ def write_tiff_stack_io(fn, img):
 
     """
 
-    # Ensure the image stack is float32
-    img = np.array(img, dtype=np.float32)
+    # Find the size of the stack
+    if (np.ndim(img) == 2):
+        img = np.asarray(img)[np.newaxis]
+    N = len(img)
+    shape = img.shape[1:]
 
-    # Write the imag
-    imsave(fn, img)
+    # Write the pages
+    writer = tiff_writer(fn, shape, np.float32, N=N, bigtiff=bigtiff)
+    num_threads = max(1, min(num_threads, N))
+    if (num_threads == 1):
+        for i in range(N):
+            writer.write_page(i, img[i])
+    else:
+        with ThreadPoolExecutor(max_workers=num_threads) as ex:
+            list(ex.map(lambda i: writer.write_page(i, img[i]), range(N)))
+    writer.close()
 
     # Return
-    return
\ No newline at end of file
+    return
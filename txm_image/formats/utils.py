@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module holds helper functions shared by the different file formats.
+
+Started: 2026-10-18
+Last modified: 2026-10-18
+"""
+
+
+import os
+import numpy as np
+
+
+def list_files(path, ext):
+    """ Find the files in a folder with a given extension
+
+    Parameters
+    ----------
+    path -- string or list of strings
+        a string with the folder location of the files, or a list with the
+        filenames (which is returned unchanged)
+    ext -- string
+        the filename extension to look for (the case is ignored)
+
+    Returns
+    -------
+    fn -- list of strings
+        a sorted list with the full path of each file
+
+    """
+
+    # A list of files was provided
+    if (not isinstance(path, str)):
+        return list(path)
+
+    # Find the files with the extension
+    ext = ext.lower()
+    fn = [os.path.join(path, i) for i in os.listdir(path)
+          if i.lower().endswith(ext)]
+    fn.sort()
+
+    # Return the list of files
+    return fn
+
+
+def read_array(f, offset, shape, file_dtype, order='C', dtype=None,
+               out=None):
+    """ Read an array stored as a single block in a file
+
+    Parameters
+    ----------
+    f -- file object
+        the file opened in binary mode
+    offset -- integer
+        the byte offset of the array in the file
+    shape -- tuple of integers
+        the shape of the array
+    file_dtype -- NumPy dtype
+        the data type of the array in the file
+    order -- string (default='C')
+        the order of the array in the file ('C' or 'F')
+    dtype -- NumPy dtype (optional)
+        the data type of the returned array; the data type of the file is
+        kept if not provided
+    out -- NumPy array (optional)
+        an array to read the data into (its data type is used instead of
+        dtype); when it has the layout and data type of the file the data is
+        read straight into it, otherwise it is copied from a memory map so no
+        temporary array is created
+
+    Returns
+    -------
+    img -- NumPy array
+        the array (out, if provided)
+
+    """
+
+    file_dtype = np.dtype(file_dtype)
+    count = 1
+    for n in shape:
+        count *= n
+
+    # Read into a new array
+    if (out is None):
+        f.seek(offset)
+        img = np.fromfile(f, dtype=file_dtype, count=count)
+        img = np.reshape(img, shape, order=order)
+        if (dtype is not None and img.dtype != np.dtype(dtype)):
+            img = img.astype(dtype)
+        return img
+
+    # Read straight into the buffer when the layouts match
+    if (out.shape != tuple(shape)):
+        raise ValueError('The output array has the wrong shape.')
+    if (order == 'F'):
+        tmp = out.T
+    else:
+        tmp = out
+    if (out.dtype == file_dtype and tmp.flags.c_contiguous):
+        f.seek(offset)
+        f.readinto(tmp)
+        return out
+
+    # Otherwise copy (and convert) from a memory map of the file
+    mm = np.memmap(f, dtype=file_dtype, mode='r', offset=offset,
+                   shape=tuple(shape), order=order)
+    np.copyto(out, mm, casting='unsafe')
+    del mm
+
+    return out
+
+
+def roi_range(roi, n):
+    """ The first and last (exclusive) index of a region of interest
+
+    Parameters
+    ----------
+    roi -- tuple of integers or slice (optional)
+        the (start, stop) of the region, or a slice with a step of 1; the
+        whole axis is used if not provided
+    n -- integer
+        the length of the axis
+
+    Returns
+    -------
+    a -- integer
+        the first index
+    b -- integer
+        the last index (exclusive)
+
+    """
+
+    if (roi is None):
+        return 0, n
+    if (not isinstance(roi, slice)):
+        roi = slice(*roi)
+    (a, b, step) = roi.indices(n)
+    if (step != 1):
+        raise ValueError('A region of interest must have a step of 1.')
+    return a, max(a, b)
+
+
+def read_array_roi(f, offset, shape, file_dtype, order='C', rows=None,
+                   cols=None, dtype=None, out=None):
+    """ Read part of a 2D array stored as a single block in a file
+
+    Only the lines of the slow axis (the rows of a C-ordered array or the
+    columns of a Fortran-ordered array) in the region are read, and the
+    region of each line is taken from a memory map, so the amount read is in
+    proportion to the region and not to the whole array.
+
+    Parameters
+    ----------
+    f -- file object
+        the file opened in binary mode
+    offset -- integer
+        the byte offset of the array in the file
+    shape -- tuple of integers
+        the (height, width) of the whole array
+    file_dtype -- NumPy dtype
+        the data type of the array in the file
+    order -- string (default='C')
+        the order of the array in the file ('C' or 'F')
+    rows, cols -- tuple of integers or slice (optional)
+        the (start, stop) of the rows and columns to read (see roi_range)
+    dtype -- NumPy dtype (optional)
+        the data type of the returned array; the data type of the file is
+        kept if not provided
+    out -- NumPy array (optional)
+        an array with the shape of the region to read the data into
+
+    Returns
+    -------
+    img -- NumPy array
+        the region of the array (out, if provided)
+
+    """
+
+    file_dtype = np.dtype(file_dtype)
+    (h, w) = shape
+    (r0, r1) = roi_range(rows, h)
+    (c0, c1) = roi_range(cols, w)
+
+    # Find the lines of the slow axis in the region
+    if (order == 'F'):
+        (outer, inner, size) = ((c0, c1), (r0, r1), h)
+    else:
+        (outer, inner, size) = ((r0, r1), (c0, c1), w)
+    offset += outer[0] * size * file_dtype.itemsize
+    block = (outer[1] - outer[0], size)
+
+    # Whole lines are one contiguous block
+    roi_shape = (r1 - r0, c1 - c0)
+    if (inner == (0, size) or roi_shape[0] * roi_shape[1] == 0):
+        return read_array(f, offset, roi_shape, file_dtype, order=order,
+                          dtype=dtype, out=out)
+
+    # Otherwise take the region of each line from a memory map
+    mm = np.memmap(f, dtype=file_dtype, mode='r', offset=offset, shape=block)
+    tmp = mm[:, inner[0]:inner[1]]
+    if (order == 'F'):
+        tmp = tmp.T
+    if (out is None):
+        out = np.empty(roi_shape, dtype=file_dtype if (dtype is None) else
+                       dtype)
+    np.copyto(out, tmp, casting='unsafe')
+    del mm, tmp
+
+    return out
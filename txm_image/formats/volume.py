@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+"""
+This module will write and read reconstructed volumes as a raw data file with
+a MetaImage (MHD) header, which can be opened by standard volume tools such
+as ITK, 3D Slicer, ParaView, and Fiji.
+
+The raw file is allocated at its full size when the volume is created, so the
+slices can be written in any order and from several threads or processes at
+the same time. Reading part of a volume uses a memory map, so only the bytes
+that are needed are read from disk.
+
+Started: 2026-10-18
+Last modified: 2026-10-18
+"""
+
+
+import os
+import numpy as np
+
+
+# Map the NumPy data types to the MetaImage element types
+_MET_TYPES = {'uint8': 'MET_UCHAR', 'int8': 'MET_CHAR',
+              'uint16': 'MET_USHORT', 'int16': 'MET_SHORT',
+              'uint32': 'MET_UINT', 'int32': 'MET_INT',
+              'float32': 'MET_FLOAT', 'float64': 'MET_DOUBLE'}
+
+
+def read_mhd(fn):
+    """ Read a MetaImage header
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename of the header (*.mhd)
+
+    Returns
+    -------
+    hdr -- dictionary
+        the header entries as strings, along with 'shape' (slice, row,
+        column), 'dtype', and 'fn_raw' (the full path of the raw data file)
+
+    """
+
+    # Read the header entries
+    hdr = {}
+    f = open(fn, 'r')
+    for line in f:
+        if ('=' in line):
+            (key, val) = line.split('=', 1)
+            hdr[key.strip()] = val.strip()
+    f.close()
+
+    # Convert the entries used to read the data
+    dims = [int(i) for i in hdr['DimSize'].split()]
+    hdr['shape'] = tuple(dims[::-1])
+    met_types = dict([(v, k) for (k, v) in _MET_TYPES.items()])
+    hdr['dtype'] = np.dtype(met_types[hdr['ElementType']])
+    if (hdr.get('BinaryDataByteOrderMSB', 'False') == 'True'):
+        hdr['dtype'] = hdr['dtype'].newbyteorder('>')
+    hdr['fn_raw'] = os.path.join(os.path.dirname(fn),
+                                 hdr['ElementDataFile'])
+
+    return hdr
+
+
+def create_volume(fn, shape, dtype=np.float32, px=1.0):
+    """ Create an empty volume
+
+    A MetaImage header (*.mhd) and a raw data file (*.raw) with the full
+    size of the volume are created.
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename of the header (*.mhd)
+    shape -- tuple of integers
+        the shape of the volume (slice, row, column)
+    dtype -- NumPy dtype (default=np.float32)
+        the data type of the volume
+    px -- float (default=1.0)
+        the voxel size
+
+    Returns
+    -------
+    None
+
+    """
+
+    # Name the raw file after the header
+    fn_raw = os.path.splitext(fn)[0] + '.raw'
+    dtype = np.dtype(dtype)
+
+    # Write the header
+    f = open(fn, 'w')
+    f.write('ObjectType = Image\n')
+    f.write('NDims = 3\n')
+    f.write('BinaryData = True\n')
+    f.write('BinaryDataByteOrderMSB = False\n')
+    f.write('CompressedData = False\n')
+    f.write('DimSize = %d %d %d\n' % (shape[2], shape[1], shape[0]))
+    f.write('ElementSpacing = %g %g %g\n' % (px, px, px))
+    f.write('ElementType = %s\n' % (_MET_TYPES[dtype.name]))
+    f.write('ElementDataFile = %s\n' % (os.path.basename(fn_raw)))
+    f.close()
+
+    # Allocate the raw file
+    f = open(fn_raw, 'wb')
+    f.truncate(shape[0] * shape[1] * shape[2] * dtype.itemsize)
+    f.close()
+
+    return
+
+
+def open_volume(fn, mode='r'):
+    """ Memory map a volume
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename of the header (*.mhd)
+    mode -- string (default='r')
+        the memory map mode ('r' for read-only, 'r+' to write slices)
+
+    Returns
+    -------
+    vol -- NumPy memmap
+        the volume with the shape (slice, row, column)
+
+    """
+
+    hdr = read_mhd(fn)
+    vol = np.memmap(hdr['fn_raw'], dtype=hdr['dtype'], mode=mode,
+                    shape=hdr['shape'])
+
+    return vol
+
+
+def write_volume_slice(fn, ind, img):
+    """ Write a slice into an existing volume
+
+    Each call opens its own handle to the raw file and only writes the bytes
+    of the slice, so slices can be written in any order and from several
+    threads or processes at the same time.
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename of the header (*.mhd)
+    ind -- integer
+        the index of the slice (ValueError is raised if it is outside the
+        volume, or if the slice does not have the size of the volume)
+    img -- NumPy array
+        a 2D array with the slice
+
+    Returns
+    -------
+    None
+
+    """
+
+    # Find the location of the slice
+    hdr = read_mhd(fn)
+    (N, h, w) = hdr['shape']
+    if (img.shape != (h, w)):
+        raise ValueError('The slice size %s does not match the volume %s.' %
+                         (str(img.shape), str((h, w))))
+    if (ind < 0 or ind >= N):
+        raise ValueError('The slice index %d is outside the volume of %d '
+                         'slices.' % (ind, N))
+    tmp = np.ascontiguousarray(img, dtype=hdr['dtype'])
+
+    # Write the slice
+    f = open(hdr['fn_raw'], 'r+b')
+    f.seek(ind * tmp.nbytes)
+    tmp.tofile(f)
+    f.close()
+
+    return
+
+
+def write_volume(fn, vol, px=1.0):
+    """ Write a volume
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename of the header (*.mhd)
+    vol -- NumPy array
+        a 3D array with the shape (slice, row, column)
+    px -- float (default=1.0)
+        the voxel size
+
+    Returns
+    -------
+    None
+
+    """
+
+    # Create the files and write the data
+    create_volume(fn, vol.shape, dtype=vol.dtype, px=px)
+    hdr = read_mhd(fn)
+    f = open(hdr['fn_raw'], 'r+b')
+    np.ascontiguousarray(vol).tofile(f)
+    f.close()
+
+    return
+
+
+def read_volume(fn, slices=None, rows=None, cols=None):
+    """ Read a volume or a part of a volume
+
+    Parameters
+    ----------
+    fn -- string
+        a string with the filename of the header (*.mhd)
+    slices, rows, cols -- slice (optional)
+        the part of the volume to read along each axis; the whole axis is
+        read if not provided
+
+    Returns
+    -------
+    vol -- NumPy array
+        the requested part of the volume
+    hdr -- dictionary
+        the header entries from read_mhd
+
+    """
+
+    # Memory map the volume and copy the requested part
+    hdr = read_mhd(fn)
+    vol = np.memmap(hdr['fn_raw'], dtype=hdr['dtype'], mode='r',
+                    shape=hdr['shape'])
+    key = tuple([slice(None) if (i is None) else i
+                 for i in (slices, rows, cols)])
+    tmp = np.array(vol[key])
+    del vol
+
+    return tmp, hdr
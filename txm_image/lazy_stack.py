@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+
+"""
+Lazy Stack
+
+This class will present the projections in a folder (or a list of files) as
+a single 3D array (projection, row, column) without loading them. Only the
+pages that are indexed are read, and the pages that have been read are kept
+in a cache with a size limit in bytes, so a processing stage can be written
+once and run either on a stack in memory or on a stack on disk.
+
+Started: 2026-10-18
+Last modified: 2026-10-18
+
+"""
+
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from txm_image.formats import registry
+from txm_image.formats.utils import list_files
+
+
+class lazy_stack:
+    """
+    Index the projections on disk like a 3D array
+
+    Parameters
+    ----------
+    path -- string or list of strings
+        a string with the folder location of the files or a list of filenames
+    ext -- string (default='.bim')
+        the filename extension of the files (used for a folder)
+    cache_size -- integer (default=256 * 1024**2)
+        the largest number of bytes of pages kept in the cache (0 turns the
+        cache off)
+    dtype -- NumPy dtype (default=np.float32)
+        the data type of the returned images
+    num_threads -- integer (default=4)
+        the number of threads reading pages that are not in the cache
+
+    Every file can hold one page (BIM, binprj, ...) or several pages (TIFF
+    stacks and BIMSTACK files), and every page must have the same size.
+
+    Example
+    -------
+    stack = lazy_stack('C:\\scan\\bim\\', '.bim', cache_size=2 * 1024**3)
+    img = stack[0]
+    sino = stack[:, 512, :]
+    roi = stack[::10, 100:200, 300:400]
+
+    """
+    def __init__(self, path, ext='.bim', cache_size=256 * 1024**2,
+                 dtype=np.float32, num_threads=4):
+        self.fn = list_files(path, ext)
+        self.dtype = np.dtype(dtype)
+        self.cache_size = cache_size
+        self.num_threads = num_threads
+        self._cache = collections.OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+
+        # Find the pages in each file
+        self._formats = [registry.find_format(i) for i in self.fn]
+        pages = []
+        for i in range(len(self.fn)):
+            N = self._num_pages(i)
+            pages += [(i, k) for k in range(N)]
+        self._pages = pages
+
+        # Find the size of the pages
+        if (len(pages) == 0):
+            self.shape = (0, 0, 0)
+        else:
+            self.shape = (len(pages), ) + self._read_page(0).shape
+
+    def _num_pages(self, i):
+        """ The number of pages in file i """
+        name = self._formats[i].name if (self._formats[i]) else None
+        if (name == 'TIFF'):
+            from txm_image.formats import tiff
+            return len(tiff.read_tiff_index(self.fn[i]).pages)
+        elif (name == 'BIMSTACK'):
+            from txm_image.formats import bimstack
+            return len(bimstack.read_header(self.fn[i]))
+        return 1
+
+    def _open_page(self, ind, rows=None):
+        """ Return page ind (or a band of its rows, for TIFF files) as an
+        array or as a memory-mapped view """
+        (i, k) = self._pages[ind]
+        fmt = self._formats[i]
+        if (fmt is None):
+            raise ValueError('The image format of %s was not found.' %
+                             (self.fn[i]))
+        if (fmt.name == 'TIFF'):
+            from txm_image.formats import tiff
+            return tiff.read_tiff(self.fn[i], k, dtype=self.dtype, rows=rows)
+        elif (fmt.name == 'BIMSTACK'):
+            from txm_image.formats import bimstack
+            return bimstack.read_bimstack(self.fn[i], k, flag_memmap=True)[0]
+        return fmt.read(self.fn[i], flag_memmap=True)[0]
+
+    def _read_page(self, ind, key=None):
+        """ Read page ind (or the part of it selected by key) """
+        # Look in the cache
+        with self._lock:
+            img = self._cache.get(ind)
+            if (img is not None):
+                self._cache.move_to_end(ind)
+        if (img is not None):
+            return img if (key is None) else img[key]
+
+        # Without a cache, read only the requested rows of a TIFF page
+        (i, _) = self._pages[ind]
+        name = self._formats[i].name if (self._formats[i]) else None
+        if (self.cache_size == 0 and key is not None and name == 'TIFF' and
+                isinstance(key[0], slice) and key[0].step in (None, 1)):
+            img = self._open_page(ind, rows=key[0])
+            return np.asarray(img[(slice(None), ) + tuple(key[1:])],
+                              dtype=self.dtype)
+
+        # Read only the requested part of a memory-mapped page, since the
+        # rest of the page is not needed
+        img = self._open_page(ind)
+        if (isinstance(img, np.memmap)):
+            if (key is not None):
+                return np.array(img[key], dtype=self.dtype)
+            img = np.array(img, dtype=self.dtype)
+
+        # Add the page to the cache
+        img = np.asarray(img, dtype=self.dtype)
+        if (img.nbytes <= self.cache_size):
+            with self._lock:
+                if (ind not in self._cache):
+                    self._cache[ind] = img
+                    self._cache_bytes += img.nbytes
+                while (self._cache_bytes > self.cache_size):
+                    (_, tmp) = self._cache.popitem(last=False)
+                    self._cache_bytes -= tmp.nbytes
+        return img if (key is None) else img[key]
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def ndim(self):
+        return 3
+
+    def __getitem__(self, key):
+        """ Read the pages, rows and columns selected by key """
+        # Split the key into the pages and the rest
+        if (not isinstance(key, tuple)):
+            key = (key, )
+        ind = np.arange(self.shape[0])[key[0]]
+        rest = key[1:]
+        single = (np.ndim(ind) == 0)
+        ind = np.atleast_1d(ind)
+
+        # Find the shape of the selected part of each page
+        if (len(rest) == 0):
+            page_key = None
+            page_shape = self.shape[1:]
+        else:
+            page_key = rest
+            page_shape = np.broadcast_to(np.zeros((), dtype=bool),
+                                         self.shape[1:])[rest].shape
+        img = np.empty((len(ind), ) + page_shape, dtype=self.dtype)
+
+        # Read the pages
+        def read(k):
+            img[k] = self._read_page(ind[k], page_key)
+        if (self.num_threads > 1 and len(ind) > 1):
+            with ThreadPoolExecutor(max_workers=self.num_threads) as ex:
+                list(ex.map(read, range(len(ind))))
+        else:
+            for k in range(len(ind)):
+                read(k)
+
+        if (single):
+            return img[0]
+        return img
+
+    def __array__(self, dtype=None, copy=None):
+        img = self[:]
+        if (dtype is not None):
+            img = img.astype(dtype)
+        return img
+
+    def clear_cache(self):
+        """ Remove every page from the cache """
+        with self._lock:
+            self._cache.clear()
+            self._cache_bytes = 0
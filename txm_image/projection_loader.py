@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+"""
+Projection Loader
+
+This function will load all the projection TIFF files of a scan into a
+single array. The size of the stack is found from the TIFF page indexes, so
+the array is allocated once and the pages are decoded straight into it by
+several threads.
+
+Started: 2026-10-18
+Last modified: 2026-10-18
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from txm_image.formats import tiff
+
+
+def load_projections(scanlog, fn, num_threads=4, dtype=np.float32,
+                     verbose=False):
+    """
+    Load the projection images of a scan into one preallocated array
+
+    Parameters
+    ----------
+    scanlog -- class scanlog
+        a scanlog class already loaded into memory
+    fn -- list of strings
+        the full path of each projection TIFF file, in order
+    num_threads -- integer (default=4)
+        the number of threads reading the files
+    dtype -- NumPy dtype (default=np.float32)
+        the data type of the returned stack
+    verbose -- boolean (default=False)
+        a flag for extra output to the console
+
+    Returns
+    -------
+    img -- NumPy array
+        a 3D array where the first dimension is the index of each image
+
+    """
+
+    # Find the pages in each file
+    N_scan = scanlog.num_proj * scanlog.num_mos * scanlog.num_exp
+    index = [tiff.read_tiff_index(fn[0])]
+    if (len(index[0].pages) != N_scan):
+        index += [tiff.read_tiff_index(i) for i in fn[1:]]
+    N = [len(i.pages) for i in index]
+    N_total = sum(N)
+    if (verbose or N_total != N_scan):
+        print('Found %d images (%d expected from the scanlog).' %
+              (N_total, N_scan))
+
+    # Allocate the stack
+    page = index[0].pages[0]
+    img = np.empty((N_total, int(page['height']), int(page['width'])),
+                   dtype=dtype)
+
+    # Split the pages into blocks for the threads
+    blocks = []
+    start = 0
+    step = max(1, -(-N_total // (4 * max(num_threads, 1))))
+    for i in range(len(index)):
+        for a in range(0, N[i], step):
+            b = min(a + step, N[i])
+            blocks.append((i, a, b, start + a))
+        start += N[i]
+
+    # Define the work for each block
+    def read_block(block):
+        (i, a, b, k) = block
+        tiff._read_pages(index[i].fn, index[i], img[k:k+b-a],
+                         ind=range(a, b), num_threads=1)
+
+    # Read the blocks
+    if (num_threads > 1):
+        with ThreadPoolExecutor(max_workers=num_threads) as ex:
+            list(ex.map(read_block, blocks))
+    else:
+        for block in blocks:
+            read_block(block)
+
+    # Return the stack
+    return img
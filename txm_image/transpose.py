@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+"""
+Transpose
+
+This function will turn a set of projections into sinograms without loading
+all the projections into memory. The projections are read in bands of
+detector rows that fit in a memory budget, and each band is transposed and
+written to the sinogram file before the next band is read. The next band is
+read while the current band is written.
+
+A band of rows is a single contiguous block of a BINSINOVOL file (row,
+angle, column), so each band is written with one sequential write.
+
+Started: 2026-10-18
+Last modified: 2026-10-18
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from txm_image.formats import binsino
+from txm_image.formats import precision
+from txm_image.lazy_stack import lazy_stack
+
+
+def _band_rows(N, row, col, memory):
+    """ The number of detector rows in each band
+
+    Four bands must fit in the memory budget: the rows being written, their
+    encoded copy, and the next band as it is read and transposed.
+    """
+    return int(max(1, min(row, memory // (4 * 4 * N * col))))
+
+
+def projections_to_sinograms(fn, fn_out, th, memory=4 * 1024**3, shift=0,
+                             func=None, storage=None, scale=None,
+                             offset=None, num_threads=4, verbose=False):
+    """
+    Write the sinograms of a set of projections, one band of rows at a time
+
+    Parameters
+    ----------
+    fn -- list of strings or class lazy_stack
+        the projection files (in the order of the angles), or a lazy_stack
+        of the projections
+    fn_out -- string
+        the BINSINOVOL file to write, or a format string for a BINSINO file
+        for each row (such as 'sinos/_%06d.binsino', filled in with the row
+        number starting at 1)
+    th -- NumPy array
+        the angle of each projection
+    memory -- integer (default=4 * 1024**3)
+        the memory budget in bytes
+    shift -- integer (default=0)
+        the number of blank columns added to center the rotation axis (on
+        the left of the projections if positive, on the right if negative)
+    func -- function (optional)
+        a function applied to each sinogram (angle, column), such as a ring
+        removal filter; it must return an array with the same shape
+    storage -- string (optional)
+        a reduced precision storage mode of the BINSINOVOL file ('float16'
+        or 'uint16')
+    scale, offset -- float (optional)
+        the scale and offset of 'uint16' values (required for 'uint16',
+        since the projections are never all in memory to find their range)
+    num_threads -- integer (default=4)
+        the number of threads reading the projections
+    verbose -- boolean (default=False)
+        a flag for extra output to the console
+
+    Returns
+    -------
+    None
+
+    """
+
+    # Check the storage before anything is read or written
+    flag_vol = ('%' not in fn_out)
+    if (flag_vol and storage == 'uint16' and
+            (scale is None or offset is None)):
+        raise ValueError('The scale and offset are needed for uint16.')
+
+    # Open the projections
+    if (isinstance(fn, lazy_stack)):
+        stack = fn
+    else:
+        stack = lazy_stack(fn, cache_size=0, num_threads=num_threads)
+    (N, row, col) = stack.shape
+    cols = col + abs(shift)
+
+    # Find the size of the bands
+    band = _band_rows(N, row, cols, memory)
+    bands = [(a, min(a + band, row)) for a in range(0, row, band)]
+    if (verbose):
+        print('Transposing %d rows in %d bands of %d rows.' %
+              (row, len(bands), band))
+
+    # Create the sinogram file
+    if (flag_vol):
+        if (storage != 'uint16'):
+            (scale, offset) = (1.0, 0.0)
+        binsino.create_binsinovol(fn_out, row, cols, th, storage=storage,
+                                  scale=scale, offset=offset)
+        (vol, _) = binsino.open_binsinovol(fn_out, mode='r+')
+
+    # Read a band of rows and transpose it to (row, angle, column)
+    def read_band(a, b):
+        tmp = stack[:, a:b, :]
+        sino = np.zeros((b - a, N, cols), dtype=np.float32)
+        if (shift >= 0):
+            sino[:, :, shift:] = tmp.transpose(1, 0, 2)
+        else:
+            sino[:, :, :col] = tmp.transpose(1, 0, 2)
+        return sino
+
+    # Read the next band while the current band is written
+    # (the pending read is finished before an error is raised)
+    with ThreadPoolExecutor(max_workers=1) as ex:
+        job = ex.submit(read_band, *bands[0])
+        for i in range(len(bands)):
+            (a, b) = bands[i]
+            sino = job.result()
+            if (i + 1 < len(bands)):
+                job = ex.submit(read_band, *bands[i + 1])
+            if (verbose):
+                print('Writing rows %d-%d of %d...' % (a + 1, b, row))
+
+            # Filter each sinogram
+            if (func is not None):
+                for k in range(b - a):
+                    sino[k] = func(sino[k])
+
+            # Write the band
+            if (flag_vol):
+                if (storage is None):
+                    vol[a:b] = sino
+                else:
+                    vol[a:b] = precision.encode(sino, storage, scale, offset)
+            else:
+                for k in range(b - a):
+                    binsino.write_binsino(fn_out % (a + k + 1), sino[k].T, th)
+            del sino
+
+    # Finish the file
+    if (flag_vol):
+        vol.flush()
+        del vol
+
+    return